@@ -0,0 +1,119 @@
+"""
+Record agent calls to a file and replay them later, so the post pipeline can run without an LLM server.
+"""
+
+from collections import defaultdict
+from json import dumps, loads
+from logging import getLogger
+from os import path
+from threading import Lock
+from typing import Any, Callable, Dict, List, Tuple
+
+logger = getLogger(__name__)
+
+
+class LlmRecorder:
+    """
+    Make the real agent calls and append each result to a JSON lines file.
+    """
+
+    def __init__(self, file: str):
+        self.file = file
+        self.lock = Lock()
+        self.calls = 0
+
+    def __call__(self, agent, prompt: str, context: dict, call: Callable[[], Any]):
+        result = call()
+        record = {
+            "agent": agent.name,
+            "key": agent.call_key(prompt, context),
+            "prompt": prompt,
+            "result": result,
+        }
+
+        with self.lock:
+            with open(self.file, "a") as f:
+                f.write(dumps(record, default=str) + "\n")
+
+            self.calls += 1
+
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.calls,
+        }
+
+
+class LlmReplay:
+    """
+    Return the recorded results instead of calling the LLM. Calls are matched by their full key first, which only
+    works when the random choices are the same as the recording. Otherwise, the recorded results for the same agent
+    and prompt are returned in order, then the results for the same prompt from any agent.
+    """
+
+    def __init__(self, file: str):
+        self.lock = Lock()
+        self.by_key: Dict[str, Any] = {}
+        self.by_agent: Dict[Tuple[str, str], List[Any]] = defaultdict(list)
+        self.by_prompt: Dict[str, List[Any]] = defaultdict(list)
+        self.positions: Dict[Any, int] = defaultdict(int)
+        self.exact = 0
+        self.fuzzy = 0
+        self.misses = 0
+
+        if not path.exists(file):
+            raise ValueError(f"recording not found: {file}")
+
+        with open(file, "r") as f:
+            for line in f:
+                if len(line.strip()) == 0:
+                    continue
+
+                record = loads(line)
+                if record["key"] is not None:
+                    self.by_key[record["key"]] = record["result"]
+
+                self.by_agent[(record["agent"], record["prompt"])].append(
+                    record["result"]
+                )
+                self.by_prompt[record["prompt"]].append(record["result"])
+
+        logger.info(
+            "loaded %s recorded agent calls from %s",
+            sum(len(results) for results in self.by_prompt.values()),
+            file,
+        )
+
+    def next_result(self, group: Any, results: List[Any]) -> Any:
+        position = self.positions[group]
+        self.positions[group] = position + 1
+        return results[position % len(results)]
+
+    def __call__(self, agent, prompt: str, context: dict, call: Callable[[], Any]):
+        key = agent.call_key(prompt, context)
+        with self.lock:
+            if key is not None and key in self.by_key:
+                self.exact += 1
+                return self.by_key[key]
+
+            agent_results = self.by_agent.get((agent.name, prompt))
+            if agent_results:
+                self.fuzzy += 1
+                return self.next_result((agent.name, prompt), agent_results)
+
+            prompt_results = self.by_prompt.get(prompt)
+            if prompt_results:
+                self.fuzzy += 1
+                return self.next_result(prompt, prompt_results)
+
+            self.misses += 1
+
+        raise ValueError(f"no recorded result for {agent.name}: {prompt[:80]}")
+
+    def stats(self) -> dict:
+        return {
+            "exact": self.exact,
+            "fuzzy": self.fuzzy,
+            "misses": self.misses,
+        }
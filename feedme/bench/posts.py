@@ -0,0 +1,189 @@
+"""
+Benchmark the whole post pipeline against the stub image servers, with recorded or live agent calls.
+
+Record the agent calls once with a live LLM server, then replay them to measure changes offline:
+
+    python -m feedme.bench.posts --record /tmp/feedme-llm.jsonl --posts 2
+    python -m feedme.bench.posts --replay /tmp/feedme-llm.jsonl --posts 5 --output /tmp/feedme-bench.json
+
+The example prompts still come from the GPT2 model, set promptgen.corpus to keep it off the benchmark path. Pass an
+earlier report with --baseline to exit with an error when the throughput drops or a stage gets slower by more than
+--tolerance.
+"""
+
+from argparse import ArgumentParser
+from json import dump, load
+from os import environ
+from random import seed
+from tempfile import mkdtemp
+from time import monotonic
+from typing import Dict, List
+
+from packit.utils import logger_with_colors
+
+from feedme.bench.llm import LlmRecorder, LlmReplay
+from feedme.bench.stubs import ComfyStubHandler, OnnxStubHandler, StubServer
+from feedme.bench.utils import peak_memory
+from feedme.utils.profile import percentile, run_profile
+
+logger = logger_with_colors(__name__, level="INFO")
+
+
+def stage_report(profile) -> Dict[str, Dict]:
+    stages = {}
+    for name, stats in profile.stages.items():
+        stages[name] = {
+            "runs": stats.runs,
+            "p50": percentile(stats.times, 50),
+            "p90": percentile(stats.times, 90),
+            "max": max(stats.times, default=0),
+            "total": sum(stats.times),
+            "llm_calls": stats.llm_calls,
+        }
+
+    return stages
+
+
+def compare_reports(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    List the ways the report is slower than the baseline, beyond the tolerance.
+    """
+    regressions = []
+    if report["posts_per_hour"] < baseline["posts_per_hour"] * (1 - tolerance):
+        regressions.append(
+            f"posts per hour dropped from {baseline['posts_per_hour']:.2f} "
+            f"to {report['posts_per_hour']:.2f}"
+        )
+
+    for name, expected in baseline["stages"].items():
+        actual = report["stages"].get(name)
+        if actual is None:
+            continue
+
+        if actual["p50"] > expected["p50"] * (1 + tolerance):
+            regressions.append(
+                f"{name} p50 went from {expected['p50']:.2f}s to {actual['p50']:.2f}s"
+            )
+
+    return regressions
+
+
+def format_report(report: Dict) -> str:
+    mb = 1024 * 1024
+    lines = [
+        f"posts: {report['posts']}, approved: {report['approved']}, "
+        f"elapsed: {report['elapsed']:.1f}s",
+        f"posts per hour: {report['posts_per_hour']:.2f}, "
+        f"approved per hour: {report['approved_per_hour']:.2f}",
+        f"peak RSS: {report['peak_rss'] / mb:.1f} MB, agent calls: {report['llm']}",
+        f"{'stage':<32} {'runs':>5} {'p50':>8} {'p90':>8} {'max':>8} {'total':>9}",
+    ]
+    stages = sorted(
+        report["stages"].items(), key=lambda item: item[1]["total"], reverse=True
+    )
+    for name, stats in stages:
+        lines.append(
+            f"{name:<32} {stats['runs']:>5} {stats['p50']:>8.2f} {stats['p90']:>8.2f} "
+            f"{stats['max']:>8.2f} {stats['total']:>9.2f}"
+        )
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = ArgumentParser(description="benchmark the post pipeline")
+    parser.add_argument("--posts", type=int, default=3)
+    calls = parser.add_mutually_exclusive_group()
+    calls.add_argument("--record", help="record the agent calls to this file")
+    calls.add_argument("--replay", help="replay the agent calls from this file")
+    parser.add_argument("--image-tool", default="onnx", choices=["onnx", "comfy"])
+    parser.add_argument("--latency", type=float, default=5.0)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--poll", type=int, default=1)
+    parser.add_argument("--pipeline", action="store_true")
+    parser.add_argument("--depth", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dest", default=None)
+    parser.add_argument("--output", help="save the report to this file")
+    parser.add_argument("--baseline", help="compare with an earlier report")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    onnx = StubServer(OnnxStubHandler, args.latency, args.image_latency).start()
+    comfy = StubServer(ComfyStubHandler, args.latency, args.image_latency).start()
+
+    # the feedme modules read these when they are first imported
+    environ["ONNX_API"] = f"http://{onnx.address}"
+    environ["COMFY_API"] = comfy.address
+    environ["IMAGE_TOOL"] = args.image_tool
+    environ["POST_TOOL"] = "html"
+    environ["FEEDME_DEST"] = args.dest or mkdtemp(prefix="feedme-bench-")
+
+    from feedme import multi_post
+    from feedme.data import misc
+    from feedme.utils.cache import agent_cache, set_agent_transport
+
+    # send every call through the recorder or replay, instead of the disk cache
+    agent_cache.enabled = False
+    transport = None
+    if args.record:
+        transport = LlmRecorder(args.record)
+    elif args.replay:
+        transport = LlmReplay(args.replay)
+
+    set_agent_transport(transport)
+
+    if misc.onnx is not None:
+        misc.onnx.poll = args.poll
+
+    seed(args.seed)
+    logger.info("benchmarking %s posts in %s", args.posts, environ["FEEDME_DEST"])
+
+    start = monotonic()
+    try:
+        approved = multi_post.main(
+            concept_count=args.posts,
+            pipeline=args.pipeline,
+            pipeline_depth=args.depth,
+        )
+    finally:
+        set_agent_transport(None)
+        onnx.stop()
+        comfy.stop()
+
+    elapsed = monotonic() - start
+    hours = elapsed / 3600
+    report = {
+        "posts": args.posts,
+        "approved": len(approved),
+        "elapsed": elapsed,
+        "posts_per_hour": args.posts / hours if hours > 0 else 0,
+        "approved_per_hour": len(approved) / hours if hours > 0 else 0,
+        "peak_rss": peak_memory(),
+        "image_tool": args.image_tool,
+        "pipeline": args.pipeline,
+        "llm": transport.stats() if transport is not None else {},
+        "stages": stage_report(run_profile),
+    }
+    logger.info("benchmark results:\n%s", format_report(report))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = load(f)
+
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for regression in regressions:
+            logger.error("regression: %s", regression)
+
+        if len(regressions) > 0:
+            raise SystemExit(1)
+
+        logger.info("no regressions compared to %s", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Compare the promptgen inference backends on CPU.
+
+Each backend is loaded in its own process, so the resident memory is not shared between them. The ONNX backends are
+also checked against the torch model, by comparing the next-token logits for each of the prompts.
+
+Usage: python -m feedme.bench.promptgen --backends torch onnx onnx-int8
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from time import monotonic
+from typing import Dict, List
+
+import torch
+from packit.utils import logger_with_colors
+
+from feedme.bench.utils import peak_memory, resident_memory
+from feedme.data import misc
+from feedme.utils.gpt2 import generate_batch, model_cache, model_loaders
+
+logger = logger_with_colors(__name__, level="INFO")
+
+DEFAULT_PROMPTS = [
+    "mountain lake,sunset,reflection",
+    "city street,rain,neon lights",
+    "forest,fog,ancient ruins",
+    "portrait,old fisherman,harbor",
+    "desert,camel caravan,dunes",
+]
+
+
+def compare_logits(model_path: str, backend: str, prompts: List[str]) -> Dict:
+    """
+    Compare the next-token logits from a backend with the torch model.
+    """
+    torch_model, tokenizer, _size = model_cache.get(model_path, "cpu", "torch")
+    other_model, _tokenizer, _size = model_cache.get(model_path, "cpu", backend)
+
+    max_diff = 0.0
+    matches = 0
+    for prompt in prompts:
+        # one prompt at a time, so padding does not affect the comparison
+        inputs = tokenizer(prompt, return_tensors="pt")
+        with torch.inference_mode():
+            expected = torch_model(**inputs).logits[0, -1, :]
+            actual = other_model(**inputs).logits[0, -1, :]
+
+        max_diff = max(max_diff, float((expected - actual).abs().max()))
+        if int(expected.argmax()) == int(actual.argmax()):
+            matches += 1
+
+    return {
+        "max_logit_diff": max_diff,
+        "top1_match": matches / len(prompts),
+    }
+
+
+def bench_backend(
+    backend: str, model_path: str, prompts: List[str], length: int, runs: int
+) -> Dict:
+    rss_start = resident_memory()
+    _model, tokenizer, size = model_cache.get(model_path, "cpu", backend)
+    rss_loaded = resident_memory()
+
+    # warm up once, some backends allocate their buffers on the first run
+    generate_batch(model_path, prompts, length, device="cpu", backend=backend)
+
+    tokens = 0
+    start = monotonic()
+    for _ in range(runs):
+        outputs = generate_batch(
+            model_path, prompts, length, device="cpu", backend=backend
+        )
+        for prompt, output in zip(prompts, outputs):
+            tokens += len(tokenizer.encode(output)) - len(tokenizer.encode(prompt))
+
+    elapsed = monotonic() - start
+
+    result = {
+        "backend": backend,
+        "load_time": model_cache.load_time,
+        "model_size": size,
+        "tokens": tokens,
+        "tokens_per_second": tokens / elapsed if elapsed > 0 else 0,
+        "rss_model": rss_loaded - rss_start,
+        "rss_peak": peak_memory(),
+    }
+
+    if backend != "torch":
+        result.update(compare_logits(model_path, backend, prompts))
+
+    return result
+
+
+def format_results(results: List[Dict]) -> str:
+    mb = 1024 * 1024
+    lines = [
+        f"{'backend':<10} {'load s':>8} {'tok/s':>8} {'model MB':>9} {'rss MB':>8} {'peak MB':>8} {'diff':>8} {'top1':>6}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['backend']:<10} {result['load_time']:>8.2f} {result['tokens_per_second']:>8.1f} "
+            f"{result['model_size'] / mb:>9.1f} {result['rss_model'] / mb:>8.1f} {result['rss_peak'] / mb:>8.1f} "
+            f"{result.get('max_logit_diff', 0):>8.4f} {result.get('top1_match', 1):>6.2f}"
+        )
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = ArgumentParser(description="benchmark the promptgen backends")
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=list(model_loaders.keys()),
+        choices=list(model_loaders.keys()),
+    )
+    parser.add_argument("--model", default=misc.llms.gpt2)
+    parser.add_argument("--length", type=int, default=180)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for backend in args.backends:
+        logger.info("benchmarking %s backend", backend)
+        # use a fresh process for each backend, so memory and threads are not shared
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=get_context("spawn")
+        ) as pool:
+            result = pool.submit(
+                bench_backend,
+                backend,
+                args.model,
+                DEFAULT_PROMPTS,
+                args.length,
+                args.runs,
+            ).result()
+
+        logger.info("%s results: %s", backend, result)
+        results.append(result)
+
+    logger.info("promptgen backends:\n%s", format_results(results))
+
+
+if __name__ == "__main__":
+    main()
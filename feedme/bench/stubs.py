@@ -0,0 +1,445 @@
+"""
+Local stand-ins for the ONNX web and ComfyUI servers, for running the post pipeline without a GPU.
+
+Both servers render jobs one at a time, like a single GPU, taking latency seconds per job plus image_latency seconds
+per image. The images are solid color PNGs at the requested size.
+
+Usage: python -m feedme.bench.stubs --latency 5 --image-latency 1
+"""
+
+from argparse import ArgumentParser
+from base64 import b64encode
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from re import search
+from select import select
+from struct import pack
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+from zlib import compress, crc32
+
+from packit.utils import logger_with_colors
+
+logger = logger_with_colors(__name__, level="INFO")
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def make_png(width: int, height: int, color: Tuple[int, int, int]) -> bytes:
+    """
+    Encode a solid color RGB image as a PNG, without any image libraries.
+    """
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            pack(">I", len(data))
+            + kind
+            + data
+            + pack(">I", crc32(kind + data) & 0xFFFFFFFF)
+        )
+
+    row = b"\x00" + bytes(color) * width
+    header = pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+class StubJob:
+    def __init__(
+        self, name: str, count: int, width: int, height: int, start: float, end: float
+    ):
+        self.name = name
+        self.count = count
+        self.width = width
+        self.height = height
+        self.start = start
+        self.end = end
+        self.cancelled = False
+        self.notified = False
+
+    @property
+    def ready(self) -> bool:
+        return self.cancelled or monotonic() >= self.end
+
+    @property
+    def progress(self) -> float:
+        if self.end <= self.start:
+            return 1.0
+
+        elapsed = monotonic() - self.start
+        return min(1.0, max(0.0, elapsed / (self.end - self.start)))
+
+    @property
+    def outputs(self) -> List[str]:
+        return [f"{self.name}_{i}.png" for i in range(self.count)]
+
+
+class StubQueue:
+    """
+    Schedule jobs one after another, so each job waits for the ones before it to finish.
+    """
+
+    def __init__(self, latency: float, image_latency: float):
+        self.latency = latency
+        self.image_latency = image_latency
+        self.lock = Lock()
+        self.jobs: Dict[str, StubJob] = {}
+        self.images: Dict[str, StubJob] = {}
+        self.last_end = 0.0
+
+    def submit(self, count: int, width: int, height: int) -> StubJob:
+        with self.lock:
+            name = uuid4().hex
+            start = max(monotonic(), self.last_end)
+            end = start + self.latency + self.image_latency * count
+            self.last_end = end
+
+            job = StubJob(name, count, width, height, start, end)
+            self.jobs[name] = job
+            for output in job.outputs:
+                self.images[output] = job
+
+            return job
+
+    def get(self, name: str) -> Optional[StubJob]:
+        with self.lock:
+            return self.jobs.get(name)
+
+    def cancel(self, name: str) -> bool:
+        with self.lock:
+            job = self.jobs.get(name)
+            if job is None:
+                return False
+
+            job.cancelled = True
+            return True
+
+    def image(self, filename: str) -> Optional[bytes]:
+        with self.lock:
+            job = self.images.get(filename)
+
+        if job is None or not job.ready:
+            return None
+
+        index = sum(filename.encode("utf-8")) % 256
+        return make_png(job.width, job.height, (index, 128, 255 - index))
+
+    def running(self) -> List[StubJob]:
+        with self.lock:
+            return [job for job in self.jobs.values() if not job.ready]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # websocket clients expect an HTTP/1.1 upgrade
+    protocol_version = "HTTP/1.1"
+    queue: StubQueue
+
+    def log_message(self, format, *args):
+        logger.debug("%s: %s", self.__class__.__name__, format % args)
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length > 0 else b""
+
+    def send_json(self, data, status: int = 200) -> None:
+        body = dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_png(self, data: Optional[bytes]) -> None:
+        if data is None:
+            self.send_json({"error": "image not found"}, status=404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class OnnxStubHandler(StubHandler):
+    """
+    Mimic the onnx-web API used by onnx_tools.
+    """
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/api/txt2img":
+            self.send_json({"error": "not found"}, status=404)
+            return
+
+        # the parameters are sent as a JSON field in a multipart form
+        body = self.read_body().decode("utf-8", errors="replace")
+        params = {}
+        json = search(r"\{.*\}", body)
+        if json:
+            params = loads(json.group(0)).get("params", {})
+
+        job = self.queue.submit(
+            int(params.get("batch", 1)),
+            int(params.get("width", 512)),
+            int(params.get("height", 512)),
+        )
+        self.send_json({"name": job.name})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == "/api/ready":
+            job = self.queue.get(query.get("output", [""])[0])
+            if job is None:
+                self.send_json({"error": "job not found"}, status=404)
+                return
+
+            self.send_json(
+                {
+                    "ready": job.ready,
+                    "cancelled": job.cancelled,
+                    "failed": False,
+                    "progress": job.progress,
+                }
+            )
+        elif url.path == "/api/job/status":
+            statuses = []
+            for name in query.get("jobs", [""])[0].split(","):
+                job = self.queue.get(name)
+                if job is None:
+                    continue
+
+                statuses.append(
+                    {
+                        "name": job.name,
+                        "status": "success" if job.ready else "running",
+                        "outputs": job.outputs if job.ready else [],
+                        "progress": job.progress,
+                    }
+                )
+
+            self.send_json(statuses)
+        elif url.path.startswith("/output/"):
+            self.send_png(self.queue.image(url.path[len("/output/") :]))
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/api/job/cancel":
+            for name in query.get("jobs", [""])[0].split(","):
+                self.queue.cancel(name)
+
+            self.send_json({"status": "ok"})
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+
+class ComfyStubHandler(StubHandler):
+    """
+    Mimic the ComfyUI API used by comfy_tools, including the websocket that reports when each prompt is done.
+    """
+
+    clients: Dict[str, List[str]]
+    clients_lock: Lock
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.read_body()
+
+        if url.path == "/prompt":
+            data = loads(body)
+            count, width, height = 1, 512, 512
+            for node in data["prompt"].values():
+                if node.get("class_type") == "EmptyLatentImage":
+                    inputs = node["inputs"]
+                    count = int(inputs.get("batch_size", 1))
+                    width = int(inputs.get("width", 512))
+                    height = int(inputs.get("height", 512))
+
+            job = self.queue.submit(count, width, height)
+            with self.clients_lock:
+                client_id = data.get("client_id", "")
+                self.clients.setdefault(client_id, []).append(job.name)
+
+            self.send_json({"prompt_id": job.name, "number": len(self.queue.jobs)})
+        elif url.path == "/interrupt":
+            for job in self.queue.running():
+                if job.start <= monotonic():
+                    self.queue.cancel(job.name)
+                    break
+
+            self.send_json({})
+        elif url.path == "/queue":
+            data = loads(body) if body else {}
+            for name in data.get("delete", []):
+                self.queue.cancel(name)
+
+            self.send_json({})
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path == "/ws":
+            self.handle_websocket(query.get("clientId", [""])[0])
+        elif url.path.startswith("/history/"):
+            job = self.queue.get(url.path[len("/history/") :])
+            if job is None or not job.ready:
+                self.send_json({})
+                return
+
+            images = [
+                {"filename": output, "subfolder": "", "type": "output"}
+                for output in job.outputs
+            ]
+            self.send_json({job.name: {"outputs": {"9": {"images": images}}}})
+        elif url.path == "/view":
+            self.send_png(self.queue.image(query.get("filename", [""])[0]))
+        elif url.path == "/queue":
+            now = monotonic()
+            running = [job for job in self.queue.running() if job.start <= now]
+            pending = [job for job in self.queue.running() if job.start > now]
+            self.send_json(
+                {
+                    "queue_running": [[0, job.name, {}, {}, []] for job in running],
+                    "queue_pending": [[0, job.name, {}, {}, []] for job in pending],
+                }
+            )
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def handle_websocket(self, client_id: str) -> None:
+        key = self.headers.get("Sec-WebSocket-Key")
+        if key is None:
+            self.send_json({"error": "websocket key missing"}, status=400)
+            return
+
+        accept = b64encode(sha1((key + WEBSOCKET_GUID).encode("utf-8")).digest())
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept.decode("utf-8"))
+        self.end_headers()
+        self.wfile.flush()
+
+        # send a message once each prompt from this client is done, until the client disconnects
+        self.close_connection = True
+        while True:
+            readable, _, _ = select([self.connection], [], [], 0.05)
+            if readable and len(self.connection.recv(4096)) == 0:
+                return
+
+            with self.clients_lock:
+                names = list(self.clients.get(client_id, []))
+
+            for name in names:
+                job = self.queue.get(name)
+                if job is None or not job.ready or job.notified:
+                    continue
+
+                job.notified = True
+                message = {
+                    "type": "executing",
+                    "data": {"node": None, "prompt_id": name},
+                }
+                try:
+                    self.send_frame(dumps(message).encode("utf-8"))
+                except OSError:
+                    return
+
+    def send_frame(self, payload: bytes) -> None:
+        # server frames are not masked
+        length = len(payload)
+        if length < 126:
+            header = pack(">BB", 0x81, length)
+        elif length < 65536:
+            header = pack(">BBH", 0x81, 126, length)
+        else:
+            header = pack(">BBQ", 0x81, 127, length)
+
+        self.wfile.write(header + payload)
+        self.wfile.flush()
+
+
+class StubServer:
+    """
+    Run a stub server on a local port in a background thread.
+    """
+
+    def __init__(
+        self,
+        handler: type,
+        latency: float = 0,
+        image_latency: float = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.queue = StubQueue(latency, image_latency)
+        attrs = {"queue": self.queue}
+        if issubclass(handler, ComfyStubHandler):
+            attrs.update(clients={}, clients_lock=Lock())
+
+        # bind the queue to a handler subclass, so each server has its own jobs
+        self.server = ThreadingHTTPServer(
+            (host, port), type(handler.__name__, (handler,), attrs)
+        )
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self.thread.start()
+        logger.info(
+            "started %s at %s", self.server.RequestHandlerClass.__name__, self.address
+        )
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = ArgumentParser(description="run the stub ONNX and Comfy servers")
+    parser.add_argument("--latency", type=float, default=5.0)
+    parser.add_argument("--image-latency", type=float, default=1.0)
+    parser.add_argument("--onnx-port", type=int, default=5000)
+    parser.add_argument("--comfy-port", type=int, default=8188)
+    args = parser.parse_args()
+
+    onnx = StubServer(
+        OnnxStubHandler, args.latency, args.image_latency, port=args.onnx_port
+    ).start()
+    comfy = StubServer(
+        ComfyStubHandler, args.latency, args.image_latency, port=args.comfy_port
+    ).start()
+    logger.info("ONNX_API=http://%s COMFY_API=%s", onnx.address, comfy.address)
+
+    try:
+        while True:
+            sleep(60)
+    except KeyboardInterrupt:
+        onnx.stop()
+        comfy.stop()
+
+
+if __name__ == "__main__":
+    main()
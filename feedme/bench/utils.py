@@ -0,0 +1,19 @@
+from os import sysconf
+from resource import RUSAGE_SELF, getrusage
+
+
+def resident_memory() -> int:
+    """
+    Get the current resident memory of this process, in bytes.
+    """
+    with open("/proc/self/statm", "r") as f:
+        pages = int(f.read().split()[1])
+
+    return pages * sysconf("SC_PAGE_SIZE")
+
+
+def peak_memory() -> int:
+    """
+    Get the peak resident memory of this process, in bytes.
+    """
+    return getrusage(RUSAGE_SELF).ru_maxrss * 1024
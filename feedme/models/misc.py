@@ -1,4 +1,4 @@
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Literal, Optional, Tuple
 
 from pydantic import Field, PositiveFloat, PositiveInt
 
@@ -23,6 +23,49 @@ class OnnxData:
     remove: str
     retries: PositiveInt
     poll: PositiveInt
+    min_poll: PositiveFloat = Field(default=0.5)
+    deadline: Optional[PositiveFloat] = Field(default=None)
+    pool_size: PositiveInt = Field(default=4)
+    connect_timeout: PositiveFloat = Field(default=5)
+    read_timeout: PositiveFloat = Field(default=60)
+    get_retries: int = Field(default=3)
+    backoff: float = Field(default=0.5)
+    backoff_jitter: float = Field(default=0.5)
+
+
+@dataclass
+class PromptgenData:
+    backend: Literal["torch", "onnx", "onnx-int8"] = Field(default="torch")
+    device: str = Field(default="cpu")
+    cache_memory: PositiveInt = Field(default=2048)  # in MB
+    max_commas: Optional[PositiveInt] = Field(default=None)
+    max_words: Optional[PositiveInt] = Field(default=None)
+    stop: Optional[str] = Field(default=None)
+    onnx_path: str = Field(default="/tmp/feedme-promptgen")
+    corpus: Optional[str] = Field(default=None)
+    coverage: float = Field(default=0.5)
+    workers: int = Field(default=0)
+
+
+@dataclass
+class ConcurrencyData:
+    workers: PositiveInt = Field(default=4)
+    prompt: bool = Field(default=False)
+    ranking: bool = Field(default=False)
+    ideas: bool = Field(default=False)
+    voting: bool = Field(default=False)
+    timeout: PositiveFloat = Field(default=300)
+    pipeline: bool = Field(default=False)
+    pipeline_depth: PositiveInt = Field(default=1)
+
+
+@dataclass
+class CacheData:
+    enabled: bool = Field(default=False)
+    path: str = Field(default="/tmp/feedme-cache")
+    max_size: PositiveInt = Field(default=256)  # in MB
+    max_temperature: float = Field(default=0.2)
+    ttl: PositiveInt = Field(default=7 * 24 * 60 * 60)  # in seconds
 
 
 @dataclass
@@ -61,6 +104,8 @@ class ImageData:
     count: MinMaxInt
     steps: StepData
     extra: int = Field(default=0)
+    speculative: bool = Field(default=False)
+    inflight: PositiveInt = Field(default=2)
 
 
 @dataclass
@@ -72,23 +117,38 @@ class InterestData(MinMaxInt):
 class PostData:
     count: int
     retry: int
+    checkpoint: bool = Field(default=False)
+    retry_from: Dict[
+        str,
+        Literal["parameters", "ideas", "description", "gate", "prompt", "images"],
+    ] = Field(
+        default_factory=lambda: {
+            "not enough images": "images",
+            "low rating": "ideas",
+            "critique gate": "ideas",
+        }
+    )
 
 
 @dataclass
 class ConceptRankingData:
     max: PositiveInt
     threshold: PositiveFloat
+    strategy: Literal["bool", "list", "scale"] = Field(default="scale")
 
 
 @dataclass
 class ImageRankingData:
     max: PositiveInt
     threshold: PositiveFloat
+    early_exit: bool = Field(default=False)
 
 
 @dataclass
 class PostRankingData:
     threshold: PositiveFloat
+    gate: bool = Field(default=False)
+    structured: bool = Field(default=False)
 
 
 @dataclass
@@ -111,3 +171,6 @@ class MiscData:
     interests: InterestData
     posts: PostData
     ranking: RankingData
+    promptgen: PromptgenData = Field(default_factory=PromptgenData)
+    concurrency: ConcurrencyData = Field(default_factory=ConcurrencyData)
+    cache: CacheData = Field(default_factory=CacheData)
@@ -7,6 +7,8 @@ class PromptsModel:
     critique_image_binary: str
     critique_image_opinion: str
     critique_image_scale: str
+    critique_image_structured_binary: str
+    critique_image_structured_scale: str
     demo_idea: str
     demo_post: str
     elaborate_characters: str
@@ -21,6 +23,7 @@ class PromptsModel:
     negative_prompt: str
     post_notice: str
     rank_concepts_binary: str
+    rank_concepts_list: str
     rank_concepts_scale: str
     rank_image_sort: str
     rank_image_sort_retry: str
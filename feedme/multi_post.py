@@ -1,12 +1,17 @@
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from contextvars import copy_context
 from json import dumps
-from os import environ, makedirs, path
+from os import environ, makedirs, path, remove
 from random import choice, randint
 from shutil import move, rmtree
+from threading import Event, Lock
 from time import monotonic
+from typing import Optional
 
-from packit.agent import Agent, agent_easy_connect
+from packit.agent import agent_easy_connect
 from packit.groups import Panel
+from packit.loops import loop_retry
 from packit.results import int_result
 from packit.tracing import trace
 from packit.utils import logger_with_colors
@@ -19,8 +24,9 @@ from feedme.data import (
     get_save_path,
     misc,
     prompts,
-    set_save_path,
 )
+from feedme.state.checkpoint import Checkpoint, load_checkpoints
+from feedme.state.sizes import predict_size, save_size_choice
 from feedme.state.utils import load_state, save_state, update_state
 from feedme.tools.civitai_tools import close_page, create_post, launch_login
 from feedme.tools.comfy_tools import generate_image_tool as generate_image_comfy
@@ -28,17 +34,32 @@ from feedme.tools.html_tools import template_post
 from feedme.tools.image_tools import get_image_data
 from feedme.tools.onnx_tools import download_input_images
 from feedme.tools.onnx_tools import generate_image_tool as generate_image_onnx
+from feedme.utils.cache import CachedAgent, agent_cache
 from feedme.utils.misc import (
     cleanup_sentence,
     format_bullet_list,
+    format_numbered_list,
+    get_bool,
+    get_number,
     hash_post,
     monotonic_delta,
+    parse_critique,
     parse_ranking,
+    parse_scores,
     rank_list,
     sanitize_name,
     str_parser,
 )
+from feedme.utils.pipeline import Pipeline, run_stages
+from feedme.utils.profile import (
+    Profile,
+    activate_profile,
+    profile_stage,
+    profiled,
+    run_profile,
+)
 from feedme.utils.promptgen import generate_prompt
+from feedme.utils.workers import completed_future, shutdown_promptgen, submit_llm
 
 # set up logging and tracing
 logger = logger_with_colors(__name__, level="DEBUG")
@@ -60,7 +81,6 @@ post_tool = environ.get("POST_TOOL", "html")
 
 # set up paths
 root_path = get_save_path()  # this is initialized to the dest path
-approval_path = path.join(root_path, "approval")
 approved_path = path.join(root_path, "approved")
 rejected_path = path.join(root_path, "rejected")
 working_path = path.join(root_path, "working")
@@ -77,6 +97,16 @@ creative_llm = agent_easy_connect(
 )
 
 
+# the lowest score on the ranking scales, the prompts ask for a score from 1 to max_score
+MIN_SCORE = 1
+
+
+# speculative images run next to the size vote, one post at a time
+speculative_pool = ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="feedme-speculative"
+)
+
+
 def InterestAgent(interest: str, **kwargs):
     base_story = agents.backstory["Interest Scientist"]
     interest_story = get_interest_story(interest)
@@ -86,7 +116,7 @@ def InterestAgent(interest: str, **kwargs):
         "creating agent for interest %s with backstory: %s", interest, backstory
     )
 
-    return Agent(
+    return CachedAgent(
         f"{interest} scientist",
         backstory,
         {
@@ -94,11 +124,11 @@ def InterestAgent(interest: str, **kwargs):
             "interest": interest,
         },
         creative_llm,
+        misc.llms.creative,
     )
 
 
 def make_post_paths():
-    makedirs(approval_path, exist_ok=True)
     makedirs(approved_path, exist_ok=True)
     makedirs(rejected_path, exist_ok=True)
     makedirs(working_path, exist_ok=True)
@@ -109,11 +139,16 @@ def append_post_notice(body: str, hash: str):
 
 
 @task()
-def do_images(prompt, count, size, tool=image_tool):
+@profiled
+def do_images(prompt, count, size, tool=image_tool, cancel=None, save_path=None):
     if tool == "comfy":
-        results = generate_image_comfy(prompt, count, size=size)
+        results = generate_image_comfy(
+            prompt, count, size=size, cancel=cancel, save_path=save_path
+        )
     elif tool == "onnx":
-        results = generate_image_onnx(prompt, count, size=size)
+        results = generate_image_onnx(
+            prompt, count, size=size, cancel=cancel, save_path=save_path
+        )
     else:
         logger.error("unknown image tool: %s", tool)
         return []
@@ -122,7 +157,53 @@ def do_images(prompt, count, size, tool=image_tool):
     return results
 
 
+class SpeculativeImages:
+    """
+    Start generating images at a predicted size before the size has been chosen. Once the size is known, the images
+    are either kept or cancelled.
+    """
+
+    def __init__(self, prompt, count, size, save_path=None):
+        self.size = size
+        self.cancel = Event()
+        self.future = speculative_pool.submit(
+            copy_context().run,
+            do_images,
+            prompt,
+            count,
+            size,
+            cancel=self.cancel,
+            save_path=save_path,
+        )
+
+    def resolve(self, size):
+        """
+        Return the images if they were generated at the chosen size. Otherwise, cancel the generation, remove any
+        images that were already saved, and return None.
+        """
+        if size == self.size:
+            logger.info("speculative %s images match the chosen size", size)
+            return self.future.result()
+
+        logger.warning(
+            "cancelling speculative %s images, chosen size is %s", self.size, size
+        )
+        self.cancel.set()
+        try:
+            results = self.future.result()
+        except Exception:
+            logger.exception("speculative image generation failed")
+            results = []
+
+        for image in results:
+            if path.exists(image):
+                remove(image)
+
+        return None
+
+
 @task()
+@profiled
 def do_post(post_slug, post_description, post_hash, post, tool=post_tool):
     description = append_post_notice(post_description, post_hash)
     if tool == "civitai":
@@ -159,7 +240,55 @@ def do_post(post_slug, post_description, post_hash, post, tool=post_tool):
         logger.error("unknown post tool: %s", tool)
 
 
+def sample_agent(agent, prompt, context, **kwargs) -> dict:
+    """
+    Sample a single agent, retrying the call with loop_retry like a panel does for each of its agents. Returns the
+    result keyed by the agent name, the same way Panel.sample does.
+    """
+    return {agent.name: loop_retry(agent, prompt, context=context, **kwargs)}
+
+
+def sample_items(agents, items, prompt, make_context, name, **kwargs):
+    """
+    Sample a panel of agents for each item. Returns a list of futures for each item, which should be passed to
+    collect_results.
+
+    When concurrency.ranking is enabled, every (item, agent) call is sent through the shared LLM pool at once, otherwise
+    each item is sampled with a single panel, one after another. Each call is retried within its own future, so a call
+    that fails once does not fail the item in either mode.
+    """
+    if misc.concurrency.ranking:
+        return [
+            [
+                submit_llm(sample_agent, agent, prompt, make_context(item), **kwargs)
+                for agent in agents
+            ]
+            for item in items
+        ]
+
+    return [
+        [
+            completed_future(
+                Panel(agents, name=name).sample, prompt, make_context(item), **kwargs
+            )
+        ]
+        for item in items
+    ]
+
+
+def collect_results(futures) -> dict:
+    """
+    Wait for the futures from sample_items and merge them into the same results that Panel.sample would return.
+    """
+    results = {}
+    for future in futures:
+        results.update(future.result())
+
+    return results
+
+
 @task()
+@profiled
 def generate_concepts(interest_agents, min_words=3, max_words=6):
     interest_panel = Panel(list(interest_agents.values()), name="concepts")
     panel_results = interest_panel.sample(
@@ -177,17 +306,23 @@ def generate_concepts(interest_agents, min_words=3, max_words=6):
 
 
 @task()
+@profiled
 def concept_ranking_each_bool(interest_agents, concepts):
     total_ranking = Counter()
 
-    for concept in concepts.values():
-        interest_panel = Panel(list(interest_agents.values()), "concepts")
-        panel_results = interest_panel.sample(
-            prompts.rank_concepts_binary,
-            {
-                "concept": concept,
-            },
-        )
+    concept_list = list(concepts.values())
+    concept_futures = sample_items(
+        list(interest_agents.values()),
+        concept_list,
+        prompts.rank_concepts_binary,
+        lambda concept: {
+            "concept": concept,
+        },
+        name="concepts",
+    )
+
+    for concept, futures in zip(concept_list, concept_futures):
+        panel_results = collect_results(futures)
 
         for interest, ranking in panel_results.items():
             logger.info("ranking for %s interest: %s", interest, ranking)
@@ -204,6 +339,7 @@ def concept_ranking_each_bool(interest_agents, concepts):
 
 
 @task()
+@profiled
 def concept_ranking_each_scale(
     interest_agents,
     concepts,
@@ -214,17 +350,22 @@ def concept_ranking_each_scale(
     selected_concepts = []
     selected_rankings = Counter()
 
-    for concept in concepts.values():
-        interest_panel = Panel(list(interest_agents.values()), name="concepts")
+    concept_list = list(concepts.values())
+    concept_futures = sample_items(
+        list(interest_agents.values()),
+        concept_list,
+        prompts.rank_concepts_scale,
+        lambda concept: {
+            "concept": concept,
+            "max_score": max_score,
+        },
+        name="concepts",
+        result_parser=int_result,
+    )
+
+    for concept, futures in zip(concept_list, concept_futures):
         try:
-            panel_results = interest_panel.sample(
-                prompts.rank_concepts_scale,
-                {
-                    "concept": concept,
-                    "max_score": max_score,
-                },
-                result_parser=int_result,
-            )
+            panel_results = collect_results(futures)
             image_rankings = list(panel_results.values())
         except Exception:
             logger.exception("failed to parse ranking")
@@ -262,49 +403,202 @@ def concept_ranking_each_scale(
 
 
 @task()
-def image_size_choice(interest_agents, description):
-    total_ratios = Counter()
-
-    for scientist in interest_agents.values():
-        image_ratio = scientist(
-            prompts.choose_image_size,
-            description=description,
-        ).lower()
+@profiled
+def concept_ranking_list(
+    interest_agents,
+    concepts,
+    ranking_threshold=misc.ranking.concept.threshold,
+    max_score=misc.ranking.concept.max,
+    count=1,
+):
+    """
+    Give each agent the whole list of concepts in a single prompt and collect a score for each concept.
+    """
+    concept_list = list(concepts.values())
+    list_futures = sample_items(
+        list(interest_agents.values()),
+        [concept_list],
+        prompts.rank_concepts_list,
+        lambda concept_list: {
+            "concepts": format_numbered_list(concept_list),
+            "max_score": max_score,
+        },
+        name="concepts",
+        result_parser=str_parser,
+    )
 
-        # TODO: use packit enum result parser
-        landscape_index = image_ratio.find("landscape")
-        portrait_index = image_ratio.find("portrait")
-        square_index = image_ratio.find("square")
+    concept_scores = {concept: [] for concept in concept_list}
+    for interest, ranking in collect_results(list_futures[0]).items():
+        logger.info("ranking for %s interest: %s", interest, ranking)
+        try:
+            scores = parse_scores(ranking)
+        except Exception:
+            logger.exception("failed to parse ranking: %s", ranking)
+            continue
 
-        if landscape_index < 0:
-            landscape_index = 999
+        for number, score in scores.items():
+            if 1 <= number <= len(concept_list) and MIN_SCORE <= score <= max_score:
+                concept_scores[concept_list[number - 1]].append(score)
+            else:
+                logger.warning("invalid concept score: %s: %s", number, score)
 
-        if portrait_index < 0:
-            portrait_index = 999
+    selected_rankings = Counter()
+    for concept, concept_rankings in concept_scores.items():
+        if len(concept_rankings) > 0:
+            average_ranking = sum(concept_rankings) / len(concept_rankings)
+        else:
+            average_ranking = 0
 
-        if square_index < 0:
-            square_index = 999
+        if average_ranking >= ranking_threshold:
+            logger.info(
+                "concept %s met threshold: %s >= %s",
+                concept,
+                average_ranking,
+                ranking_threshold,
+            )
 
-        if landscape_index < portrait_index and landscape_index < square_index:
-            total_ratios["landscape"] += 1
-        elif portrait_index < landscape_index and portrait_index < square_index:
-            total_ratios["portrait"] += 1
-        elif square_index < landscape_index and square_index < portrait_index:
-            total_ratios["square"] += 1
+            # counter can only handle integers, so multiply by 10
+            selected_rankings[concept] = int(average_ranking * 10)
         else:
             logger.warning(
-                "invalid image ratio: %s (%s, %s, %s)",
-                image_ratio,
-                landscape_index,
-                portrait_index,
-                square_index,
+                "concept %s did not meet threshold: %s < %s",
+                concept,
+                average_ranking,
+                ranking_threshold,
+            )
+
+    top_concepts = selected_rankings.most_common(count)
+    logger.info("top concepts: %s", top_concepts)
+
+    return top_concepts
+
+
+def concept_ranking(interest_agents, concepts, strategy=misc.ranking.concept.strategy):
+    if strategy == "bool":
+        return concept_ranking_each_bool(interest_agents, concepts)
+    elif strategy == "list":
+        return concept_ranking_list(interest_agents, concepts)
+    elif strategy == "scale":
+        return concept_ranking_each_scale(interest_agents, concepts)
+    else:
+        raise ValueError(f"unknown concept ranking strategy: {strategy}")
+
+
+def parse_image_size(image_ratio: str) -> str | None:
+    # TODO: use packit enum result parser
+    image_ratio = image_ratio.lower()
+    landscape_index = image_ratio.find("landscape")
+    portrait_index = image_ratio.find("portrait")
+    square_index = image_ratio.find("square")
+
+    if landscape_index < 0:
+        landscape_index = 999
+
+    if portrait_index < 0:
+        portrait_index = 999
+
+    if square_index < 0:
+        square_index = 999
+
+    if landscape_index < portrait_index and landscape_index < square_index:
+        return "landscape"
+    elif portrait_index < landscape_index and portrait_index < square_index:
+        return "portrait"
+    elif square_index < landscape_index and square_index < portrait_index:
+        return "square"
+    else:
+        logger.warning(
+            "invalid image ratio: %s (%s, %s, %s)",
+            image_ratio,
+            landscape_index,
+            portrait_index,
+            square_index,
+        )
+        return None
+
+
+def has_majority(votes: Counter, remaining: int) -> bool:
+    """
+    Check whether the leading option has more votes than any other option could reach with the remaining votes.
+    """
+    ranked = votes.most_common(2)
+    if len(ranked) == 0:
+        return False
+
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    return ranked[0][1] > runner_up + remaining
+
+
+def vote_choice(agents, ask, concurrent=misc.concurrency.voting) -> Counter:
+    """
+    Ask each agent to vote for an option and count the votes, stopping as soon as one option holds a majority that
+    the remaining agents cannot beat. ask(agent) should return the option, or None if the vote was not valid.
+
+    When concurrent is set, all of the agents are asked at once, and the vote returns as soon as there is a majority.
+    Only the calls that are still waiting for a worker can be cancelled then, the calls that have already started keep
+    running until they finish and their votes are ignored.
+    """
+    votes = Counter()
+    remaining = len(agents)
+
+    if concurrent:
+        futures = [submit_llm(ask, agent) for agent in agents]
+        try:
+            for future in as_completed(futures):
+                remaining -= 1
+                option = future.result()
+                if option is not None:
+                    votes[option] += 1
+
+                if has_majority(votes, remaining):
+                    break
+        finally:
+            cancelled = sum(future.cancel() for future in futures)
+
+        if remaining > 0:
+            running = sum(not future.done() for future in futures)
+            logger.info(
+                "vote decided with %s agents left to ask, cancelled %s calls that had not started, %s are still running",
+                remaining,
+                cancelled,
+                running,
             )
 
+        return votes
+
+    for agent in agents:
+        remaining -= 1
+        option = ask(agent)
+        if option is not None:
+            votes[option] += 1
+
+        if has_majority(votes, remaining):
+            break
+
+    if remaining > 0:
+        logger.info("vote decided with %s agents left to ask", remaining)
+
+    return votes
+
+
+@task()
+@profiled
+def image_size_choice(interest_agents, description):
+    def ask(scientist):
+        image_ratio = scientist(
+            prompts.choose_image_size,
+            description=description,
+        )
+        return parse_image_size(image_ratio)
+
+    total_ratios = vote_choice(list(interest_agents.values()), ask)
+
     logger.info("total ratios: %s", total_ratios)
     return total_ratios.most_common(1)[0][0]
 
 
 @task()
+@profiled
 def image_ranking_sort(interests, interest_agents, image_data, count, max_rank_retry=3):
     total_ranking = Counter()
 
@@ -350,22 +644,23 @@ def image_ranking_sort(interests, interest_agents, image_data, count, max_rank_r
 
 
 @task()
+@profiled
 def image_ranking_each_bool(interests, interest_agents, image_data, count, description):
     total_ranking = Counter()
 
-    for image in image_data:
-        caption = image["caption"]
-        filename = image["filename"]
+    image_futures = sample_items(
+        [interest_agents[interest] for interest in interests],
+        image_data,
+        prompts.rank_image_binary,
+        lambda image: {
+            "caption": image["caption"],
+        },
+        name="images",
+    )
 
-        interest_panel = Panel(
-            [interest_agents[interest] for interest in interests], name="images"
-        )
-        panel_results = interest_panel.sample(
-            prompts.rank_image_binary,
-            {
-                "caption": caption,
-            },
-        )
+    for image, futures in zip(image_data, image_futures):
+        filename = image["filename"]
+        panel_results = collect_results(futures)
 
         for interest, ranking in panel_results.items():
             logger.info("ranking for %s interest: %s", interest, ranking)
@@ -382,6 +677,7 @@ def image_ranking_each_bool(interests, interest_agents, image_data, count, descr
 
 
 @task()
+@profiled
 def image_ranking_each_scale(
     interests,
     interest_agents,
@@ -390,26 +686,38 @@ def image_ranking_each_scale(
     description,
     ranking_threshold=misc.ranking.image.threshold,
     max_score=misc.ranking.image.max,
+    early_exit=misc.ranking.image.early_exit,
 ):
+    if early_exit:
+        return image_ranking_early_exit(
+            interests,
+            interest_agents,
+            image_data,
+            count,
+            description,
+            ranking_threshold=ranking_threshold,
+            max_score=max_score,
+        )
+
     selected_images = []
     selected_rankings = Counter()
 
-    for image in image_data:
-        caption = image["caption"]
-        filename = image["filename"]
+    image_futures = sample_items(
+        [interest_agents[interest] for interest in interests],
+        image_data,
+        prompts.rank_image_scale,
+        lambda image: {
+            "caption": image["caption"],
+            "description": description,
+            "max_score": max_score,
+        },
+        name="images",
+        result_parser=int_result,
+    )
 
-        interest_panel = Panel(
-            [interest_agents[interest] for interest in interests], name="images"
-        )
-        panel_results = interest_panel.sample(
-            prompts.rank_image_scale,
-            {
-                "caption": caption,
-                "description": description,
-                "max_score": max_score,
-            },
-            result_parser=int_result,
-        )
+    for image, futures in zip(image_data, image_futures):
+        filename = image["filename"]
+        panel_results = collect_results(futures)
         image_rankings = list(panel_results.values())
 
         # image_rankings = [4]
@@ -445,23 +753,174 @@ def image_ranking_each_scale(
     return top_images
 
 
-@task()
-def image_critique_group_bool(critics, context):
+def image_ranking_early_exit(
+    interests,
+    interest_agents,
+    image_data,
+    count,
+    description,
+    ranking_threshold=misc.ranking.image.threshold,
+    max_score=misc.ranking.image.max,
+    min_score=MIN_SCORE,
+):
+    """
+    Rank images the same way as image_ranking_each_scale, but ask the agents one at a time and stop sampling an image
+    as soon as the remaining votes cannot change whether its average meets the threshold. Once count images have
+    passed, the remaining images are skipped. Images that stop early are ranked by the lowest average they could
+    have reached. Scores outside of the scale are clamped to it, so the bounds hold.
+
+    Each vote decides whether the next one is needed, so the agents are always asked one at a time and
+    concurrency.ranking does not apply.
+    """
+    agents = [interest_agents[interest] for interest in interests]
+    selected_rankings = Counter()
+    total_calls = len(agents) * len(image_data)
+    calls = 0
+
+    for image in image_data:
+        filename = image["filename"]
+        if len(selected_rankings) >= count:
+            logger.info("enough images met threshold, skipping image %s", filename)
+            continue
+
+        image_rankings = []
+        for i, agent in enumerate(agents):
+            panel_results = Panel([agent], name="images").sample(
+                prompts.rank_image_scale,
+                {
+                    "caption": image["caption"],
+                    "description": description,
+                    "max_score": max_score,
+                },
+                result_parser=int_result,
+            )
+            calls += 1
+            image_rankings.extend(
+                min(max(score, min_score), max_score)
+                for score in panel_results.values()
+            )
+
+            # the best and worst averages this image can still reach
+            remaining = len(agents) - i - 1
+            best_average = (sum(image_rankings) + remaining * max_score) / len(agents)
+            worst_average = (sum(image_rankings) + remaining * min_score) / len(agents)
+            if remaining > 0 and (
+                best_average < ranking_threshold or worst_average >= ranking_threshold
+            ):
+                logger.debug(
+                    "image %s decided after %s of %s votes",
+                    filename,
+                    i + 1,
+                    len(agents),
+                )
+                break
+
+        # count the votes that were skipped as the lowest score, so an image that exited early is ranked by the lowest
+        # average it could have had, and a few high votes cannot put it ahead of images that every agent scored
+        if len(agents) > 0:
+            missing = len(agents) - len(image_rankings)
+            average_ranking = (sum(image_rankings) + missing * min_score) / len(agents)
+        else:
+            average_ranking = 0
+
+        if average_ranking >= ranking_threshold:
+            logger.info(
+                "image %s met threshold: %s >= %s",
+                filename,
+                average_ranking,
+                ranking_threshold,
+            )
+
+            # counter can only handle integers, so multiply by 10
+            selected_rankings[filename] = int(average_ranking * 10)
+        else:
+            logger.warning(
+                "image %s did not meet threshold: %s < %s",
+                filename,
+                average_ranking,
+                ranking_threshold,
+            )
+
+    logger.info(
+        "early exit image ranking used %s of %s calls, saved %s",
+        calls,
+        total_calls,
+        total_calls - calls,
+    )
+
+    # select the top images
+    top_images = selected_rankings.most_common(count)
+    logger.info("top images: %s", top_images)
+
+    return top_images
+
+
+def image_critique_structured(critics, context, prompt, get_rating):
+    """
+    Ask each critic for their critique and rating in a single reply. Returns the critiques and ratings that could be
+    parsed, along with the critics whose replies could not be parsed, which should be asked again with two prompts.
+    """
     panel = Panel(list(critics.values()), name="critics")
-    critiques = panel.sample(
-        prompts.critique_image_opinion,
+    replies = panel.sample(
+        prompt,
         context,
         result_parser=str_parser,
     )
 
+    critiques = {}
+    ratings = {}
+    for agent_name, reply in replies.items():
+        try:
+            critique, rating = parse_critique(reply)
+            rating = get_rating(rating)
+            if rating is None:
+                raise ValueError("Invalid rating")
+
+            critiques[agent_name] = critique
+            ratings[agent_name] = rating
+        except ValueError:
+            logger.warning("could not parse critique from %s: %s", agent_name, reply)
+
+    remaining = {
+        name: critic for name, critic in critics.items() if critic.name not in critiques
+    }
+    return critiques, ratings, remaining
+
+
+@task()
+@profiled
+def image_critique_group_bool(
+    critics, context, structured=misc.ranking.post.structured
+):
+    critiques = {}
+    ratings = {}
+    if structured:
+        critiques, ratings, critics = image_critique_structured(
+            critics, context, prompts.critique_image_structured_binary, get_bool
+        )
+
+    if len(critics) > 0:
+        # use separate prompts, or fall back to them for the critics that could not be parsed
+        panel = Panel(list(critics.values()), name="critics")
+        critiques = {
+            **critiques,
+            **panel.sample(
+                prompts.critique_image_opinion,
+                context,
+                result_parser=str_parser,
+            ),
+        }
+        ratings = {
+            **ratings,
+            **panel.sample(
+                prompts.critique_image_binary,
+                context,
+            ),
+        }
+
     for agent_name, critique in critiques.items():
         logger.info("critique from %s: %s", agent_name, critique)
 
-    ratings = panel.sample(
-        prompts.critique_image_binary,
-        context,
-    )
-
     for agent_name, rating in ratings.items():
         logger.info("rating from %s: %s", agent_name, rating)
 
@@ -469,23 +928,40 @@ def image_critique_group_bool(critics, context):
 
 
 @task()
-def image_critique_group_scale(critics, context):
-    panel = Panel(list(critics.values()), name="critics")
-    critiques = panel.sample(
-        prompts.critique_image_opinion,
-        context,
-        result_parser=str_parser,
-    )
+@profiled
+def image_critique_group_scale(
+    critics, context, structured=misc.ranking.post.structured
+):
+    critiques = {}
+    ratings = {}
+    if structured:
+        critiques, ratings, critics = image_critique_structured(
+            critics, context, prompts.critique_image_structured_scale, get_number
+        )
+
+    if len(critics) > 0:
+        # use separate prompts, or fall back to them for the critics that could not be parsed
+        panel = Panel(list(critics.values()), name="critics")
+        critiques = {
+            **critiques,
+            **panel.sample(
+                prompts.critique_image_opinion,
+                context,
+                result_parser=str_parser,
+            ),
+        }
+        ratings = {
+            **ratings,
+            **panel.sample(
+                prompts.critique_image_scale,
+                context,
+                result_parser=int_result,
+            ),
+        }
 
     for agent_name, critique in critiques.items():
         logger.info("critique from %s: %s", agent_name, critique)
 
-    ratings = panel.sample(
-        prompts.critique_image_scale,
-        context,
-        result_parser=int_result,
-    )
-
     valid_ratings = []
     for agent_name, rating in ratings.items():
         logger.info("rating from %s: %s", agent_name, rating)
@@ -496,7 +972,7 @@ def image_critique_group_scale(critics, context):
     return critiques, valid_ratings
 
 
-def summarize(post_ratings, post_times, approved_posts, rejected_posts):
+def summarize(post_ratings, post_times, approved_posts, rejected_posts, elapsed=None):
     num_approved = len(approved_posts)
     num_rejected = len(rejected_posts)
 
@@ -519,13 +995,18 @@ def summarize(post_ratings, post_times, approved_posts, rejected_posts):
         average_post_time,
         average_post_time / approval_rate if approval_rate > 0 else 0,
     )
+    if elapsed:
+        hours = elapsed / 3600
+        logger.info(
+            "throughput: %.2f posts per hour, %.2f approved posts per hour",
+            (num_approved + num_rejected) / hours,
+            num_approved / hours,
+        )
 
+    logger.info("agent cache: %s", agent_cache.stats())
 
-@task()
-def rate_post(critics, post_captions, post_path):
-    critiques, ratings = image_critique_group_bool(critics, post_captions)
 
-    # calculate the average rating
+def average_ratings(ratings) -> float:
     rating_values = list(ratings.values())
     if len(rating_values) > 0:
         average_rating = sum(rating_values) / len(rating_values)
@@ -534,6 +1015,50 @@ def rate_post(critics, post_captions, post_path):
         average_rating = 0
         logger.error("no ratings for post")
 
+    return average_rating
+
+
+@task()
+@profiled
+def critique_gate(
+    critics, theme, description, gate_path, threshold=misc.ranking.post.threshold
+) -> bool:
+    """
+    Have the critics rate the post description before any images are generated. The critique prompts only use the
+    theme and description, so a post that would be rejected after rendering can be rejected here instead.
+    """
+    critiques, ratings = image_critique_group_bool(
+        critics, {"theme": theme, "description": description}
+    )
+    average_rating = average_ratings(ratings)
+    approved = average_rating >= threshold
+
+    # save the decision with the post
+    with open(path.join(gate_path, "gate.json"), "w") as f:
+        f.write(
+            dumps(
+                {
+                    "approved": approved,
+                    "average": average_rating,
+                    "critiques": critiques,
+                    "ratings": ratings,
+                    "threshold": threshold,
+                },
+                indent=2,
+            )
+        )
+
+    return approved
+
+
+@task()
+@profiled
+def rate_post(critics, post_captions, post_path):
+    critiques, ratings = image_critique_group_bool(critics, post_captions)
+
+    # calculate the average rating
+    average_rating = average_ratings(ratings)
+
     # save rating and critique
     with open(path.join(post_path, "rating.json"), "w") as f:
         f.write(
@@ -550,21 +1075,118 @@ def rate_post(critics, post_captions, post_path):
     return average_rating
 
 
+def timed_call(fn, *args, **kwargs):
+    """
+    Call fn and return its result along with the time it took.
+    """
+    start = monotonic()
+    result = fn(*args, **kwargs)
+    delta, _ = monotonic_delta(start)
+    return result, delta
+
+
+def start_timed_call(started: dict, key, fn, *args, **kwargs):
+    """
+    Record when a call starts running, then call fn and return its result along with the time it took.
+    """
+    started[key] = monotonic()
+    return timed_call(fn, *args, **kwargs)
+
+
+def wait_timed_call(future, started: dict, key, timeout: float, deadline: float):
+    """
+    Wait for a call made with start_timed_call. The timeout starts when the call does, so calls waiting for a free
+    worker do not use it up, but the wait never goes past the deadline.
+    """
+    while True:
+        start = started.get(key)
+        if start is None:
+            # check again once a second, until the call starts
+            end = min(monotonic() + 1, deadline)
+        else:
+            end = min(start + timeout, deadline)
+
+        try:
+            return future.result(timeout=max(0, end - monotonic()))
+        except TimeoutError:
+            if start is not None or monotonic() >= deadline:
+                raise
+
+
 @task()
-def generate_ideas(interests, interest_agents):
+@profiled
+def generate_ideas(
+    interests,
+    interest_agents,
+    concurrent=misc.concurrency.ideas,
+    timeout=misc.concurrency.timeout,
+    margin=5.0,
+):
+    if concurrent:
+        # each call has its own timeout from when it starts, and the calls that are waiting for a free worker have a
+        # small margin past that to start, so one slow call cannot hold up the post
+        deadline = monotonic() + timeout + margin
+        started = {}
+        futures = {
+            interest: submit_llm(
+                start_timed_call,
+                started,
+                interest,
+                interest_agents[interest],
+                prompts.generate_ideas,
+            )
+            for interest in interests
+        }
+
     ideas = {}
+    latency = {}
     for interest in interests:
         scientist = interest_agents[interest]
         logger.debug("running scientist for interest: %s", interest)
-        idea = scientist(prompts.generate_ideas)
-        logger.info("%s scientist came up with an idea: %s", interest, idea)
+        if concurrent:
+            try:
+                idea, delta = wait_timed_call(
+                    futures[interest], started, interest, timeout, deadline
+                )
+            except TimeoutError:
+                # calls that have already started cannot be stopped, so they are abandoned and left to finish
+                if futures[interest].cancel():
+                    outcome = "cancelled before it started"
+                else:
+                    outcome = "abandoned, the call may still be running"
+
+                logger.error(
+                    "%s scientist did not come up with an idea within %s seconds, %s",
+                    interest,
+                    timeout,
+                    outcome,
+                )
+                latency[scientist.name] = None
+                continue
+        else:
+            idea, delta = timed_call(scientist, prompts.generate_ideas)
+
+        logger.info(
+            "%s scientist came up with an idea in %.2f seconds: %s",
+            interest,
+            delta,
+            idea,
+        )
         ideas[interest] = idea
+        latency[scientist.name] = delta
 
+    logger.info("idea latency by agent: %s", latency)
     logger.debug("ideas: %s", ideas)
+
+    # only calls that timed out can be skipped, so this is only needed when they run concurrently
+    if concurrent and len(ideas) == 0:
+        raise ValueError("no ideas were generated")
+
     return ideas
 
 
 @task()
+@profiled
 def generate_description(interests, social_media_manager, ideas):
     post_description = social_media_manager(
         prompts.generate_description,
@@ -574,6 +1196,552 @@ def generate_description(interests, social_media_manager, ideas):
     return post_description
 
 
+# stages that can be run again for each retry, in order
+RETRY_STAGES = ["parameters", "ideas", "description", "gate", "prompt", "images"]
+POST_STAGES = ["interests", "concepts", "ranking", *RETRY_STAGES]
+
+# the stage to retry from when a pipeline stage fails outside of any checkpoint stage
+FAILED_STAGES = {"plan": RETRY_STAGES[0], "render": "images", "review": "images"}
+
+
+def has_checkpoint_images(checkpoint: Checkpoint) -> bool:
+    """
+    Check whether the checkpoint has images and they are all still in the working path.
+    """
+    images = checkpoint.get("images")
+    if images is None:
+        return False
+
+    return all(path.exists(image) for image, _ in images)
+
+
+def retry_checkpoint(
+    checkpoint: Checkpoint,
+    post_retry: int,
+    reason: str,
+    retry_from: dict[str, str] = misc.posts.retry_from,
+    stage: Optional[str] = None,
+) -> None:
+    """
+    Clear the stages that should be run again for the rejection reason, keeping the earlier stages so they can be
+    reused by the next retry. Unknown reasons run all of the retry stages again. If a stage is given, the post is
+    retried from that stage instead, such as the stage that failed.
+    """
+    stage = stage or retry_from.get(reason, RETRY_STAGES[0])
+    stages = POST_STAGES[POST_STAGES.index(stage) :]
+    logger.info("retrying post from %s stage for reason: %s", stage, reason)
+
+    checkpoint.clear(stages)
+    checkpoint.set("retry", post_retry)
+
+
+def generate_post_images(
+    interests,
+    interest_agents,
+    image_data,
+    count,
+    post_description,
+    post_keywords,
+    save_path=working_path,
+):
+    """
+    Rank the input images, if there are any, or generate new ones in the save path for the post.
+    """
+    if len(image_data) > 0:
+        return image_ranking_each_scale(
+            interests,
+            interest_agents,
+            image_data,
+            count,
+            post_description,
+        )
+
+    # start generating at the most likely size while the agents vote
+    speculative = None
+    if misc.images.speculative:
+        predicted_size = predict_size(interests)
+        logger.info("speculatively generating %s images", predicted_size)
+        speculative = SpeculativeImages(
+            post_keywords, count, predicted_size, save_path=save_path
+        )
+
+    try:
+        image_size = image_size_choice(interest_agents, post_description)
+    except Exception:
+        # do not leave the speculative images running into the next retry
+        if speculative is not None:
+            speculative.resolve(None)
+
+        raise
+
+    save_size_choice(interests, image_size)
+
+    images = None
+    if speculative is not None:
+        images = speculative.resolve(image_size)
+
+    if images is None:
+        logger.warning(
+            "generating %s %s images for post, prompt: %s",
+            count,
+            image_size,
+            post_keywords,
+        )
+        images = do_images(post_keywords, count, size=image_size, save_path=save_path)
+
+    return [(image, None) for image in images]
+
+
+def move_post(working_path: str, post_path: str) -> None:
+    """
+    Move a post out of its working path. If the post path already exists, an earlier attempt was interrupted after
+    moving the same post, so the working path is removed instead of making a second copy.
+    """
+    if path.exists(post_path):
+        logger.warning("post already exists, removing working path: %s", post_path)
+        rmtree(working_path)
+        return
+
+    move(working_path, post_path)
+
+
+class PostJob:
+    """
+    A single post moving through the stages of the pipeline, along with the results of each stage.
+    """
+
+    def __init__(self, checkpoint: Checkpoint):
+        self.checkpoint = checkpoint
+        self.post_id = checkpoint.post_id
+        self.retry = checkpoint.get("retry", 0)
+        self.start_time = monotonic()
+
+        # each post has its own working path, so images for one post can render while another is being rated
+        self.working_path = path.join(working_path, checkpoint.post_id)
+        self.profile = Profile(checkpoint.post_id)
+
+        # filled in by the plan stage
+        self.interests = []
+        self.images = []
+        self.theme = None
+        self.count = 0
+        self.modifier = None
+        self.ideas = {}
+        self.description = None
+        self.keywords = None
+        self.social_media_manager = None
+        self.art_critic = None
+        self.interest_agents = {}
+
+        # filled in by the render stage
+        self.top_images = []
+
+
+class PostRunner:
+    """
+    Run the plan, render, and review stages for each post, keeping track of the results.
+
+    The stages for a post can run on different threads, so each stage reports to its own trace, named after the post
+    and the stage, rather than one trace for the whole post.
+    """
+
+    def __init__(
+        self,
+        approval_threshold,
+        max_post_retry,
+        min_image_count,
+        max_image_count,
+        min_interest_count,
+        max_interest_count,
+        post_interests,
+        post_format,
+        post_state,
+        critique_gate=misc.ranking.post.gate,
+    ):
+        self.approval_threshold = approval_threshold
+        self.critique_gate = critique_gate
+        self.max_post_retry = max_post_retry
+        self.min_image_count = min_image_count
+        self.max_image_count = max_image_count
+        self.min_interest_count = min_interest_count
+        self.max_interest_count = max_interest_count
+        self.post_interests = post_interests
+        self.post_format = post_format
+        self.post_state = post_state
+        self.state_lock = Lock()
+
+        self.post_ratings = []
+        self.post_times = []
+        self.approved_posts = []
+        self.rejected_posts = []
+        self.start_time = monotonic()
+
+    @property
+    def stages(self):
+        return [
+            ("plan", self.profile_job("plan", self.plan)),
+            ("render", self.profile_job("render", self.render)),
+            ("review", self.profile_job("review", self.review)),
+        ]
+
+    def profile_job(self, stage, fn):
+        """
+        Record the stages run for a job to its profile, so each post has its own.
+        """
+
+        def run(job: PostJob):
+            with activate_profile(job.profile), profile_stage(stage):
+                return fn(job)
+
+        return run
+
+    def save_profile(self, job: PostJob, post_path: str):
+        job.profile.retries = job.retry
+        try:
+            makedirs(post_path, exist_ok=True)
+            job.profile.save(path.join(post_path, "profile.json"))
+        except OSError:
+            logger.exception("failed to save profile for post: %s", job.post_id)
+
+    def save_failed_profile(self, job: PostJob, reason: str):
+        """
+        Save the profile for an attempt that ended without a post to the rejected folder, so every attempt has one.
+        """
+        failed_slug = f"{job.post_id}_{job.retry}_{sanitize_name(reason)}"
+        self.save_profile(job, path.join(rejected_path, failed_slug))
+
+    def jobs(self, concept_count):
+        """
+        Resume any posts that were interrupted, then start new ones until there are enough.
+        """
+        checkpoints = load_checkpoints()
+        for _ in range(concept_count):
+            checkpoint = checkpoints.pop(0) if len(checkpoints) > 0 else Checkpoint()
+            yield PostJob(checkpoint)
+
+    def summarize(self):
+        summarize(
+            self.post_ratings,
+            self.post_times,
+            self.approved_posts,
+            self.rejected_posts,
+            elapsed=monotonic() - self.start_time,
+        )
+
+    def next_attempt(self, job: PostJob, report_output):
+        if job.retry >= self.max_post_retry:
+            logger.error("max retries exceeded for post: %s", job.post_id)
+            job.checkpoint.remove()
+            report_output({"status": "failed", "reason": "max retries exceeded"})
+            return None
+
+        run_profile.record_retry()
+        self.summarize()
+        return "plan"
+
+    def reject(self, job: PostJob, reason: str, report_output):
+        self.rejected_posts.append(1)
+        job.retry += 1
+        retry_checkpoint(job.checkpoint, job.retry, reason)
+        return self.next_attempt(job, report_output)
+
+    def fail(self, job: PostJob, stage: str, err: Exception, report_output):
+        """
+        Retry a post after one of its stages raised an error. Errors use up a retry like rejections do, so a post that
+        keeps failing is given up on after the max retries instead of being run again forever.
+        """
+        logger.exception("failed to process post: %s", job.post_id)
+        report_output(
+            {
+                "status": "failed",
+                "reason": str(err),
+                "error": type(err).__name__,
+            }
+        )
+
+        # run the failed stage and the ones after it again, so the next attempt does not replay the same inputs
+        failed_stage = job.checkpoint.failed or FAILED_STAGES[stage]
+        job.checkpoint.failed = None
+        self.save_failed_profile(job, "error")
+        job.retry += 1
+        retry_checkpoint(job.checkpoint, job.retry, "error", stage=failed_stage)
+        return self.next_attempt(job, report_output)
+
+    def plan(self, job: PostJob):
+        """
+        Pick the interests and theme for the post, then write the ideas, description, and image prompt.
+        """
+        checkpoint = job.checkpoint
+        with trace(job.post_id, "feedme.post.plan") as (report_args, report_output):
+            try:
+                job.start_time = monotonic()
+
+                # keep the working path if the images are being resumed
+                if not has_checkpoint_images(checkpoint):
+                    checkpoint.clear(["images"])
+                    if path.exists(job.working_path):
+                        logger.warning("removing existing post at %s", job.working_path)
+                        rmtree(job.working_path)
+
+                make_post_paths()
+                makedirs(job.working_path, exist_ok=True)
+
+                job.interests = checkpoint.run(
+                    "interests",
+                    get_random_interest,
+                    randint(self.min_interest_count, self.max_interest_count),
+                    interests=self.post_interests,
+                )
+                logger.info(
+                    "planning post %s (retry %s) with interests: %s",
+                    job.post_id,
+                    job.retry,
+                    job.interests,
+                )
+                report_args(job.interests, self.post_format, retry=job.retry)
+
+                concept_agents = {
+                    interest: InterestAgent(interest, **self.post_state)
+                    for interest in job.interests
+                }
+                concepts = checkpoint.run("concepts", generate_concepts, concept_agents)
+                top_concepts = checkpoint.run(
+                    "ranking", concept_ranking, concept_agents, concepts
+                )
+                if len(top_concepts) == 0:
+                    logger.error("no top concepts found")
+                    checkpoint.remove()
+                    self.save_failed_profile(job, "no top concepts")
+                    report_output({"status": "failed", "reason": "no top concepts"})
+                    return None
+
+                job.theme = cleanup_sentence(top_concepts[0][0], trailing_period=False)
+
+                # extract parameters
+                parameters = checkpoint.run(
+                    "parameters",
+                    lambda: {
+                        "count": randint(self.min_image_count, self.max_image_count),
+                        "modifier": choice(list(misc.modifiers.values())),
+                    },
+                )
+                job.count = parameters["count"]
+                job.modifier = parameters["modifier"]
+
+                # set up agents
+                agent_context = {
+                    "count": job.count,
+                    "modifier": job.modifier,
+                    "post_format": self.post_format,
+                    "theme": job.theme,
+                    **self.post_state,
+                }
+
+                job.social_media_manager = CachedAgent(
+                    "social media manager",
+                    agents.backstory["Social Media Manager"],
+                    agent_context,
+                    manager_llm,
+                    misc.llms.manager,
+                )
+                job.art_critic = CachedAgent(
+                    "art critic",
+                    agents.backstory["Art Critic"],
+                    agent_context,
+                    creative_llm,
+                    misc.llms.creative,
+                )
+                job.interest_agents = {
+                    interest: InterestAgent(interest, **agent_context)
+                    for interest in job.interests
+                }
+
+                job.ideas = checkpoint.run(
+                    "ideas", generate_ideas, job.interests, job.interest_agents
+                )
+                job.description = checkpoint.run(
+                    "description",
+                    lambda: cleanup_sentence(
+                        generate_description(
+                            job.interests, job.social_media_manager, job.ideas
+                        )
+                    ),
+                )
+
+                # reject weak descriptions before spending any time on images
+                if self.critique_gate:
+                    critics = {
+                        "art critic": job.art_critic,
+                        **job.interest_agents,
+                    }
+                    approved = checkpoint.run(
+                        "gate",
+                        critique_gate,
+                        critics,
+                        job.theme,
+                        job.description,
+                        job.working_path,
+                        threshold=self.approval_threshold,
+                    )
+                    if not approved:
+                        # keep the decision, the working path is cleared for the next attempt
+                        gate_slug = sanitize_name(job.theme)[:50]
+                        gate_slug += f"_{job.post_id}_{job.retry}"
+                        gate_path = path.join(rejected_path, gate_slug)
+                        logger.error("rejecting post before images: %s", gate_path)
+                        self.save_profile(job, job.working_path)
+                        move_post(job.working_path, gate_path)
+                        report_output({"status": "failed", "reason": "critique gate"})
+                        return self.reject(job, "critique gate", report_output)
+
+                # summarize the post
+                prompt_agent = choice(list(job.interest_agents.values()))
+                logger.info("using %s to generate post prompt", prompt_agent.name)
+                job.keywords = checkpoint.run(
+                    "prompt", generate_prompt, prompt_agent, job.description
+                )
+                logger.info("post image prompt: %s", job.keywords)
+                report_output({"status": "planned", "theme": job.theme})
+            except Exception as err:
+                return self.fail(job, "plan", err, report_output)
+
+        return "render"
+
+    def render(self, job: PostJob):
+        """
+        Generate or rank the images for the post.
+        """
+        checkpoint = job.checkpoint
+        with trace(job.post_id, "feedme.post.render") as (report_args, report_output):
+            report_args(job.keywords, job.count)
+            try:
+                # download images
+                if len(job.images) > 0:
+                    download_input_images(job.images, job.working_path)
+
+                    # load captions and sizes
+                    image_data = get_image_data(job.working_path)
+                    logger.info("loaded image captions: %s", image_data)
+                else:
+                    image_data = []
+
+                # add images to the post or generate new ones
+                job.top_images = checkpoint.run(
+                    "images",
+                    generate_post_images,
+                    job.interests,
+                    job.interest_agents,
+                    image_data,
+                    job.count,
+                    job.description,
+                    job.keywords,
+                    save_path=job.working_path,
+                )
+            except Exception as err:
+                return self.fail(job, "render", err, report_output)
+
+            # make sure there are enough images
+            if len(job.top_images) == 0:
+                logger.error(
+                    "not enough images for post: %s < %s",
+                    len(job.top_images),
+                    job.count,
+                )
+                report_output({"status": "failed", "reason": "not enough images"})
+                return self.reject(job, "not enough images", report_output)
+
+            report_output({"status": "rendered", "images": len(job.top_images)})
+
+        return "review"
+
+    def review(self, job: PostJob):
+        """
+        Have the critics rate the post, then approve and publish it or send it back for another attempt.
+        """
+        with trace(job.post_id, "feedme.post.review") as (report_args, report_output):
+            report_args(job.theme, job.description)
+            try:
+                # compile the post
+                post = {
+                    "title": job.theme,
+                    "description": job.description,
+                    "files": [path.basename(image) for image, _ in job.top_images],
+                    "keywords": job.keywords,
+                }
+                logger.info("post: %s", post)
+
+                post_hash = hash_post(post)
+                post_slug = sanitize_name(job.theme)[:50] + "_" + post_hash
+
+                # save the post data and ideas
+                with open(path.join(job.working_path, "post.json"), "w") as f:
+                    f.write(dumps(post, indent=2))
+
+                with open(path.join(job.working_path, "ideas.json"), "w") as f:
+                    f.write(dumps(job.ideas, indent=2))
+
+                # have the art critic and the scientists rate the post
+                critics = {
+                    "art critic": job.art_critic,
+                    **job.interest_agents,
+                }
+                average_rating = rate_post(critics, post, job.working_path)
+
+                # accumulate average rating and stop the timer
+                self.post_ratings.append(average_rating)
+                delta, _ = monotonic_delta(job.start_time)
+                self.post_times.append(delta)
+
+                # move the post to the approved or rejected folder as the last step, then update the checkpoint
+                if average_rating < self.approval_threshold:
+                    post_path = path.join(rejected_path, post_slug)
+                    logger.error("rejecting post: %s", post_path)
+                    self.save_profile(job, job.working_path)
+                    move_post(job.working_path, post_path)
+                    report_output({"status": "failed", "reason": "low rating"})
+                    return self.reject(job, "low rating", report_output)
+
+                post_path = path.join(approved_path, post_slug)
+                logger.warning("approving post: %s", post_path)
+                move_post(job.working_path, post_path)
+                job.checkpoint.remove()
+                self.approved_posts.append(post_path)
+            except Exception as err:
+                return self.fail(job, "review", err, report_output)
+
+            # the post is finished, so do not make it again if publishing fails
+            try:
+                # post to Civitai or save to HTML
+                do_post(post_slug, job.description, post_hash, post)
+                self.save_profile(job, post_path)
+
+                logger.info("finished processing post: %s", job.post_id)
+                report_output(
+                    {
+                        "status": "approved",
+                        "post": post,
+                        "rating": average_rating,
+                    }
+                )
+
+                # update state
+                with self.state_lock:
+                    self.post_state = update_state("approved", post, self.post_state)
+                    save_state(self.post_state)
+            except Exception as err:
+                logger.exception("failed to publish post: %s", post_path)
+                report_output(
+                    {
+                        "status": "failed",
+                        "reason": str(err),
+                        "error": type(err).__name__,
+                    }
+                )
+
+        self.summarize()
+        return None
+
+
 def main(
     approval_threshold=misc.ranking.post.threshold,
     concept_count=misc.posts.count,
@@ -585,12 +1753,9 @@ def main(
     post_interests=None,
     post_format=None,
     post_state=None,
+    pipeline=misc.concurrency.pipeline,
+    pipeline_depth=misc.concurrency.pipeline_depth,
 ):
-    post_ratings = []
-    post_times = []
-    approved_posts = []
-    rejected_posts = []
-
     # TODO: pick per post
     if post_format is None:
         post_format = choice(misc.formats)
@@ -598,246 +1763,39 @@ def main(
     if post_state is None:
         post_state = load_state()
 
-    for _ in range(concept_count):
-        interests = get_random_interest(
-            randint(min_interest_count, max_interest_count), interests=post_interests
-        )
-        logger.info("selected interests: %s", interests)
-
-        interest_agents = {
-            interest: InterestAgent(interest, **post_state) for interest in interests
-        }
-
-        with trace(post_format, "feedme.post") as (report_args, report_output):
-            report_args(interests, post_format)
-
-            concepts = generate_concepts(interest_agents)
-            top_concepts = concept_ranking_each_scale(interest_agents, concepts)
-            if len(top_concepts) == 0:
-                logger.error("no top concepts found")
-                continue
-
-            theme = cleanup_sentence(top_concepts[0][0], trailing_period=False)
-            input = {
-                "interests": interests,
-                "images": [],
-                "theme": theme,
-            }
-
-            post_retry = 0
-            while post_retry < max_post_retry:
-                summarize(post_ratings, post_times, approved_posts, rejected_posts)
-
-                with trace(str(post_retry), "feedme.post.retry") as (
-                    report_args_retry,
-                    report_output_retry,
-                ):
-                    try:
-                        logger.info(
-                            "processing input (retry %s): %s", post_retry, input
-                        )
-                        if path.exists(working_path):
-                            logger.warning("removing existing post at %s", working_path)
-                            rmtree(working_path)
-
-                        make_post_paths()
-
-                        # start timer
-                        start_time = monotonic()
-
-                        # extract parameters
-                        modifier = choice(list(misc.modifiers.values()))
-                        count = randint(min_image_count, max_image_count)
-                        interests = input["interests"]
-                        theme = input["theme"]
-
-                        # download images
-                        images = input["images"]
-                        if len(images) > 0:
-                            download_input_images(images, working_path)
-
-                            # load captions and sizes
-                            image_data = get_image_data(working_path)
-                            logger.info("loaded image captions: %s", image_data)
-                        else:
-                            image_data = []
-
-                        # set up agents
-                        agent_context = {
-                            "count": count,
-                            "modifier": modifier,
-                            "post_format": post_format,
-                            "theme": theme,
-                            **post_state,
-                        }
-
-                        report_args_retry(**agent_context)
-
-                        social_media_manager = Agent(
-                            "social media manager",
-                            agents.backstory["Social Media Manager"],
-                            agent_context,
-                            manager_llm,
-                        )
-                        art_critic = Agent(
-                            "art critic",
-                            agents.backstory["Art Critic"],
-                            agent_context,
-                            creative_llm,
-                        )
-                        interest_agents = {
-                            interest: InterestAgent(interest, **agent_context)
-                            for interest in interests
-                        }
-
-                        ideas = generate_ideas(interests, interest_agents)
-                        post_description = generate_description(
-                            interests, social_media_manager, ideas
-                        )
-                        post_description = cleanup_sentence(post_description)
-
-                        # run the agents
-                        # summarize the post
-                        prompt_agent = choice(list(interest_agents.values()))
-                        logger.info(
-                            "using %s to generate post prompt", prompt_agent.name
-                        )
-                        post_keywords = generate_prompt(prompt_agent, post_description)
-                        logger.info("post image prompt: %s", post_keywords)
-
-                        # add images to the post or generate new ones
-                        if len(image_data) > 0:
-                            top_images = image_ranking_each_scale(
-                                interests,
-                                interest_agents,
-                                image_data,
-                                count,
-                                post_description,
-                            )
-                        else:
-                            image_size = image_size_choice(
-                                interest_agents, post_description
-                            )
-                            logger.warning(
-                                "generating %s %s images for post, prompt: %s",
-                                count,
-                                image_size,
-                                post_keywords,
-                            )
-                            set_save_path(working_path)
-                            top_images = [
-                                (image, None)
-                                for image in do_images(
-                                    post_keywords, count, size=image_size
-                                )
-                            ]
-
-                        # make sure there are enough images
-                        if len(top_images) == 0:
-                            logger.error(
-                                "not enough images for post: %s < %s",
-                                len(top_images),
-                                count,
-                            )
-                            rejected_posts.append(1)
-                            post_retry += 1
-                            report_output_retry(
-                                {"status": "failed", "reason": "not enough images"}
-                            )
-                            continue
-
-                        # compile the post
-                        post = {
-                            "title": theme,
-                            "description": post_description,
-                            "files": [path.basename(image) for image, _ in top_images],
-                            "keywords": post_keywords,
-                        }
-                        logger.info("post: %s", post)
-
-                        # move post files to their own folder
-                        post_hash = hash_post(post)
-                        post_slug = sanitize_name(theme)[:50] + "_" + post_hash
-                        post_path = path.join(approval_path, post_slug)
-                        move(working_path, post_path)
-
-                        # save the post data and ideas
-                        with open(path.join(post_path, "post.json"), "w") as f:
-                            f.write(dumps(post, indent=2))
-
-                        with open(path.join(post_path, "ideas.json"), "w") as f:
-                            f.write(dumps(ideas, indent=2))
-
-                        # have the art critic and the scientists rate the post
-                        critics = {
-                            "art critic": art_critic,
-                            **interest_agents,
-                        }
-                        average_rating = rate_post(critics, post, post_path)
-
-                        # accumulate average rating and stop the timer
-                        post_ratings.append(average_rating)
-                        delta, _ = monotonic_delta(start_time)
-                        post_times.append(delta)
-
-                        # move the post to the approved or rejected folder
-                        if average_rating < approval_threshold:
-                            logger.error("rejecting post: %s", post_path)
-                            move(post_path, rejected_path)
-                            rejected_posts.append(1)
-                            post_retry += 1
-                            report_output_retry(
-                                {
-                                    "status": "failed",
-                                    "reason": "low rating",
-                                }
-                            )
-                            continue
-
-                        logger.warning("approving post: %s", post_path)
-                        move(post_path, approved_path)
-                        approved_posts.append(path.join(approved_path, post_slug))
-
-                        # post to Civitai or save to HTML
-                        do_post(post_slug, post_description, post_hash, post)
-
-                        logger.info("finished processing input: %s", input)
-                        report_output_retry(
-                            {
-                                "status": "approved",
-                                "post": post,
-                                "rating": average_rating,
-                            }
-                        )
-                        report_output(
-                            {
-                                "status": "approved",
-                                "post": post,
-                                "rating": average_rating,
-                            }
-                        )
-
-                        # update state
-                        post_state = update_state("approved", post, post_state)
-                        save_state(post_state)
-
-                        # move on to the next post
-                        break
-                    except Exception as err:
-                        logger.exception("failed to process input: %s", input)
-                        report_output_retry(
-                            {
-                                "status": "failed",
-                                "reason": str(err),
-                                "error": type(err).__name__,
-                            }
-                        )
-
-            if post_retry >= max_post_retry:
-                report_output({"status": "failed", "reason": "max retries exceeded"})
+    runner = PostRunner(
+        approval_threshold,
+        max_post_retry,
+        min_image_count,
+        max_image_count,
+        min_interest_count,
+        max_interest_count,
+        post_interests,
+        post_format,
+        post_state,
+    )
 
-    summarize(post_ratings, post_times, approved_posts, rejected_posts)
-    return approved_posts
+    try:
+        with trace(post_format, "feedme.posts") as (report_args, report_output):
+            report_args(concept_count, post_format, pipeline=pipeline)
+
+            if pipeline:
+                # plan the next post while the images for this one render and the last one is rated
+                logger.info("running posts in a pipeline with depth %s", pipeline_depth)
+                Pipeline(runner.stages, depth=pipeline_depth).run(
+                    runner.jobs(concept_count)
+                )
+            else:
+                run_stages(runner.stages, runner.jobs(concept_count))
+
+            report_output({"approved": runner.approved_posts})
+    finally:
+        # stop the promptgen workers here, rather than leaving them to interpreter teardown
+        shutdown_promptgen()
+
+    runner.summarize()
+    logger.info("stage profile:\n%s", run_profile.table())
+    return runner.approved_posts
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+from dataclasses import asdict
+from json import dump, load
+from logging import getLogger
+from os import listdir, makedirs, path, remove, replace
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from feedme.data import get_save_path, misc, prompts
+from feedme.utils.misc import hash_post
+
+logger = getLogger(__name__)
+
+# make sure this is always saved to the root path, not within each post
+checkpoint_root = path.join(get_save_path(), "checkpoints")
+
+
+def prompts_version() -> str:
+    """
+    Hash the current prompts, so checkpoints made with different prompts are not resumed.
+    """
+    return hash_post(asdict(prompts))
+
+
+class Checkpoint:
+    """
+    Save the output of each stage for a single post, so an interrupted run can resume from the last completed stage.
+    """
+
+    post_id: str
+    root: str
+    stages: Dict[str, Any]
+    version: str
+    running: Optional[str]
+    failed: Optional[str]
+
+    def __init__(
+        self,
+        post_id: Optional[str] = None,
+        root: str = checkpoint_root,
+        stages: Optional[Dict[str, Any]] = None,
+        version: Optional[str] = None,
+        enabled: bool = misc.posts.checkpoint,
+    ):
+        self.post_id = post_id or uuid4().hex
+        self.root = root
+        self.stages = stages or {}
+        self.version = version or prompts_version()
+        self.enabled = enabled
+        # the stage that is running, and the last stage that raised an error
+        self.running = None
+        self.failed = None
+
+    @property
+    def file(self) -> str:
+        return path.join(self.root, f"{self.post_id}.json")
+
+    def has(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def get(self, stage: str, default: Any = None) -> Any:
+        return self.stages.get(stage, default)
+
+    def set(self, stage: str, value: Any) -> Any:
+        self.stages[stage] = value
+        self.save()
+        return value
+
+    def run(self, stage: str, fn, *args, **kwargs) -> Any:
+        """
+        Return the saved output of a stage, or run the stage and save its output. If the stage raises an error, it is
+        recorded in failed until the next stage runs, so the caller knows which stage to run again.
+        """
+        if stage in self.stages:
+            logger.info("resuming %s stage from checkpoint %s", stage, self.post_id)
+            return self.stages[stage]
+
+        self.running = stage
+        self.failed = None
+        try:
+            value = fn(*args, **kwargs)
+        except Exception:
+            self.failed = stage
+            raise
+        finally:
+            self.running = None
+
+        return self.set(stage, value)
+
+    def clear(self, stages: List[str]) -> None:
+        for stage in stages:
+            self.stages.pop(stage, None)
+
+        self.save()
+
+    def save(self) -> None:
+        if not self.enabled:
+            return
+
+        makedirs(self.root, exist_ok=True)
+        temp_file = f"{self.file}.tmp"
+        with open(temp_file, "w") as f:
+            dump(
+                {
+                    "post_id": self.post_id,
+                    "stages": self.stages,
+                    "version": self.version,
+                },
+                f,
+            )
+
+        replace(temp_file, self.file)
+
+    def remove(self) -> None:
+        self.stages = {}
+        if path.exists(self.file):
+            remove(self.file)
+
+
+def load_checkpoints(
+    root: str = checkpoint_root, enabled: bool = misc.posts.checkpoint
+) -> List[Checkpoint]:
+    """
+    Load the checkpoints for any posts that were interrupted, oldest first. Checkpoints from a different version of
+    the prompts are removed.
+    """
+    if not enabled or not path.exists(root):
+        return []
+
+    version = prompts_version()
+    files = [path.join(root, f) for f in listdir(root) if f.endswith(".json")]
+    files.sort(key=path.getmtime)
+
+    checkpoints = []
+    for file in files:
+        try:
+            with open(file, "r") as f:
+                data = load(f)
+        except (OSError, ValueError):
+            logger.exception("failed to load checkpoint: %s", file)
+            continue
+
+        if data.get("version") != version:
+            logger.warning("removing checkpoint from different prompts: %s", file)
+            remove(file)
+            continue
+
+        checkpoints.append(
+            Checkpoint(
+                data["post_id"], root=root, stages=data["stages"], version=version
+            )
+        )
+
+    logger.info("loaded %s checkpoints", len(checkpoints))
+    return checkpoints
@@ -0,0 +1,61 @@
+from collections import Counter
+from json import dump, load
+from logging import getLogger
+from os import path, replace
+from threading import Lock
+from typing import Dict, List
+
+from feedme.data import get_save_path
+
+logger = getLogger(__name__)
+
+SizeHistory = Dict[str, Dict[str, int]]
+
+# saved to the root path, next to the state
+size_path = path.join(get_save_path(), "sizes.json")
+
+# posts can finish their size votes at the same time, so only one should update the history at once
+size_lock = Lock()
+
+
+def load_size_history() -> SizeHistory:
+    if not path.exists(size_path):
+        return {}
+
+    with open(size_path) as f:
+        return load(f)
+
+
+def save_size_choice(interests: List[str], size: str) -> None:
+    """
+    Count the chosen image size for each of the interests. The history is written to a temporary file and then
+    replaced, so it is never read while partly written.
+    """
+    with size_lock:
+        history = load_size_history()
+        for interest in interests:
+            interest_sizes = history.setdefault(interest, {})
+            interest_sizes[size] = interest_sizes.get(size, 0) + 1
+
+        temp_path = f"{size_path}.tmp"
+        with open(temp_path, "w") as f:
+            logger.debug("saving size history: %s", history)
+            dump(history, f)
+
+        replace(temp_path, size_path)
+
+
+def predict_size(interests: List[str], default: str = "landscape") -> str:
+    """
+    Predict the image size that will be chosen for a group of interests, based on previous choices.
+    """
+    history = load_size_history()
+
+    total_sizes = Counter()
+    for interest in interests:
+        total_sizes.update(history.get(interest, {}))
+
+    if len(total_sizes) == 0:
+        return default
+
+    return total_sizes.most_common(1)[0][0]
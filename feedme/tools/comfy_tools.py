@@ -1,44 +1,85 @@
 # This is an example that uses the websockets api to know when a prompt execution is done
 # Once the prompt execution is done it downloads the images using the /history endpoint
 
-import io
 import json
 import urllib.parse
 import urllib.request
 import uuid
 from logging import getLogger
-from os import environ, path
+from os import environ, path, remove, replace
 from random import choice, randint
-from typing import List
+from shutil import copyfileobj
+from threading import Event
+from typing import List, Optional
 
 import websocket  # NOTE: websocket-client (https://github.com/websocket-client/websocket-client)
 from jinja2 import Environment, FileSystemLoader, select_autoescape
-from PIL import Image
 from traceloop.sdk.decorators import tool
 
 from feedme.data import data_base, get_save_path, misc, prompts
-from feedme.tools.onnx_tools import generate_batches, generate_cfg, generate_steps
+from feedme.tools.onnx_tools import (
+    DOWNLOAD_CHUNK,
+    generate_batches,
+    generate_cfg,
+    generate_steps,
+    run_batches,
+)
 
 logger = getLogger(__name__)
 
 server_address = environ["COMFY_API"]
-client_id = str(uuid.uuid4())
 
 
-def queue_prompt(prompt):
+def queue_prompt(prompt, client_id):
     p = {"prompt": prompt, "client_id": client_id}
     data = json.dumps(p).encode("utf-8")
     req = urllib.request.Request("http://{}/prompt".format(server_address), data=data)
     return json.loads(urllib.request.urlopen(req).read())
 
 
-def get_image(filename, subfolder, folder_type):
+def save_image(filename, subfolder, folder_type, dest):
+    """
+    Stream an image from the server straight to disk, keeping the original bytes.
+    """
     data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
     url_values = urllib.parse.urlencode(data)
-    with urllib.request.urlopen(
-        "http://{}/view?{}".format(server_address, url_values)
-    ) as response:
-        return response.read()
+    temp_path = dest + ".part"
+    try:
+        with urllib.request.urlopen(
+            "http://{}/view?{}".format(server_address, url_values)
+        ) as response:
+            with open(temp_path, "wb") as f:
+                copyfileobj(response, f, DOWNLOAD_CHUNK)
+    except Exception:
+        if path.exists(temp_path):
+            remove(temp_path)
+
+        raise
+
+    replace(temp_path, dest)
+
+
+def cancel_prompt(prompt_id):
+    """
+    Remove a prompt from the queue if it has not started yet, or interrupt it if it is running.
+    """
+    with urllib.request.urlopen("http://{}/queue".format(server_address)) as response:
+        queue = json.loads(response.read())
+
+    # queue items are [number, prompt_id, prompt, extra_data, outputs]
+    running = [item[1] for item in queue.get("queue_running", [])]
+    if prompt_id in running:
+        # interrupt stops whichever prompt is running, so only send it when that is this prompt
+        req = urllib.request.Request(
+            "http://{}/interrupt".format(server_address), data=b"", method="POST"
+        )
+    else:
+        data = json.dumps({"delete": [prompt_id]}).encode("utf-8")
+        req = urllib.request.Request(
+            "http://{}/queue".format(server_address), data=data
+        )
+
+    urllib.request.urlopen(req).read()
 
 
 def get_history(prompt_id):
@@ -48,11 +89,25 @@ def get_history(prompt_id):
         return json.loads(response.read())
 
 
-def get_images(ws, prompt):
-    prompt_id = queue_prompt(prompt)["prompt_id"]
+def get_images(ws, prompt, client_id, cancel: Optional[Event] = None):
+    prompt_id = queue_prompt(prompt, client_id)["prompt_id"]
     output_images = {}
+
+    if cancel is not None:
+        # wake up periodically to check whether the prompt has been cancelled
+        ws.settimeout(1)
+
     while True:
-        out = ws.recv()
+        if cancel is not None and cancel.is_set():
+            logger.warning("cancelling prompt: %s", prompt_id)
+            cancel_prompt(prompt_id)
+            return {}
+
+        try:
+            out = ws.recv()
+        except websocket.WebSocketTimeoutException:
+            continue
+
         if isinstance(out, str):
             message = json.loads(out)
             if message["type"] == "executing":
@@ -62,34 +117,46 @@ def get_images(ws, prompt):
         else:
             continue  # previews are binary data
 
+    # return the image details, so they can be downloaded straight to disk
     history = get_history(prompt_id)[prompt_id]
-    for o in history["outputs"]:
-        for node_id in history["outputs"]:
-            node_output = history["outputs"][node_id]
-            if "images" in node_output:
-                images_output = []
-                for image in node_output["images"]:
-                    image_data = get_image(
-                        image["filename"], image["subfolder"], image["type"]
-                    )
-                    images_output.append(image_data)
-            output_images[node_id] = images_output
+    for node_id, node_output in history["outputs"].items():
+        if "images" in node_output:
+            output_images[node_id] = node_output["images"]
 
     return output_images
 
 
 @tool(name="generate_image")
-def generate_image_tool(prompt, count, size="landscape"):
+def generate_image_tool(prompt, count, size="landscape", cancel=None, save_path=None):
+    def generate_batch(i, batch_count):
+        return generate_images(
+            prompt,
+            batch_count,
+            size,
+            prefix=f"output-{i}",
+            cancel=cancel,
+            save_path=save_path,
+        )
+
     output_paths = []
-    for i, count in enumerate(generate_batches(count + misc.images.extra)):
-        results = generate_images(prompt, count, size, prefix=f"output-{i}")
+    batches = generate_batches(count + misc.images.extra)
+    for results in run_batches(generate_batch, batches, cancel=cancel):
+        if results is None:
+            output_paths.append("Error generating images: cancelled.")
+            break
+
         output_paths.extend(results)
 
     return output_paths
 
 
 def generate_images(
-    prompt: str, count: int, size="landscape", prefix="output"
+    prompt: str,
+    count: int,
+    size="landscape",
+    prefix="output",
+    cancel: Optional[Event] = None,
+    save_path: Optional[str] = None,
 ) -> List[str]:
     cfg = generate_cfg()
     height, width = misc.sizes.get(size, (512, 512))
@@ -122,26 +189,24 @@ def generate_images(
     logger.debug("template workflow: %s", result)
     prompt_workflow = json.loads(result)
 
+    # each call needs its own client ID, since Comfy only sends messages to the latest websocket for each client
+    client_id = str(uuid.uuid4())
     logger.debug("Connecting to Comfy API at %s", server_address)
     ws = websocket.WebSocket()
     ws.connect("ws://{}/ws?clientId={}".format(server_address, client_id))
-    images = get_images(ws, prompt_workflow)
-
-    results = []
-    for node_id in images:
-        for image_data in images[node_id]:
-            image = Image.open(io.BytesIO(image_data))
-            results.append(image)
+    try:
+        images = get_images(ws, prompt_workflow, client_id, cancel=cancel)
+    finally:
+        ws.close()
 
+    save_path = save_path or get_save_path()
     paths: List[str] = []
-    for j, image in enumerate(results):
-        image_path = path.join(get_save_path(), f"{prefix}-{j}.png")
-        with open(image_path, "wb") as f:
-            image_bytes = io.BytesIO()
-            image.save(image_bytes, format="PNG")
-            f.write(image_bytes.getvalue())
-
-        paths.append(image_path)
+    for node_id in images:
+        for image in images[node_id]:
+            image_path = path.join(save_path, f"{prefix}-{len(paths)}.png")
+            logger.info("downloading image %s to: %s", image["filename"], image_path)
+            save_image(image["filename"], image["subfolder"], image["type"], image_path)
+            paths.append(image_path)
 
     return paths
 
@@ -1,12 +1,39 @@
 from json import dumps, loads
 from os import listdir, path
 from re import sub
-from typing import Dict, List
+from struct import unpack
+from typing import Dict, List, Optional
 
 from PIL import Image
 
 from feedme.data import get_save_path
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def png_size(image_path: str) -> Optional[tuple[int, int]]:
+    """
+    Read the size of a PNG image from its IHDR chunk, without decoding the image. Returns None if the file is not a
+    PNG.
+    """
+    with open(image_path, "rb") as f:
+        header = f.read(24)
+
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        return None
+
+    width, height = unpack(">II", header[16:24])
+    return width, height
+
+
+def read_image_size(image_path: str) -> tuple[int, int]:
+    size = png_size(image_path)
+    if size is not None:
+        return size
+
+    with Image.open(image_path) as img:
+        return img.size
+
 
 def image_size(filename: str) -> tuple[int, int]:
     """
@@ -15,8 +42,7 @@ def image_size(filename: str) -> tuple[int, int]:
     image_path = path.join(get_save_path(), filename)
 
     if path.exists(image_path):
-        with Image.open(image_path) as img:
-            return img.size
+        return read_image_size(image_path)
 
     raise FileNotFoundError(f"Image file {filename} not found")
 
@@ -47,14 +73,13 @@ def get_image_data(root_path=get_save_path()) -> List[Dict[str, str]]:
     for f in listdir(root_path):
         if path.isfile(path.join(root_path, f)) and f.endswith(".png"):
             image_path = path.join(root_path, f)
-            with Image.open(image_path) as img:
-                images.append(
-                    {
-                        "filename": f,
-                        "size": img.size,
-                        "caption": read_prompt_file(f + ".json", root_path=root_path),
-                    }
-                )
+            images.append(
+                {
+                    "filename": f,
+                    "size": read_image_size(image_path),
+                    "caption": read_prompt_file(f + ".json", root_path=root_path),
+                }
+            )
 
     return dumps(images)
 
@@ -1,18 +1,21 @@
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from json import dumps
 from logging import getLogger
-from os import environ, path
+from os import environ, path, remove, replace
 from random import choice, randint, random
-from time import sleep
-from typing import List, Literal, Sequence
-from urllib.request import urlretrieve
+from threading import Event, Lock
+from time import monotonic, sleep
+from typing import Callable, List, Literal, Optional, Tuple
 
 import requests
 from packit.tracing import trace
-from PIL import Image
+from requests.adapters import HTTPAdapter
 from traceloop.sdk.decorators import tool
+from urllib3.util.retry import Retry
 
 from feedme.data import get_save_path, misc, prompts
+from feedme.utils.profile import record_wait
 
 logger = getLogger(__name__)
 
@@ -20,33 +23,111 @@ ImageSize = Literal["landscape", "portrait", "square"]
 
 onnx_root = environ.get("ONNX_API", None)
 
+# read downloads in chunks, so whole images are never held in memory
+DOWNLOAD_CHUNK = 64 * 1024
+
+session: Optional[requests.Session] = None
+session_lock = Lock()
+
+
+def make_session(
+    pool_size: int, retries: int, backoff: float, backoff_jitter: float
+) -> requests.Session:
+    """
+    Create a session that keeps up to pool_size connections open. Only GET requests are retried, since they can be
+    repeated safely, and only for connection errors and server errors.
+    """
+    retry = Retry(
+        total=retries,
+        allowed_methods=["GET"],
+        backoff_factor=backoff,
+        backoff_jitter=backoff_jitter,
+        status_forcelist=[500, 502, 503, 504],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+
+    new_session = requests.Session()
+    new_session.mount("http://", adapter)
+    new_session.mount("https://", adapter)
+    return new_session
+
+
+def get_session() -> requests.Session:
+    """
+    Get the shared session for the ONNX API, creating it on first use.
+    """
+    global session
+
+    if misc.onnx is None:
+        raise ValueError("onnx config not found")
+
+    with session_lock:
+        if session is None:
+            session = make_session(
+                misc.onnx.pool_size,
+                misc.onnx.get_retries,
+                misc.onnx.backoff,
+                misc.onnx.backoff_jitter,
+            )
+
+        return session
+
+
+def get_timeout() -> Tuple[float, float]:
+    """
+    Get the connect and read timeouts for the ONNX API, so a server that stops responding does not hang the worker.
+    """
+    if misc.onnx is None:
+        raise ValueError("onnx config not found")
+
+    return (misc.onnx.connect_timeout, misc.onnx.read_timeout)
+
 
 @tool(name="generate_image")
 def generate_image_tool(
-    prompt: str, count: int, size: ImageSize = "landscape"
+    prompt: str,
+    count: int,
+    size: ImageSize = "landscape",
+    cancel: Optional[Event] = None,
+    save_path: Optional[str] = None,
 ) -> List[str]:
-    output_paths: List[str] = []
-    for i, count in enumerate(generate_batches(count + misc.images.extra)):
-        results = generate_images(prompt, count, size)
-        if isinstance(results, str):
-            output_paths.append(results)
+    def generate_batch(i: int, batch_count: int) -> List[str]:
+        return generate_images(
+            prompt,
+            batch_count,
+            size,
+            prefix=f"output-{i}",
+            cancel=cancel,
+            save_path=save_path,
+        )
 
-        for j, image in enumerate(results):
-            if isinstance(image, str):
-                output_paths.append(image)
-                continue
+    output_paths: List[str] = []
+    batches = generate_batches(count + misc.images.extra)
+    for results in run_batches(generate_batch, batches, cancel=cancel):
+        if results is None:
+            output_paths.append("Error generating images: cancelled.")
+            break
 
-            image_path = f"{get_save_path()}/output-{i}-{j}.png"
-            logger.info("saving image %s to: %s", i, image_path)
-            image.save(image_path)
-            output_paths.append(image_path)
+        output_paths.extend(results)
 
     return output_paths
 
 
 def generate_images(
-    prompt: str, count: int, size: ImageSize = "landscape"
-) -> Sequence[Image.Image | str]:
+    prompt: str,
+    count: int,
+    size: ImageSize = "landscape",
+    prefix: str = "output",
+    cancel: Optional[Event] = None,
+    save_path: Optional[str] = None,
+) -> List[str]:
+    """
+    Generate images and download them into the save path, returning the image paths or an error message. The global
+    save path is used if one is not given.
+    """
     # make sure onnx config exists
     if misc.onnx is None:
         raise ValueError("onnx config not found")
@@ -57,26 +138,43 @@ def generate_images(
     dims = misc.sizes.get(size, (512, 512))
     with trace("generate_images", "feedme.onnx") as (report_args, report_result):
         report_args(prompt=prompt, count=count, size=size)
-        job = generate_txt2img(onnx_root, prompt, count, *dims)
+        job, steps = generate_txt2img(onnx_root, prompt, count, *dims)
         if job is None:
             report_result({"status": "error", "reason": "could not get job name"})
             return ["Error generating images: could not get job name."]
 
+        # the job renders every image in the batch, so progress and timing are both measured against its total steps
+        total_steps = steps * count
+        poller = ReadinessPoller(total_steps)
         ready = False
-        for _ in range(int(misc.onnx.retries)):
-            if check_ready(onnx_root, job):
+        while not poller.expired:
+            ready, progress = check_progress(onnx_root, job, total_steps)
+            if ready:
                 logger.debug("image is ready: %s", job)
-                ready = True
                 break
-            else:
-                logger.debug("waiting for image to be ready")
-                sleep(int(misc.onnx.poll))
+
+            wait = poller.next_wait(progress)
+            logger.debug(
+                "waiting %.1fs for image to be ready, progress: %s", wait, progress
+            )
+            if cancel is None:
+                sleep(wait)
+            elif cancel.wait(wait):
+                logger.warning("cancelling image job: %s", job)
+                cancel_job(onnx_root, job)
+                report_result({"status": "cancelled"})
+                return ["Error generating images: cancelled."]
 
         if not ready:
             report_result({"status": "error", "reason": "image not ready in time"})
             return ["Error generating images: image not ready in time."]
 
-        results = download_images(onnx_root, job)
+        idle = poller.finish()
+        logger.debug("image job %s was ready for up to %.1fs before polling", job, idle)
+        record_wait("onnx_idle_wait", idle)
+
+        save_path = save_path or get_save_path()
+        results = download_images(onnx_root, job, path.join(save_path, prefix))
         if results is None or len(results) == 0:
             report_result({"status": "error", "reason": "could not download images"})
             return ["Error generating images: could not download images."]
@@ -84,6 +182,159 @@ def generate_images(
         return results
 
 
+class ReadinessPoller:
+    """
+    Decide how long to wait between readiness checks for a job. Once the server reports that the job has started, the
+    finish time is predicted from how quickly the progress is advancing, or the time per step from earlier jobs, and
+    checked more often as it gets closer. While the job is queued, or past its prediction without making progress,
+    the wait starts short and backs off. The poller expires once the deadline has passed.
+    """
+
+    # seconds per step from earlier jobs, shared between pollers
+    step_time: Optional[float] = None
+    step_lock = Lock()
+
+    def __init__(
+        self,
+        steps: int,
+        min_poll: Optional[float] = None,
+        max_poll: Optional[float] = None,
+        deadline: Optional[float] = None,
+    ):
+        if misc.onnx is None:
+            raise ValueError("onnx config not found")
+
+        self.steps = steps
+        self.min_poll = min_poll or misc.onnx.min_poll
+        self.max_poll = max_poll or misc.onnx.poll
+        self.deadline = (
+            deadline or misc.onnx.deadline or misc.onnx.retries * self.max_poll
+        )
+        self.start = monotonic()
+        self.last_check = self.start
+        self.backoff = self.min_poll
+        # when the progress was first seen to start, and how far along the job was at that point
+        self.started: Optional[float] = None
+        self.started_progress = 0.0
+        self.progress: Optional[float] = None
+        self.finish_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return monotonic() - self.start
+
+    @property
+    def expired(self) -> bool:
+        return self.elapsed >= self.deadline
+
+    def observe(self, progress: Optional[float], now: float) -> bool:
+        """
+        Record the progress from a readiness check and return whether it has advanced since the last check.
+        """
+        if progress is None:
+            return False
+
+        advanced = self.progress is None or progress > self.progress
+        if progress > 0 and self.started is None:
+            self.started = now
+            self.started_progress = progress
+
+        self.progress = max(progress, self.progress or 0.0)
+        return advanced and progress > 0
+
+    def predict(self, now: float) -> Optional[float]:
+        """
+        Predict when the job will finish, as a monotonic time, or None if it has not been seen to start.
+        """
+        if self.started is None or self.progress is None:
+            return None
+
+        rendered = self.progress - self.started_progress
+        if rendered > 0 and now > self.started:
+            rate = rendered / (now - self.started)
+            return now + (1 - self.progress) / rate
+
+        with self.step_lock:
+            step_time = ReadinessPoller.step_time
+
+        if step_time is not None:
+            return now + (1 - self.progress) * self.steps * step_time
+
+        return None
+
+    def next_wait(self, progress: Optional[float] = None) -> float:
+        now = monotonic()
+        self.last_check = now
+        advanced = self.observe(progress, now)
+        self.finish_at = self.predict(now)
+        remaining_deadline = max(0, self.deadline - (now - self.start))
+
+        if advanced:
+            self.backoff = self.min_poll
+
+        if self.finish_at is None or (self.finish_at <= now and not advanced):
+            # back off while the job is queued, or overdue without making progress
+            wait = self.backoff
+            self.backoff = min(self.backoff * 2, self.max_poll)
+        else:
+            # wait for half of the remaining time, so the checks get closer together near the end
+            remaining = self.finish_at - now
+            wait = min(max(remaining / 2, self.min_poll), self.max_poll)
+
+        return min(wait, remaining_deadline)
+
+    def finish(self) -> float:
+        """
+        Return how long the job may have been ready before the last check. If the job was seen to start, the time per
+        step is updated from the time since then, so time spent queued is not counted.
+        """
+        now = monotonic()
+        finished = self.last_check
+        if self.finish_at is not None:
+            finished = min(max(self.finish_at, self.last_check), now)
+
+        steps = self.steps * (1 - self.started_progress)
+        if self.started is not None and steps > 0 and finished > self.started:
+            step_time = (finished - self.started) / steps
+            with self.step_lock:
+                if ReadinessPoller.step_time is None:
+                    ReadinessPoller.step_time = step_time
+                else:
+                    # favor recent jobs, since the server load changes
+                    ReadinessPoller.step_time = (
+                        0.7 * ReadinessPoller.step_time + 0.3 * step_time
+                    )
+
+        return now - finished
+
+
+def run_batches(
+    generate: Callable[[int, int], List[str]],
+    batches: List[int],
+    cancel: Optional[Event] = None,
+    inflight: int = misc.images.inflight,
+) -> List[Optional[List[str]]]:
+    """
+    Call generate(i, count) for each batch, with up to inflight batches running at once so the server always has the
+    next batch queued. Returns the results in batch order. Batches that had not started when cancel was set return
+    None.
+    """
+
+    def run(i: int, batch_count: int) -> Optional[List[str]]:
+        if cancel is not None and cancel.is_set():
+            logger.warning("image generation cancelled before batch %s", i)
+            return None
+
+        return generate(i, batch_count)
+
+    with ThreadPoolExecutor(max_workers=inflight) as pool:
+        futures = [
+            pool.submit(copy_context().run, run, i, batch_count)
+            for i, batch_count in enumerate(batches)
+        ]
+        return [future.result() for future in futures]
+
+
 def generate_batches(
     count: int,
     batch_size: int = misc.images.batch,
@@ -115,7 +366,10 @@ def generate_cfg(
 
 def generate_txt2img(
     host: str, prompt: str, count: int, height: int, width: int
-) -> str:
+) -> Tuple[str, int]:
+    """
+    Submit a txt2img job, returning the job name and the number of steps per image.
+    """
     cfg = generate_cfg()
     steps = generate_steps(min_steps=int(misc.images.steps.min + cfg))
     image_parameters = {
@@ -161,32 +415,75 @@ def generate_txt2img(
         "json": (None, dumps(image_parameters)),
     }
 
-    resp = requests.post(f"{host}/api/txt2img", files=body)
+    resp = get_session().post(f"{host}/api/txt2img", files=body, timeout=get_timeout())
     if resp.status_code == 200:
         json = resp.json()
-        return json.get("name")
+        return json.get("name"), steps
 
     raise ValueError(f"error generating images, status code: {resp.status_code}")
 
 
-def check_ready(host: str, key: str) -> bool:
-    resp = requests.get(f"{host}/api/ready?output={key}")
+def parse_progress(progress, steps: int) -> Optional[float]:
+    """
+    Get the fraction of the job that is done from the progress reported by the server, which may be a fraction, a step
+    count, or an object with the current and total steps.
+    """
+    if isinstance(progress, dict):
+        current = progress.get("current", progress.get("steps"))
+        total = progress.get("total", steps)
+        if isinstance(current, (int, float)) and total:
+            return min(current / total, 1.0)
+
+        return None
+
+    if isinstance(progress, bool) or not isinstance(progress, (int, float)):
+        return None
+
+    if isinstance(progress, float) and progress <= 1.0:
+        return progress
+
+    if steps > 0:
+        return min(progress / steps, 1.0)
+
+    return None
+
+
+def check_progress(host: str, key: str, steps: int = 0) -> Tuple[bool, Optional[float]]:
+    """
+    Check whether a job is ready, along with the fraction of it that is done, if the server reports that.
+    """
+    resp = get_session().get(f"{host}/api/ready?output={key}", timeout=get_timeout())
     if resp.status_code == 200:
         json = resp.json()
+        progress = parse_progress(json.get("progress"), steps)
         ready = json.get("ready", False)
         if ready:
             cancelled = json.get("cancelled", False)
             failed = json.get("failed", False)
-            return not cancelled and not failed
+            return not cancelled and not failed, progress
         else:
-            return False
+            return False, progress
     else:
         logger.warning("ready request failed: %s", resp.status_code)
         raise ValueError("error getting image status")
 
 
+def check_ready(host: str, key: str) -> bool:
+    ready, _progress = check_progress(host, key)
+    return ready
+
+
+def cancel_job(host: str, key: str) -> bool:
+    resp = get_session().put(f"{host}/api/job/cancel?jobs={key}", timeout=get_timeout())
+    if resp.status_code == 200:
+        return True
+
+    logger.warning("cancel request failed: %s: %s", resp.status_code, resp.text)
+    return False
+
+
 def check_outputs(host: str, key: str) -> List[str]:
-    resp = requests.get(f"{host}/api/job/status?jobs={key}")
+    resp = get_session().get(f"{host}/api/job/status?jobs={key}", timeout=get_timeout())
     if resp.status_code == 200:
         json = resp.json()
         outputs = json[0].get("outputs", [])
@@ -196,31 +493,48 @@ def check_outputs(host: str, key: str) -> List[str]:
     raise ValueError("error getting image outputs")
 
 
-def download_images(host: str, key: str) -> List[Image.Image]:
+def download_file(url: str, dest: str) -> None:
+    """
+    Stream a file from the server straight to disk, keeping the original bytes. The file is written next to the
+    destination and moved into place once it is complete, so partial downloads are never left behind.
+    """
+    temp_path = dest + ".part"
+    with get_session().get(url, stream=True, timeout=get_timeout()) as resp:
+        if resp.status_code != 200:
+            logger.warning("download request failed: %s: %s", url, resp.status_code)
+            raise ValueError("error downloading file")
+
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                    f.write(chunk)
+        except Exception:
+            if path.exists(temp_path):
+                remove(temp_path)
+
+            raise
+
+    replace(temp_path, dest)
+
+
+def download_images(host: str, key: str, prefix: str) -> List[str]:
     outputs = check_outputs(host, key)
 
-    images = []
-    for key in outputs:
-        url = f"{host}/output/{key}"
-        resp = requests.get(url)
-        if resp.status_code == 200:
-            logger.debug("downloading image: %s", key)
-            images.append(Image.open(BytesIO(resp.content)))
-        else:
-            logger.warning("download request failed: %s: %s", url, resp.status_code)
-            raise ValueError("error downloading image")
+    paths = []
+    for j, output in enumerate(outputs):
+        image_path = f"{prefix}-{j}.png"
+        logger.info("downloading image %s to: %s", output, image_path)
+        download_file(f"{host}/output/{output}", image_path)
+        paths.append(image_path)
 
-    return images
+    return paths
 
 
 def download_input_images(images: list[str], dest: str):
     for i, image in enumerate(images):
         logger.info("downloading image: %s", image)
         # get image and json metadata
-        urlretrieve(
-            onnx_root + "/output/" + image + ".png", path.join(dest, f"{i}.png")
-        )
-        urlretrieve(
-            onnx_root + "/output/" + image + ".png.json",
-            path.join(dest, f"{i}.png.json"),
+        download_file(f"{onnx_root}/output/{image}.png", path.join(dest, f"{i}.png"))
+        download_file(
+            f"{onnx_root}/output/{image}.png.json", path.join(dest, f"{i}.png.json")
         )
@@ -0,0 +1,288 @@
+"""
+Content-addressed disk cache for agent calls.
+"""
+
+from hashlib import sha256
+from json import dump, dumps, load
+from logging import getLogger
+from os import listdir, makedirs, path, remove, replace, utime
+from threading import Lock
+from time import time
+from typing import Any, Callable, Optional, Tuple, Union
+
+from packit.agent import Agent
+
+from feedme.data import misc
+from feedme.models.misc import SingleLlmData
+from feedme.utils.profile import record_llm_call
+
+logger = getLogger(__name__)
+
+
+class AgentCache:
+    """
+    Store agent results on disk, keyed by a hash of everything that went into the call. Entries expire ttl seconds
+    after they were written, and the least recently used entries are removed once the cache grows beyond max_size
+    bytes. Each hit touches the entry, so its modified time is the last time it was used.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        ttl: float,
+        max_size: int,
+        max_temperature: float,
+        enabled: bool = False,
+    ):
+        self.root = root
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_temperature = max_temperature
+        self.enabled = enabled
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.bypassed = 0
+        self.size: Optional[int] = None
+
+    def should_cache(self, temperature: float) -> bool:
+        return self.enabled and temperature <= self.max_temperature
+
+    def make_key(self, **parts: Union[str, float]) -> str:
+        """
+        Hash the parts of a call. Only strings and numbers are allowed, since other objects may not have a stable
+        representation.
+        """
+        return sha256(dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Get an entry from the cache. Returns whether the entry was found and its value. Expired entries are removed and
+        counted as both misses and expired.
+        """
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, "r") as f:
+                entry = load(f)
+
+            # entries from before the write time was saved fall back to the modified time
+            written = entry.get("time") or path.getmtime(entry_path)
+            if time() - written > self.ttl:
+                logger.debug("cache entry expired: %s", key)
+                self.remove(entry_path)
+                with self.lock:
+                    self.expired += 1
+            else:
+                value = entry["value"]
+                try:
+                    utime(entry_path)
+                except OSError:
+                    pass
+
+                with self.lock:
+                    self.hits += 1
+
+                return True, value
+        except (OSError, ValueError, KeyError):
+            pass
+
+        with self.lock:
+            self.misses += 1
+
+        return False, None
+
+    def set(self, key: str, value: Any) -> None:
+        entry_path = self.entry_path(key)
+        makedirs(path.dirname(entry_path), exist_ok=True)
+
+        temp_path = f"{entry_path}.tmp"
+        with open(temp_path, "w") as f:
+            dump({"key": key, "time": time(), "value": value}, f)
+
+        replace(temp_path, entry_path)
+
+        with self.lock:
+            if self.size is None:
+                self.size = self.scan_size()
+            else:
+                self.size += path.getsize(entry_path)
+
+            if self.size > self.max_size:
+                self.evict()
+
+    def remove(self, entry_path: str) -> None:
+        try:
+            size = path.getsize(entry_path)
+            remove(entry_path)
+            with self.lock:
+                if self.size is not None:
+                    self.size -= size
+        except OSError:
+            pass
+
+    def list_entries(self):
+        entries = []
+        for bucket in listdir(self.root):
+            bucket_path = path.join(self.root, bucket)
+            if not path.isdir(bucket_path):
+                continue
+
+            for file in listdir(bucket_path):
+                if file.endswith(".json"):
+                    entry_path = path.join(bucket_path, file)
+                    entries.append(
+                        (
+                            path.getmtime(entry_path),
+                            path.getsize(entry_path),
+                            entry_path,
+                        )
+                    )
+
+        return entries
+
+    def scan_size(self) -> int:
+        return sum(size for _mtime, size, _path in self.list_entries())
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache is back under 90% of the max size. Must be called with
+        the lock held.
+        """
+        entries = sorted(self.list_entries())
+        size = sum(entry_size for _mtime, entry_size, _path in entries)
+        evicted = 0
+        for _mtime, entry_size, entry_path in entries:
+            if size <= self.max_size * 0.9:
+                break
+
+            try:
+                remove(entry_path)
+                size -= entry_size
+                evicted += 1
+            except OSError:
+                pass
+
+        self.size = size
+        logger.info("evicted %s entries from agent cache", evicted)
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / requests if requests > 0 else 0,
+        }
+
+
+agent_cache = AgentCache(
+    misc.cache.path,
+    ttl=misc.cache.ttl,
+    max_size=misc.cache.max_size * 1024 * 1024,
+    max_temperature=misc.cache.max_temperature,
+    enabled=misc.cache.enabled,
+)
+
+
+# called with the agent, prompt, full context, and a function that makes the real call, for recording and replaying
+# agent calls in the benchmarks
+AgentTransport = Callable[["CachedAgent", str, dict, Callable[[], Any]], Any]
+agent_transport: Optional[AgentTransport] = None
+
+
+def set_agent_transport(transport: Optional[AgentTransport]) -> None:
+    global agent_transport
+    agent_transport = transport
+
+
+def render_prompt(template: str, context: dict) -> Optional[str]:
+    """
+    Fill in a prompt template with the context for a call, or return None if that is not possible.
+    """
+    try:
+        return template.format(**context)
+    except (AttributeError, IndexError, KeyError, ValueError):
+        return None
+
+
+class CachedAgent(Agent):
+    """
+    An agent that caches its results for calls with a low enough temperature. The cache key includes the agent name,
+    model, temperature, and the backstory and prompt after filling in the context for the call.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        backstory: str,
+        context: dict,
+        llm,
+        llm_data: SingleLlmData,
+        cache: AgentCache = agent_cache,
+    ):
+        super().__init__(name, backstory, context, llm)
+        self.cache = cache
+        self.cache_backstory = backstory
+        self.cache_context = context
+        self.llm_data = llm_data
+
+    def call_key(self, prompt: str, context: dict) -> Optional[str]:
+        """
+        Get the cache key for a call, or None if the backstory or prompt cannot be filled in, since the key would not
+        cover the whole context.
+        """
+        backstory = render_prompt(self.cache_backstory, context)
+        rendered_prompt = render_prompt(prompt, context)
+        if backstory is None or rendered_prompt is None:
+            return None
+
+        return self.cache.make_key(
+            agent=self.name,
+            model=self.llm_data.model,
+            temperature=self.llm_data.temperature,
+            backstory=backstory,
+            prompt=rendered_prompt,
+        )
+
+    def call_llm(self, prompt: str, context: dict, **kwargs):
+        def call():
+            return super(CachedAgent, self).__call__(prompt, **kwargs)
+
+        if agent_transport is None:
+            result = call()
+        else:
+            result = agent_transport(self, prompt, context, call)
+
+        record_llm_call(prompt, result, context=context)
+        return result
+
+    def __call__(self, prompt: str, **kwargs):
+        context = {**self.cache_context, **kwargs}
+        key = None
+        if self.cache.should_cache(self.llm_data.temperature):
+            key = self.call_key(prompt, context)
+
+        if key is None:
+            with self.cache.lock:
+                self.cache.bypassed += 1
+
+            return self.call_llm(prompt, context, **kwargs)
+
+        found, result = self.cache.get(key)
+        if found:
+            logger.debug("agent cache hit for %s: %s", self.name, key)
+            record_llm_call(prompt, result, cached=True, context=context)
+            return result
+
+        result = self.call_llm(prompt, context, **kwargs)
+        try:
+            self.cache.set(key, result)
+        except (OSError, TypeError, ValueError):
+            logger.exception("failed to cache agent result")
+
+        return result
@@ -0,0 +1,231 @@
+"""
+Pre-generated example prompts, with an inverted index from keywords to examples.
+
+Build a corpus with: python -m feedme.utils.corpus --output /tmp/feedme-corpus.json.gz --count 50000
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+from gzip import open as gzip_open
+from json import dump, load
+from logging import getLogger
+from os import replace
+from random import sample, shuffle
+from re import findall
+from threading import Lock
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+logger = getLogger(__name__)
+
+STOP_WORDS = {"and", "are", "but", "for", "from", "its", "the", "this", "with"}
+
+
+def index_words(text: str) -> List[str]:
+    """
+    Split some text into the words that are used for the index: lowercase, alphanumeric, and at least 3 characters.
+    """
+    words = findall(r"[a-z0-9]+", text.lower())
+    return [word for word in words if len(word) >= 3 and word not in STOP_WORDS]
+
+
+class ExampleCorpus:
+    def __init__(self, examples: List[str], model: Optional[str] = None):
+        self.examples = examples
+        self.model = model
+        self.index: Dict[str, FrozenSet[int]] = {}
+
+        postings: Dict[str, List[int]] = {}
+        for i, example in enumerate(examples):
+            for word in set(index_words(example)):
+                postings.setdefault(word, []).append(i)
+
+        self.index = {word: frozenset(ids) for word, ids in postings.items()}
+
+    def match(self, keyword: str) -> FrozenSet[int]:
+        """
+        Find the examples that contain every word in a keyword.
+        """
+        words = index_words(keyword)
+        if len(words) == 0:
+            return frozenset()
+
+        ids = self.index.get(words[0], frozenset())
+        for word in words[1:]:
+            ids = ids & self.index.get(word, frozenset())
+
+        return ids
+
+    def sample(self, keywords: List[str], n: int) -> Tuple[List[str], float]:
+        """
+        Select n examples that match the most keywords. Returns the examples and the fraction of keywords that matched
+        at least one example.
+        """
+        scores: Counter[int] = Counter()
+        covered = 0
+        for keyword in keywords:
+            ids = self.match(keyword)
+            if len(ids) > 0:
+                covered += 1
+                scores.update(ids)
+
+        coverage = covered / len(keywords) if len(keywords) > 0 else 0
+
+        # pick randomly from the best matches, so posts with similar keywords do not always get the same examples
+        candidates = [i for i, _score in scores.most_common(n * 4)]
+        selected = sample(candidates, k=min(n, len(candidates)))
+        return [self.examples[i] for i in selected], coverage
+
+    def save(self, file: str) -> None:
+        temp_file = f"{file}.tmp"
+        with gzip_open(temp_file, "wt", encoding="utf-8") as f:
+            dump(
+                {
+                    "model": self.model,
+                    "examples": self.examples,
+                    "index": {
+                        word: sorted(ids) for word, ids in sorted(self.index.items())
+                    },
+                },
+                f,
+                separators=(",", ":"),
+            )
+
+        replace(temp_file, file)
+
+    @classmethod
+    def load(cls, file: str) -> "ExampleCorpus":
+        with gzip_open(file, "rt", encoding="utf-8") as f:
+            data = load(f)
+
+        corpus = cls.__new__(cls)
+        corpus.examples = data["examples"]
+        corpus.model = data.get("model")
+        corpus.index = {word: frozenset(ids) for word, ids in data["index"].items()}
+        return corpus
+
+
+corpus_cache: Dict[str, ExampleCorpus] = {}
+corpus_lock = Lock()
+
+
+def load_corpus(
+    file: Optional[str], model: Optional[str] = None
+) -> Optional[ExampleCorpus]:
+    """
+    Load a corpus once and keep it in memory. If the corpus was built with a different model than the one that is
+    being used to generate examples, a warning is logged, since the examples may not match the live ones.
+    """
+    if file is None:
+        return None
+
+    with corpus_lock:
+        if file not in corpus_cache:
+            corpus = ExampleCorpus.load(file)
+            logger.info(
+                "loaded %s examples and %s keywords from corpus: %s",
+                len(corpus.examples),
+                len(corpus.index),
+                file,
+            )
+            if model is not None and corpus.model != model:
+                logger.warning(
+                    "corpus was built with a different model, rebuild it to match: %s != %s",
+                    corpus.model,
+                    model,
+                )
+
+            corpus_cache[file] = corpus
+
+        return corpus_cache[file]
+
+
+def build_corpus(
+    generate,
+    seeds: List[str],
+    count: int,
+    batch: int,
+    k: int = 3,
+    max_stalled: int = 5,
+):
+    """
+    Generate count example prompts, using k random seed keywords for each one. If max_stalled batches in a row do not
+    add any new examples, the generator is only returning duplicates or empty prompts, so the corpus is returned with
+    fewer examples.
+    """
+    examples = set()
+    stalled = 0
+    while len(examples) < count:
+        seed_prompts = []
+        for _ in range(batch):
+            shuffle(seeds)
+            seed_prompts.append(seeds[:k])
+
+        previous = len(examples)
+        for example in generate(seed_prompts):
+            if example:
+                examples.add(example)
+
+        logger.info("generated %s of %s examples", len(examples), count)
+
+        if len(examples) > previous:
+            stalled = 0
+        else:
+            stalled += 1
+            if stalled >= max_stalled:
+                logger.warning(
+                    "no new examples in the last %s batches, stopping with %s of %s examples",
+                    stalled,
+                    len(examples),
+                    count,
+                )
+                break
+
+    return list(examples)[:count]
+
+
+def main():
+    from packit.utils import logger_with_colors
+
+    from feedme.data import agents, misc
+    from feedme.utils.promptgen import generate_live_examples
+
+    logger = logger_with_colors(__name__, level="INFO")
+
+    parser = ArgumentParser(description="pre-generate example prompts")
+    parser.add_argument("--output", default=misc.promptgen.corpus)
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=16)
+    parser.add_argument("--length", type=int, default=180)
+    parser.add_argument(
+        "--seeds", help="file with one seed keyword per line, defaults to interests"
+    )
+    args = parser.parse_args()
+
+    if args.output is None:
+        parser.error("no output file, set --output or promptgen.corpus")
+
+    if args.seeds is None:
+        seeds = [interest.replace("_", " ") for interest in agents.interests.keys()]
+    else:
+        with open(args.seeds, "r") as f:
+            seeds = [line.strip() for line in f if line.strip()]
+
+    examples = build_corpus(
+        lambda seed_prompts: generate_live_examples(seed_prompts, args.length),
+        seeds,
+        args.count,
+        args.batch,
+    )
+
+    corpus = ExampleCorpus(examples, model=misc.llms.gpt2)
+    corpus.save(args.output)
+    logger.info(
+        "saved %s examples and %s keywords to %s",
+        len(corpus.examples),
+        len(corpus.index),
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
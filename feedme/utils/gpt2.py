@@ -1,26 +1,377 @@
-from transformers import GPT2LMHeadModel, GPT2Tokenizer
+from collections import OrderedDict
+from itertools import islice
+from logging import getLogger
+from os import listdir, path
+from re import finditer
+from threading import Lock
+from time import monotonic
+from typing import Any, List, NamedTuple, Optional, Tuple
 
+import torch
+from transformers import (
+    GPT2LMHeadModel,
+    GPT2Tokenizer,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
 
-def load_model(model_path):
+from feedme.data import misc
+from feedme.utils.misc import sanitize_name
+
+logger = getLogger(__name__)
+
+
+class CachedModel(NamedTuple):
+    model: Any
+    tokenizer: Any
+    size: int
+
+
+class StopRules(NamedTuple):
+    """
+    Rules for ending a completion early, once the part that will be kept is complete.
+
+    - stop: cut the completion before the first occurrence of this string
+    - max_commas: cut the completion after this many commas
+    - max_words: cut the completion after this many words
+    """
+
+    stop: Optional[str] = None
+    max_commas: Optional[int] = None
+    max_words: Optional[int] = None
+
+    def truncate(self, text: str) -> Tuple[str, bool]:
+        """
+        Apply the rules to a completion, returning the part to keep and whether any of the rules were met.
+        """
+        stopped = False
+
+        if self.stop:
+            index = text.find(self.stop)
+            if index >= 0:
+                text = text[:index]
+                stopped = True
+
+        if self.max_commas is not None:
+            parts = text.split(",", self.max_commas)
+            if len(parts) > self.max_commas:
+                text = ",".join(parts[: self.max_commas]) + ","
+                stopped = True
+
+        if self.max_words is not None:
+            # only stop once the next word has started, otherwise the last word may be incomplete
+            words = list(islice(finditer(r"\S+", text), self.max_words + 1))
+            if len(words) > self.max_words:
+                text = text[: words[self.max_words - 1].end()]
+                stopped = True
+
+        return text, stopped
+
+
+class StopRulesCriteria(StoppingCriteria):
+    """
+    Stop generating once every sequence in the batch has met the stop rules. Only the new tokens are decoded at each
+    step, with a running count of the commas and words in each sequence, so each step does not decode the whole
+    completion again.
+    """
+
+    def __init__(self, rules: StopRules, tokenizer, prompt_length: int, batch: int):
+        self.rules = rules
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.decoded_length = prompt_length
+        self.done = [False] * batch
+        self.commas = [0] * batch
+        self.words = [0] * batch
+        self.in_word = [False] * batch
+        # the end of the text so far, to find stop strings that span more than one token
+        self.tails = [""] * batch
+
+    def update(self, i: int, text: str) -> bool:
+        """
+        Add the newly decoded text for a sequence and return whether it has met any of the rules.
+        """
+        rules = self.rules
+        if rules.stop:
+            tail = self.tails[i] + text
+            if rules.stop in tail:
+                return True
+
+            self.tails[i] = tail[len(tail) - len(rules.stop) + 1 :]
+
+        if rules.max_commas is not None:
+            self.commas[i] += text.count(",")
+            if self.commas[i] >= rules.max_commas:
+                return True
+
+        if rules.max_words is not None:
+            for char in text:
+                if char.isspace():
+                    self.in_word[i] = False
+                elif not self.in_word[i]:
+                    self.in_word[i] = True
+                    self.words[i] += 1
+
+            # only stop once the next word has started, like truncate
+            if self.words[i] > rules.max_words:
+                return True
+
+        return False
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        length = input_ids.shape[-1]
+        for i, done in enumerate(self.done):
+            if not done:
+                text = self.tokenizer.decode(
+                    input_ids[i, self.decoded_length : length],
+                    skip_special_tokens=True,
+                )
+                self.done[i] = self.update(i, text)
+
+        self.decoded_length = length
+        return all(self.done)
+
+
+def load_model(model_path, device="cpu"):
     model = GPT2LMHeadModel.from_pretrained(model_path)
+    model.to(device)
+    model.eval()
     return model
 
 
+def load_onnx_model(model_path, device="cpu", quantize=False):
+    """
+    Export a GPT2 model to ONNX, optionally quantize it to int8, and load it with ONNX Runtime.
+
+    The exported models are saved in the promptgen onnx_path and reused on later runs. This requires the optimum
+    package with ONNX Runtime support, see requirements/onnx.txt.
+    """
+    from optimum.onnxruntime import ORTModelForCausalLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    if device != "cpu":
+        logger.warning("ONNX promptgen backend only runs on CPU, not %s", device)
+
+    export_path = path.join(misc.promptgen.onnx_path, sanitize_name(model_path))
+    if not path.exists(path.join(export_path, "model.onnx")):
+        logger.warning("exporting model %s to ONNX: %s", model_path, export_path)
+        model = ORTModelForCausalLM.from_pretrained(model_path, export=True)
+        model.save_pretrained(export_path)
+
+    if not quantize:
+        return ORTModelForCausalLM.from_pretrained(export_path)
+
+    quantized_path = f"{export_path}_int8"
+    if not path.exists(path.join(quantized_path, "model_quantized.onnx")):
+        logger.warning(
+            "quantizing ONNX model %s to int8: %s", model_path, quantized_path
+        )
+        quantizer = ORTQuantizer.from_pretrained(export_path, file_name="model.onnx")
+        quantizer.quantize(
+            save_dir=quantized_path,
+            quantization_config=AutoQuantizationConfig.avx2(
+                is_static=False, per_channel=False
+            ),
+        )
+        quantizer.config.save_pretrained(quantized_path)
+
+    return ORTModelForCausalLM.from_pretrained(
+        quantized_path, file_name="model_quantized.onnx"
+    )
+
+
+def load_onnx_int8_model(model_path, device="cpu"):
+    return load_onnx_model(model_path, device, quantize=True)
+
+
+# inference backends, by name
+model_loaders = {
+    "torch": load_model,
+    "onnx": load_onnx_model,
+    "onnx-int8": load_onnx_int8_model,
+}
+
+
 def load_tokenizer(tokenizer_path):
     tokenizer = GPT2Tokenizer.from_pretrained(tokenizer_path)
+    # batches are left-padded so every sequence ends at the same position
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
     return tokenizer
 
 
-def generate_text(model_path, prompt, max_length, top_k=50, top_p=0.95):
-    model = load_model(model_path)
-    tokenizer = load_tokenizer(model_path)
-    ids = tokenizer.encode(f"{prompt}", return_tensors="pt")
-    final_outputs = model.generate(
-        ids,
-        do_sample=True,
-        max_new_tokens=max_length,
-        pad_token_id=model.config.eos_token_id,
+def model_size(model) -> int:
+    """
+    Estimate the memory used by a model's parameters and buffers, in bytes. ONNX models are estimated from the size of
+    their model files.
+    """
+    if not isinstance(model, torch.nn.Module):
+        model_dir = path.dirname(model.model_path)
+        return sum(
+            path.getsize(path.join(model_dir, f))
+            for f in listdir(model_dir)
+            if f.endswith((".onnx", ".onnx_data"))
+        )
+
+    size = sum(p.numel() * p.element_size() for p in model.parameters())
+    size += sum(b.numel() * b.element_size() for b in model.buffers())
+    return size
+
+
+class ModelCache:
+    """
+    Keep GPT2 models and their tokenizers loaded between calls, keyed by model path, device, and backend. When the
+    loaded models use more than memory_limit bytes, the least recently used models are evicted.
+    """
+
+    def __init__(self, memory_limit: int):
+        self.memory_limit = memory_limit
+        self.models: OrderedDict[Tuple[str, str, str], CachedModel] = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0.0
+
+    def get(
+        self, model_path: str, device: str = "cpu", backend: str = "torch"
+    ) -> CachedModel:
+        if backend not in model_loaders:
+            raise ValueError(f"unknown promptgen backend: {backend}")
+
+        key = (model_path, device, backend)
+        with self.lock:
+            if key in self.models:
+                self.hits += 1
+                self.models.move_to_end(key)
+                return self.models[key]
+
+            self.misses += 1
+            start = monotonic()
+            model = model_loaders[backend](model_path, device)
+            tokenizer = load_tokenizer(model_path)
+            load_time = monotonic() - start
+            self.load_time += load_time
+
+            entry = CachedModel(model, tokenizer, model_size(model))
+            self.models[key] = entry
+            logger.info(
+                "loaded %s model %s on %s in %.2f seconds, %s bytes",
+                backend,
+                model_path,
+                device,
+                load_time,
+                entry.size,
+            )
+
+            self.evict()
+            return entry
+
+    def evict(self) -> None:
+        # always keep the most recent model, even if it is over the limit by itself
+        while len(self.models) > 1 and self.memory_used() > self.memory_limit:
+            (model_path, device, backend), _entry = self.models.popitem(last=False)
+            logger.warning(
+                "evicting %s model %s on %s from cache", backend, model_path, device
+            )
+
+    def memory_used(self) -> int:
+        return sum(entry.size for entry in self.models.values())
+
+    def clear(self) -> None:
+        with self.lock:
+            self.models.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests > 0 else 0,
+            "load_time": self.load_time,
+            "memory_used": self.memory_used(),
+            "models": len(self.models),
+        }
+
+
+model_cache = ModelCache(misc.promptgen.cache_memory * 1024 * 1024)
+
+
+def generate_text(
+    model_path,
+    prompt,
+    max_length,
+    top_k=50,
+    top_p=0.95,
+    device=misc.promptgen.device,
+    stop_rules: Optional[StopRules] = None,
+    backend=misc.promptgen.backend,
+):
+    return generate_batch(
+        model_path,
+        [prompt],
+        max_length,
         top_k=top_k,
         top_p=top_p,
-    )
-    return tokenizer.decode(final_outputs[0], skip_special_tokens=True)
+        device=device,
+        stop_rules=stop_rules,
+        backend=backend,
+    )[0]
+
+
+def generate_batch(
+    model_path,
+    prompts: List[str],
+    max_length,
+    top_k=50,
+    top_p=0.95,
+    device=misc.promptgen.device,
+    stop_rules: Optional[StopRules] = None,
+    backend=misc.promptgen.backend,
+) -> List[str]:
+    """
+    Generate a completion for each of the prompts in a single batch. The prompts are left-padded to the same length.
+
+    If stop_rules are provided, decoding stops as soon as every completion has met them, and each completion is cut
+    down to the part that the rules keep.
+    """
+    model, tokenizer, _size = model_cache.get(model_path, device, backend)
+    if backend != "torch":
+        device = "cpu"
+
+    inputs = tokenizer(
+        [f"{prompt}" for prompt in prompts], return_tensors="pt", padding=True
+    ).to(device)
+    prompt_length = inputs["input_ids"].shape[1]
+
+    stopping_criteria = StoppingCriteriaList()
+    if stop_rules is not None:
+        stopping_criteria.append(
+            StopRulesCriteria(stop_rules, tokenizer, prompt_length, len(prompts))
+        )
+
+    with torch.inference_mode():
+        final_outputs = model.generate(
+            **inputs,
+            do_sample=True,
+            max_new_tokens=max_length,
+            pad_token_id=tokenizer.pad_token_id,
+            top_k=top_k,
+            top_p=top_p,
+            stopping_criteria=stopping_criteria,
+        )
+
+    if stop_rules is None:
+        return tokenizer.batch_decode(final_outputs, skip_special_tokens=True)
+
+    results = []
+    for prompt_ids, output_ids in zip(inputs["input_ids"], final_outputs):
+        prompt = tokenizer.decode(prompt_ids, skip_special_tokens=True)
+        completion = tokenizer.decode(
+            output_ids[prompt_length:], skip_special_tokens=True
+        )
+        completion, _stopped = stop_rules.truncate(completion)
+        results.append(prompt + completion)
+
+    return results
@@ -2,7 +2,7 @@ from base64 import b64encode
 from hashlib import sha256
 from json import dumps, loads
 from logging import getLogger
-from re import sub
+from re import DOTALL, IGNORECASE, MULTILINE, findall, search, sub
 from time import monotonic
 
 logger = getLogger(__name__)
@@ -94,6 +94,176 @@ def parse_ranking(ranking: str) -> list[str]:
     raise ValueError("Invalid ranking format")
 
 
+def get_number(item) -> int | None:
+    """
+    Get the first integer from a number or string, like 4, "4", or "concept 4".
+    """
+    if isinstance(item, bool):
+        return None
+
+    if isinstance(item, (int, float)):
+        return int(item)
+
+    if isinstance(item, str):
+        number = search(r"\d+", item)
+        if number:
+            return int(number.group(0))
+
+    return None
+
+
+def get_score(item) -> int | None:
+    if isinstance(item, dict):
+        for subkey in ["score", "rank", "ranking", "rating"]:
+            if subkey in item:
+                return get_number(item[subkey])
+
+        return None
+
+    return get_number(item)
+
+
+def parse_scores(scores: str) -> dict[int, int]:
+    """
+    Parse a score for each numbered item from a list of scores. Accepts a JSON object like {"1": 4, "2": 2}, a JSON
+    list of objects or scores, or lines like "1: 4", with the same fixups as parse_ranking.
+    """
+    # collapse lines
+    scores = scores.replace("\n", " ").replace("\r", "")
+
+    scores = sub(
+        r"<\/\|.*$", "", scores
+    )  # sometimes the system prompt leaks into the output, like <|assistant|>
+    scores = scores.replace('""', '"')  # the robots will double some JSON quotes
+
+    # find the JSON within any leading or trailing comments
+    data = None
+    json = search(r"[\{\[].*[\}\]]", scores)
+    if json:
+        try:
+            data = loads(json.group(0))
+            logger.debug("scores were valid JSON: %s", data)
+        except ValueError:
+            logger.warning("scores were not valid JSON: %s", json.group(0))
+
+    results = {}
+    if isinstance(data, dict):
+        # if the root value is a dict with a single subkey holding the scores, unwrap it, unless that key is the
+        # number of the only item, like {"1": {"score": 4}}
+        if len(data) == 1:
+            key, value = list(data.items())[0]
+            if get_number(key) is None and isinstance(value, (dict, list)):
+                data = value
+
+    if isinstance(data, dict):
+        for key, value in data.items():
+            number = get_number(key)
+            score = get_score(value)
+            if number is not None and score is not None:
+                results[number] = score
+    elif isinstance(data, list):
+        for i, item in enumerate(data):
+            number = i + 1
+            if isinstance(item, dict):
+                for subkey in ["concept", "item", "id", "number", "index"]:
+                    if subkey in item and get_number(item[subkey]) is not None:
+                        number = get_number(item[subkey])
+                        break
+
+            score = get_score(item)
+            if score is not None:
+                results[number] = score
+
+    if len(results) > 0:
+        return results
+
+    # fall back to numbered pairs, like "1: 4" or "2 - 5", which also covers JSON that was never closed
+    for number, score in findall(r"(\d+)\"?\s*[\.:\)=\-]+\s*\"?(\d+)", scores):
+        results[int(number)] = int(score)
+
+    if len(results) > 0:
+        return results
+
+    raise ValueError("Invalid scores format")
+
+
+def get_bool(item) -> bool | None:
+    """
+    Get a yes or no answer from a bool, number, or string, like True, 1, or "Yes, it is".
+    """
+    if isinstance(item, bool):
+        return item
+
+    if isinstance(item, (int, float)):
+        return item > 0
+
+    if isinstance(item, str):
+        answer = search(r"\b(yes|no|true|false)\b", item.lower())
+        if answer:
+            return answer.group(1) in ["yes", "true"]
+
+    return None
+
+
+def parse_critique(critique: str) -> tuple[str, str | int | bool]:
+    """
+    Parse a critique and a rating from a single reply. Accepts a JSON object like {"critique": "...", "rating": "yes"}
+    within any leading or trailing comments, or a line like "Rating: 4" before or after the critique. The rating is
+    returned as-is, and should be checked with get_bool or get_number.
+    """
+    critique = critique.replace("\r", "")
+    critique = sub(
+        r"<\/\|.*$", "", critique, flags=DOTALL
+    )  # sometimes the system prompt leaks into the output, like <|assistant|>
+
+    # find the JSON within any leading or trailing comments
+    json = search(r"\{.*\}", critique, DOTALL)
+    if json:
+        try:
+            data = loads(json.group(0).replace('""', '"'))
+        except ValueError:
+            logger.warning("critique was not valid JSON: %s", json.group(0))
+            data = None
+
+        if isinstance(data, dict):
+            text = None
+            for subkey in ["critique", "opinion", "review", "comment"]:
+                if subkey in data:
+                    text = data[subkey]
+                    break
+
+            rating = None
+            for subkey in ["rating", "score", "answer", "decision", "rank"]:
+                if subkey in data:
+                    rating = data[subkey]
+                    break
+
+            if text is not None and rating is not None:
+                return str(text), rating
+
+    # fall back to a labelled rating line, keeping the rest of the reply as the critique
+    rating = search(
+        r"^\W*(?:rating|score|answer|decision)\W*[:=\-]\s*(.+)$",
+        critique,
+        IGNORECASE | MULTILINE,
+    )
+    if rating:
+        text = critique[: rating.start()] + critique[rating.end() :]
+        text = sub(
+            r"^\W*(?:critique|opinion)\W*[:=\-]\s*", "", text.strip(), flags=IGNORECASE
+        )
+        if len(text) > 0:
+            return text, rating.group(1).strip()
+
+    raise ValueError("Invalid critique format")
+
+
+def format_numbered_list(items: list[str]) -> str:
+    # remove newlines within each item
+    items = [item.replace("\n", " ").replace("\r", "") for item in items]
+    return "\n".join(f"{i}. {item}" for i, item in enumerate(items, start=1))
+
+
 def format_bullet_list(items: list[str]) -> str:
     """
     TODO: replace with packit formatting
@@ -0,0 +1,160 @@
+from collections import deque
+from logging import getLogger
+from threading import Condition, Thread
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = getLogger(__name__)
+
+# each stage returns the name of the next stage for the item, or None when the item is finished
+StageFn = Callable[[Any], Optional[str]]
+
+
+class StageQueue:
+    """
+    A queue of items waiting for a pipeline stage. Items moving forward through the pipeline are bounded by the
+    queue depth, while items sent back to an earlier stage are never blocked and are taken first, so the stages
+    cannot deadlock waiting on each other.
+    """
+
+    def __init__(self, depth: int):
+        self.condition = Condition()
+        self.depth = depth
+        self.items = deque()
+        self.returned = deque()
+        self.closed = False
+
+    def put(self, item: Any, returned: bool = False) -> None:
+        with self.condition:
+            if returned:
+                self.returned.append(item)
+            else:
+                while len(self.items) >= self.depth:
+                    self.condition.wait()
+
+                self.items.append(item)
+
+            self.condition.notify_all()
+
+    def get(self) -> Optional[Any]:
+        """
+        Wait for the next item, returning None once the queue has been closed and is empty.
+        """
+        with self.condition:
+            while len(self.returned) == 0 and len(self.items) == 0:
+                if self.closed:
+                    return None
+
+                self.condition.wait()
+
+            if len(self.returned) > 0:
+                item = self.returned.popleft()
+            else:
+                item = self.items.popleft()
+
+            self.condition.notify_all()
+            return item
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self) -> int:
+        with self.condition:
+            return len(self.items) + len(self.returned)
+
+
+class Pipeline:
+    """
+    Run items through a series of named stages, with one thread per stage, so different items can be in different
+    stages at the same time. Stages can send an item back to an earlier stage to retry it.
+    """
+
+    def __init__(self, stages: List[Tuple[str, StageFn]], depth: int = 1):
+        self.stages = stages
+        self.order = {name: i for i, (name, _fn) in enumerate(stages)}
+        self.queues: Dict[str, StageQueue] = {
+            name: StageQueue(depth) for name, _fn in stages
+        }
+        self.condition = Condition()
+        self.active = 0
+
+    def depths(self) -> Dict[str, int]:
+        return {name: len(queue) for name, queue in self.queues.items()}
+
+    def route(self, item: Any, current: str, next_stage: Optional[str]) -> None:
+        if next_stage is not None and next_stage not in self.queues:
+            logger.error("unknown pipeline stage %s, dropping item", next_stage)
+            next_stage = None
+
+        if next_stage is None:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+            return
+
+        returned = self.order[next_stage] <= self.order[current]
+        self.queues[next_stage].put(item, returned=returned)
+
+    def worker(self, name: str, fn: StageFn) -> None:
+        queue = self.queues[name]
+        while True:
+            item = queue.get()
+            if item is None:
+                break
+
+            try:
+                next_stage = fn(item)
+            except Exception:
+                logger.exception("pipeline stage %s failed, dropping item", name)
+                next_stage = None
+
+            self.route(item, name, next_stage)
+
+    def run(self, items: Iterable[Any]) -> None:
+        """
+        Feed the items into the first stage and wait for all of them to finish.
+        """
+        threads = [
+            Thread(target=self.worker, args=(name, fn), name=f"pipeline-{name}")
+            for name, fn in self.stages
+        ]
+        for thread in threads:
+            thread.start()
+
+        first, _fn = self.stages[0]
+        try:
+            for item in items:
+                with self.condition:
+                    self.active += 1
+
+                # blocks once the first stage is full, so new items are only started as others move along
+                self.queues[first].put(item)
+
+            with self.condition:
+                while self.active > 0:
+                    self.condition.wait()
+        finally:
+            for queue in self.queues.values():
+                queue.close()
+
+            for thread in threads:
+                thread.join()
+
+
+def run_stages(stages: List[Tuple[str, StageFn]], items: Iterable[Any]) -> None:
+    """
+    Run each item through all of its stages before starting the next item, without any threads.
+    """
+    stage_fns = dict(stages)
+    first, _fn = stages[0]
+    for item in items:
+        next_stage = first
+        while next_stage is not None:
+            name = next_stage
+            try:
+                next_stage = stage_fns[name](item)
+            except Exception:
+                logger.exception("stage %s failed, dropping item", name)
+                next_stage = None
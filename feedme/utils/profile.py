@@ -0,0 +1,228 @@
+"""
+Per-stage wall time and LLM call profiling for posts.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from json import dump
+from logging import getLogger
+from math import ceil
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional
+
+logger = getLogger(__name__)
+
+
+class StageStats:
+    def __init__(self):
+        self.runs = 0
+        self.errors = 0
+        self.times: List[float] = []
+        self.llm_calls = 0
+        self.cached_calls = 0
+        self.prompt_chars = 0
+        self.completion_chars = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "time": sum(self.times),
+            "llm_calls": self.llm_calls,
+            "cached_calls": self.cached_calls,
+            "prompt_chars": self.prompt_chars,
+            "completion_chars": self.completion_chars,
+        }
+
+
+class Profile:
+    """
+    Collect the stats for each stage, either for a single post or for the whole run.
+    """
+
+    def __init__(self, name: Optional[str] = None):
+        self.name = name
+        self.lock = Lock()
+        self.stages: Dict[str, StageStats] = {}
+        self.retries = 0
+        self.start_time = monotonic()
+
+    def stage(self, stage: str) -> StageStats:
+        if stage not in self.stages:
+            self.stages[stage] = StageStats()
+
+        return self.stages[stage]
+
+    def record_time(self, stage: str, elapsed: float, error: bool = False) -> None:
+        with self.lock:
+            stats = self.stage(stage)
+            stats.runs += 1
+            stats.times.append(elapsed)
+            if error:
+                stats.errors += 1
+
+    def record_retry(self) -> None:
+        with self.lock:
+            self.retries += 1
+
+    def record_call(
+        self, stage: str, prompt_chars: int, completion_chars: int, cached: bool
+    ) -> None:
+        with self.lock:
+            stats = self.stage(stage)
+            stats.llm_calls += 1
+            stats.prompt_chars += prompt_chars
+            stats.completion_chars += completion_chars
+            if cached:
+                stats.cached_calls += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "name": self.name,
+                "retries": self.retries,
+                "time": monotonic() - self.start_time,
+                "stages": {
+                    name: stats.to_dict() for name, stats in self.stages.items()
+                },
+            }
+
+    def save(self, file: str) -> None:
+        with open(file, "w") as f:
+            dump(self.to_dict(), f, indent=2)
+
+    def table(self) -> str:
+        """
+        Format the wall time percentiles and LLM calls for each stage, slowest stages first, followed by the number of
+        retries.
+        """
+        with self.lock:
+            stages = sorted(
+                self.stages.items(), key=lambda item: sum(item[1].times), reverse=True
+            )
+            lines = [
+                f"{'stage':<32} {'runs':>5} "
+                f"{'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'total':>9} "
+                f"{'llm':>5} {'cached':>6} {'prompt':>8} {'reply':>8}"
+            ]
+            for name, stats in stages:
+                calls = max(stats.llm_calls, 1)
+                lines.append(
+                    f"{name:<32} {stats.runs:>5} "
+                    f"{percentile(stats.times, 50):>8.2f} "
+                    f"{percentile(stats.times, 90):>8.2f} "
+                    f"{percentile(stats.times, 99):>8.2f} "
+                    f"{max(stats.times, default=0):>8.2f} "
+                    f"{sum(stats.times):>9.2f} "
+                    f"{stats.llm_calls:>5} {stats.cached_calls:>6} "
+                    f"{stats.prompt_chars // calls:>8} "
+                    f"{stats.completion_chars // calls:>8}"
+                )
+
+            lines.append(f"{'retries':<32} {self.retries:>5}")
+            return "\n".join(lines)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    Get the nearest-rank percentile from a list of values, or 0 if there are none.
+    """
+    if len(values) == 0:
+        return 0
+
+    ordered = sorted(values)
+    rank = max(1, ceil(p * len(ordered) / 100))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+# the whole run, and the post and stage that are currently running in this context
+run_profile = Profile("run")
+current_profile: ContextVar[Optional[Profile]] = ContextVar(
+    "current_profile", default=None
+)
+current_stage: ContextVar[Optional[str]] = ContextVar("current_stage", default=None)
+
+
+@contextmanager
+def activate_profile(profile: Profile):
+    """
+    Record the stages run within this context to the profile for a post.
+    """
+    token = current_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        current_profile.reset(token)
+
+
+@contextmanager
+def profile_stage(stage: str):
+    """
+    Time a stage and attribute any LLM calls made within it to the stage. Nested stages are timed separately, so
+    the outer stage time includes the inner stages.
+    """
+    token = current_stage.set(stage)
+    start = monotonic()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        elapsed = monotonic() - start
+        current_stage.reset(token)
+
+        run_profile.record_time(stage, elapsed, error=error)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.record_time(stage, elapsed, error=error)
+
+
+def record_wait(stage: str, elapsed: float) -> None:
+    """
+    Record time spent waiting within a stage as its own stage, like the time between a job finishing and the next
+    check for it.
+    """
+    run_profile.record_time(stage, elapsed)
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record_time(stage, elapsed)
+
+
+def profiled(fn):
+    """
+    Profile each call to a function as a stage with the same name.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with profile_stage(fn.__name__):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def record_llm_call(
+    prompt: str, result, cached: bool = False, context: Optional[dict] = None
+) -> None:
+    """
+    Record an LLM call made by an agent to the current stage. Calls made outside of any stage are recorded as
+    unstaged. The prompt size is measured after filling in the context, when possible.
+    """
+    if context:
+        try:
+            prompt = prompt.format(**context)
+        except (AttributeError, IndexError, KeyError, ValueError):
+            pass
+
+    stage = current_stage.get() or "unstaged"
+    prompt_chars = len(prompt)
+    completion_chars = len(str(result))
+
+    run_profile.record_call(stage, prompt_chars, completion_chars, cached)
+    profile = current_profile.get()
+    if profile is not None:
+        profile.record_call(stage, prompt_chars, completion_chars, cached)
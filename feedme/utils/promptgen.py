@@ -1,3 +1,4 @@
+from concurrent.futures import Future
 from logging import getLogger
 from random import sample
 from re import sub
@@ -7,13 +8,17 @@ from packit.loops import loop_retry
 from traceloop.sdk.decorators import task
 
 from feedme.data import keywords, misc, prompts
-from feedme.utils.gpt2 import generate_text
+from feedme.utils.corpus import load_corpus
+from feedme.utils.gpt2 import StopRules, generate_batch, model_cache
 from feedme.utils.misc import cleanup_sentence
+from feedme.utils.profile import profiled
+from feedme.utils.workers import submit_llm, submit_promptgen
 
 logger = getLogger(__name__)
 
 
 @task()
+@profiled
 def generate_keywords(agent, description):
     return agent(
         prompts.generate_keywords,
@@ -23,6 +28,7 @@ def generate_keywords(agent, description):
 
 
 @task()
+@profiled
 def elaborate_characters(agent, description, base_keywords):
     return agent(
         prompts.elaborate_characters,
@@ -32,6 +38,7 @@ def elaborate_characters(agent, description, base_keywords):
 
 
 @task()
+@profiled
 def elaborate_scene(agent, scene):
     return agent(
         prompts.elaborate_scene,
@@ -40,6 +47,7 @@ def elaborate_scene(agent, scene):
 
 
 @task()
+@profiled
 def elaborate_quality(agent, base_keywords):
     return agent(
         prompts.elaborate_quality,
@@ -49,6 +57,7 @@ def elaborate_quality(agent, base_keywords):
 
 
 @task()
+@profiled
 def remove_abstract_concepts(agent, base_keywords):
     return loop_retry(
         agent,
@@ -61,28 +70,102 @@ def remove_abstract_concepts(agent, base_keywords):
 
 
 @task()
+@profiled
 def generate_examples(base_keywords, length=180, n=5, k=3):
+    return select_examples(base_keywords, length=length, n=n, k=k)
+
+
+def submit_examples(base_keywords, length=180, n=5, k=3) -> Future:
+    """
+    Start selecting example prompts in the promptgen worker pool. If there are no workers, the examples are generated
+    in a thread when concurrent prompts are enabled, otherwise in this process before returning.
+    """
+    if misc.promptgen.workers > 0:
+        return submit_promptgen(select_examples, base_keywords, length=length, n=n, k=k)
+
+    if misc.concurrency.prompt:
+        return submit_llm(generate_examples, base_keywords, length, n, k)
+
+    return submit_promptgen(generate_examples, base_keywords, length, n, k)
+
+
+def select_examples(base_keywords, length=180, n=5, k=3):
     keyword_list = base_keywords.split(",")
     keyword_list = [keyword.strip() for keyword in keyword_list]
 
-    example_prompts = []
+    corpus = load_corpus(misc.promptgen.corpus, model=misc.llms.gpt2)
+    if corpus is not None:
+        example_prompts, coverage = corpus.sample(keyword_list, n)
+        if coverage < misc.promptgen.coverage:
+            logger.warning(
+                "corpus coverage too low, generating example prompts: %.2f < %.2f",
+                coverage,
+                misc.promptgen.coverage,
+            )
+        elif len(example_prompts) < n:
+            logger.warning(
+                "not enough matching examples in corpus, generating example prompts: %s < %s",
+                len(example_prompts),
+                n,
+            )
+        else:
+            logger.info("using example prompts from corpus: %s", example_prompts)
+            return example_prompts
+
+    seed_prompts = []
     for _ in range(n):
         selected_keywords = sample(keyword_list, k=min(k, len(keyword_list)))
         logger.info("generating example prompt with keywords: %s", selected_keywords)
-        prompt = generate_text(misc.llms.gpt2, ",".join(selected_keywords), length)
+        seed_prompts.append(selected_keywords)
+
+    return generate_live_examples(seed_prompts, length)
+
+
+def generate_live_examples(seed_prompts, length=180):
+    """
+    Generate an example prompt for each list of seed keywords, using the GPT2 model.
+    """
+    # stop decoding once the completion has enough keywords, the partial keyword after the last comma is removed
+    stop_rules = StopRules(
+        stop=misc.promptgen.stop,
+        max_commas=misc.promptgen.max_commas,
+        max_words=misc.promptgen.max_words,
+    )
+
+    example_prompts = []
+    for prompt in generate_batch(
+        misc.llms.gpt2,
+        [",".join(keywords) for keywords in seed_prompts],
+        length,
+        stop_rules=stop_rules,
+    ):
         prompt = sub(r"^(.+)(?:,.*)$", r"\1", prompt)
         example_prompts.append(cleanup_prompt(prompt))
 
+    logger.debug("promptgen model cache: %s", model_cache.stats())
     return example_prompts
 
 
 @task()
+@profiled
 def generate_prompt(agent, description, qk=6):
     base_keywords = cleanup_prompt(generate_keywords(agent, description))
-    characters = elaborate_characters(agent, description, base_keywords)
-    scene = elaborate_scene(agent, description)
 
-    example_prompts = generate_examples(base_keywords)
+    # the examples only depend on the keywords, so start them before waiting on the LLM
+    examples = submit_examples(base_keywords)
+    if misc.concurrency.prompt:
+        # the characters and scene do not depend on each other either, run them at the same time
+        characters_future = submit_llm(
+            elaborate_characters, agent, description, base_keywords
+        )
+        scene_future = submit_llm(elaborate_scene, agent, description)
+        characters = characters_future.result()
+        scene = scene_future.result()
+    else:
+        characters = elaborate_characters(agent, description, base_keywords)
+        scene = elaborate_scene(agent, description)
+
+    example_prompts = examples.result()
 
     prompt = loop_retry(
         agent,
@@ -0,0 +1,130 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
+from logging import getLogger
+from multiprocessing import get_context
+from os import cpu_count
+from threading import Lock
+from typing import Optional
+
+from feedme.data import misc
+
+logger = getLogger(__name__)
+
+promptgen_pool: Optional[ProcessPoolExecutor] = None
+promptgen_lock = Lock()
+
+llm_pool: Optional[ThreadPoolExecutor] = None
+llm_lock = Lock()
+in_llm_pool: ContextVar[bool] = ContextVar("in_llm_pool", default=False)
+
+
+def init_promptgen_worker(threads: int) -> None:
+    """
+    Load the promptgen model once when each worker process starts.
+    """
+    import torch
+
+    from feedme.utils.gpt2 import model_cache
+
+    torch.set_num_threads(threads)
+    model_cache.get(misc.llms.gpt2, misc.promptgen.device, misc.promptgen.backend)
+    logger.info("promptgen worker ready with %s threads", threads)
+
+
+def get_promptgen_pool(
+    workers: int = misc.promptgen.workers,
+) -> Optional[ProcessPoolExecutor]:
+    """
+    Get the shared pool of promptgen worker processes, starting it on first use. Returns None if workers is 0.
+    """
+    global promptgen_pool
+
+    if workers < 1:
+        return None
+
+    with promptgen_lock:
+        if promptgen_pool is None:
+            # split the cores between workers, so they do not compete for the same threads
+            threads = max(1, (cpu_count() or 1) // workers)
+            logger.info("starting %s promptgen workers", workers)
+            promptgen_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=get_context("spawn"),
+                initializer=init_promptgen_worker,
+                initargs=(threads,),
+            )
+
+        return promptgen_pool
+
+
+def completed_future(fn, *args, **kwargs) -> Future:
+    """
+    Run fn right away and wrap the result or error in a future.
+    """
+    future: Future = Future()
+    try:
+        future.set_result(fn(*args, **kwargs))
+    except Exception as err:
+        future.set_exception(err)
+
+    return future
+
+
+def submit_promptgen(fn, *args, **kwargs) -> Future:
+    """
+    Run fn in the promptgen worker pool. If there are no workers, fn is run right away in this process.
+
+    The function and its arguments must be picklable.
+    """
+    pool = get_promptgen_pool()
+    if pool is not None:
+        return pool.submit(fn, *args, **kwargs)
+
+    return completed_future(fn, *args, **kwargs)
+
+
+def shutdown_promptgen() -> None:
+    """
+    Stop the promptgen worker processes, if they were started. The pool is started again on the next use.
+    """
+    global promptgen_pool
+
+    with promptgen_lock:
+        if promptgen_pool is not None:
+            promptgen_pool.shutdown(wait=True, cancel_futures=True)
+            promptgen_pool = None
+
+
+def get_llm_pool(workers: int = misc.concurrency.workers) -> ThreadPoolExecutor:
+    """
+    Get the shared pool of threads for LLM calls, starting it on first use.
+    """
+    global llm_pool
+
+    with llm_lock:
+        if llm_pool is None:
+            logger.info("starting %s LLM worker threads", workers)
+            llm_pool = ThreadPoolExecutor(
+                max_workers=max(1, workers), thread_name_prefix="feedme-llm"
+            )
+
+        return llm_pool
+
+
+def run_in_llm_pool(fn, *args, **kwargs):
+    in_llm_pool.set(True)
+    return fn(*args, **kwargs)
+
+
+def submit_llm(fn, *args, **kwargs) -> Future:
+    """
+    Run fn in the shared LLM thread pool. The call runs in a copy of the current context, so tracing spans started
+    within fn keep their parent.
+
+    Calls made from within the pool run right away, so nested steps cannot starve the pool and deadlock.
+    """
+    if in_llm_pool.get():
+        return completed_future(fn, *args, **kwargs)
+
+    context = copy_context()
+    return get_llm_pool().submit(context.run, run_in_llm_pool, fn, *args, **kwargs)
@@ -0,0 +1,138 @@
+import unittest
+from os import path, utime
+from tempfile import TemporaryDirectory
+from time import time
+from unittest.mock import patch
+
+from feedme.utils.cache import AgentCache, render_prompt
+
+
+class TestAgentCache(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def make_cache(self, **kwargs) -> AgentCache:
+        options = {
+            "ttl": 60,
+            "max_size": 1024 * 1024,
+            "max_temperature": 0.2,
+            "enabled": True,
+            **kwargs,
+        }
+        return AgentCache(self.temp.name, **options)
+
+    def test_disabled_by_default(self):
+        cache = AgentCache(self.temp.name, ttl=60, max_size=1024, max_temperature=0.2)
+        self.assertFalse(cache.should_cache(0.1))
+
+    def test_should_cache(self):
+        cache = self.make_cache()
+        self.assertTrue(cache.should_cache(0.1))
+        self.assertTrue(cache.should_cache(0.2))
+        self.assertFalse(cache.should_cache(0.65))
+
+    def test_make_key(self):
+        cache = self.make_cache()
+        key = cache.make_key(agent="critic", temperature=0.1, prompt="rate this")
+        self.assertEqual(
+            key, cache.make_key(prompt="rate this", temperature=0.1, agent="critic")
+        )
+        self.assertNotEqual(
+            key, cache.make_key(agent="critic", temperature=0.1, prompt="rate that")
+        )
+
+    def test_make_key_objects(self):
+        cache = self.make_cache()
+        with self.assertRaises(TypeError):
+            cache.make_key(prompt=object())
+
+    def test_get_set(self):
+        cache = self.make_cache()
+        key = cache.make_key(prompt="rate this")
+        self.assertEqual(cache.get(key), (False, None))
+
+        cache.set(key, {"rating": 4})
+        self.assertEqual(cache.get(key), (True, {"rating": 4}))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_expired(self):
+        cache = self.make_cache()
+        key = cache.make_key(prompt="rate this")
+        cache.set(key, "4")
+
+        later = time() + 120
+        with patch("feedme.utils.cache.time", lambda: later):
+            self.assertEqual(cache.get(key), (False, None))
+
+        self.assertFalse(path.exists(cache.entry_path(key)))
+        self.assertEqual(cache.stats()["expired"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_expired_from_write(self):
+        cache = self.make_cache()
+        key = cache.make_key(prompt="rate this")
+        cache.set(key, "4")
+
+        # a hit touches the entry, but does not extend its ttl
+        soon = time() + 50
+        with patch("feedme.utils.cache.time", lambda: soon):
+            self.assertEqual(cache.get(key), (True, "4"))
+
+        later = time() + 70
+        with patch("feedme.utils.cache.time", lambda: later):
+            self.assertEqual(cache.get(key), (False, None))
+
+    def test_hit_touches_entry(self):
+        cache = self.make_cache()
+        key = cache.make_key(prompt="rate this")
+        cache.set(key, "4")
+
+        entry_path = cache.entry_path(key)
+        old = time() - 30
+        utime(entry_path, (old, old))
+
+        cache.get(key)
+        self.assertGreater(path.getmtime(entry_path), old + 20)
+
+    def test_evict(self):
+        cache = self.make_cache(max_size=1000)
+        keys = [cache.make_key(prompt=str(i)) for i in range(10)]
+        for i, key in enumerate(keys):
+            cache.set(key, "x" * 200)
+            mtime = time() - 100 + i
+            utime(cache.entry_path(key), (mtime, mtime))
+
+        self.assertLessEqual(cache.scan_size(), 900)
+        self.assertTrue(path.exists(cache.entry_path(keys[-1])))
+        self.assertFalse(path.exists(cache.entry_path(keys[0])))
+
+    def test_evict_least_recently_used(self):
+        # each entry is about 300 bytes, so the fifth one starts an eviction
+        cache = self.make_cache(max_size=1400)
+        keys = [cache.make_key(prompt=str(i)) for i in range(4)]
+        for i, key in enumerate(keys):
+            cache.set(key, "x" * 200)
+            mtime = time() - 100 + i
+            utime(cache.entry_path(key), (mtime, mtime))
+
+        # the oldest entry was used recently, so the next oldest is evicted instead
+        self.assertEqual(cache.get(keys[0]), (True, "x" * 200))
+        cache.set(cache.make_key(prompt="new"), "x" * 200)
+
+        self.assertTrue(path.exists(cache.entry_path(keys[0])))
+        self.assertFalse(path.exists(cache.entry_path(keys[1])))
+
+
+class TestRenderPrompt(unittest.TestCase):
+    def test_render(self):
+        self.assertEqual(
+            render_prompt("rate {theme}", {"theme": "cats", "count": 3}), "rate cats"
+        )
+
+    def test_missing_context(self):
+        self.assertIsNone(render_prompt("rate {theme}", {}))
+        self.assertIsNone(render_prompt("rate {", {}))
@@ -0,0 +1,80 @@
+import unittest
+from os import listdir, path
+from tempfile import TemporaryDirectory
+
+from feedme.state.checkpoint import Checkpoint, load_checkpoints
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.root = self.temp.name
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def make_checkpoint(self, **kwargs) -> Checkpoint:
+        return Checkpoint("post", root=self.root, version="1", enabled=True, **kwargs)
+
+    def test_run_saves_output(self):
+        checkpoint = self.make_checkpoint()
+        self.assertEqual(checkpoint.run("ideas", lambda x: x * 2, 2), 4)
+        self.assertEqual(checkpoint.get("ideas"), 4)
+        self.assertTrue(path.exists(checkpoint.file))
+
+    def test_run_resumes_output(self):
+        checkpoint = self.make_checkpoint(stages={"ideas": 4})
+        calls = []
+        self.assertEqual(checkpoint.run("ideas", lambda: calls.append(1)), 4)
+        self.assertEqual(calls, [])
+
+    def test_run_keeps_failed_stage(self):
+        checkpoint = self.make_checkpoint()
+
+        def fail():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            checkpoint.run("images", fail)
+
+        self.assertIsNone(checkpoint.running)
+        self.assertEqual(checkpoint.failed, "images")
+        self.assertFalse(checkpoint.has("images"))
+
+        checkpoint.run("images", lambda: [])
+        self.assertIsNone(checkpoint.failed)
+
+    def test_clear(self):
+        checkpoint = self.make_checkpoint(stages={"ideas": 1, "prompt": 2})
+        checkpoint.clear(["prompt", "images"])
+        self.assertEqual(checkpoint.stages, {"ideas": 1})
+
+    def test_remove(self):
+        checkpoint = self.make_checkpoint()
+        checkpoint.set("ideas", 1)
+        checkpoint.remove()
+        self.assertEqual(checkpoint.stages, {})
+        self.assertFalse(path.exists(checkpoint.file))
+
+    def test_disabled(self):
+        checkpoint = Checkpoint("post", root=self.root, version="1", enabled=False)
+        checkpoint.set("ideas", 1)
+        self.assertEqual(listdir(self.root), [])
+
+    def test_load_checkpoints(self):
+        checkpoint = Checkpoint(root=self.root, enabled=True)
+        checkpoint.set("ideas", ["one", "two"])
+
+        checkpoints = load_checkpoints(root=self.root, enabled=True)
+        self.assertEqual(len(checkpoints), 1)
+        self.assertEqual(checkpoints[0].post_id, checkpoint.post_id)
+        self.assertEqual(checkpoints[0].get("ideas"), ["one", "two"])
+
+    def test_load_checkpoints_other_version(self):
+        self.make_checkpoint().set("ideas", 1)
+        self.assertEqual(load_checkpoints(root=self.root, enabled=True), [])
+        self.assertEqual(listdir(self.root), [])
+
+    def test_load_checkpoints_disabled(self):
+        Checkpoint(root=self.root, enabled=True).set("ideas", 1)
+        self.assertEqual(load_checkpoints(root=self.root, enabled=False), [])
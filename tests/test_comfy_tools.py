@@ -0,0 +1,24 @@
+import unittest
+from threading import Event
+from unittest.mock import patch
+
+from feedme.tools.comfy_tools import generate_image_tool
+
+
+class TestGenerateImageTool(unittest.TestCase):
+    def test_cancel(self):
+        cancel = Event()
+
+        def generate_images(prompt, count, size, prefix, cancel, save_path):
+            cancel.set()
+            return [f"{prefix}-0.png"]
+
+        with patch("feedme.tools.comfy_tools.generate_images", generate_images):
+            with patch(
+                "feedme.tools.comfy_tools.generate_batches", lambda count: [1, 1]
+            ):
+                results = generate_image_tool("cats", 2, cancel=cancel)
+
+        self.assertEqual(
+            results, ["output-0-0.png", "Error generating images: cancelled."]
+        )
@@ -0,0 +1,116 @@
+import unittest
+from os import path
+from tempfile import TemporaryDirectory
+
+from feedme.utils.corpus import (
+    ExampleCorpus,
+    build_corpus,
+    corpus_cache,
+    index_words,
+    load_corpus,
+)
+
+EXAMPLES = [
+    "a cat sleeping in the sun, warm light",
+    "a black cat with green eyes",
+    "a dog running on the beach",
+    "portrait of a dog and a cat",
+]
+
+
+class TestExampleCorpus(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+        corpus_cache.clear()
+
+    def test_index_words(self):
+        self.assertEqual(index_words("The Cat, and a DOG in 4k"), ["cat", "dog"])
+
+    def test_index(self):
+        corpus = ExampleCorpus(EXAMPLES)
+        self.assertEqual(corpus.index["cat"], frozenset([0, 1, 3]))
+        self.assertEqual(corpus.index["dog"], frozenset([2, 3]))
+        self.assertNotIn("the", corpus.index)
+
+    def test_match(self):
+        corpus = ExampleCorpus(EXAMPLES)
+        self.assertEqual(corpus.match("black cat"), frozenset([1]))
+        self.assertEqual(corpus.match("cat dog"), frozenset([3]))
+        self.assertEqual(corpus.match("a"), frozenset())
+        self.assertEqual(corpus.match("bird"), frozenset())
+
+    def test_sample(self):
+        corpus = ExampleCorpus(EXAMPLES)
+        examples, coverage = corpus.sample(["cat", "dog", "bird", "fish"], 2)
+        self.assertEqual(coverage, 0.5)
+        self.assertEqual(len(examples), 2)
+        self.assertTrue(all(example in EXAMPLES for example in examples))
+
+    def test_sample_only_matches(self):
+        corpus = ExampleCorpus(EXAMPLES)
+        examples, coverage = corpus.sample(["green eyes", "beach"], 5)
+        self.assertEqual(coverage, 1)
+        self.assertEqual(sorted(examples), [EXAMPLES[1], EXAMPLES[2]])
+
+    def test_sample_not_enough(self):
+        corpus = ExampleCorpus(EXAMPLES)
+        examples, coverage = corpus.sample(["beach"], 3)
+        self.assertEqual(coverage, 1)
+        self.assertEqual(examples, [EXAMPLES[2]])
+
+        self.assertEqual(corpus.sample([], 3), ([], 0))
+
+    def test_save_load(self):
+        file = path.join(self.temp.name, "corpus.json.gz")
+        ExampleCorpus(EXAMPLES, model="gpt2").save(file)
+
+        corpus = ExampleCorpus.load(file)
+        self.assertEqual(corpus.examples, EXAMPLES)
+        self.assertEqual(corpus.model, "gpt2")
+        self.assertEqual(corpus.index, ExampleCorpus(EXAMPLES).index)
+        self.assertEqual(corpus.match("black cat"), frozenset([1]))
+
+    def test_load_corpus_cached(self):
+        file = path.join(self.temp.name, "corpus.json.gz")
+        ExampleCorpus(EXAMPLES, model="gpt2").save(file)
+
+        corpus = load_corpus(file, model="gpt2")
+        self.assertIs(load_corpus(file, model="gpt2"), corpus)
+        self.assertIsNone(load_corpus(None))
+
+    def test_load_corpus_other_model(self):
+        file = path.join(self.temp.name, "corpus.json.gz")
+        ExampleCorpus(EXAMPLES, model="gpt2").save(file)
+
+        with self.assertLogs("feedme.utils.corpus", level="WARNING"):
+            corpus = load_corpus(file, model="other")
+
+        self.assertEqual(corpus.examples, EXAMPLES)
+
+
+class TestBuildCorpus(unittest.TestCase):
+    def test_count(self):
+        counter = iter(range(100))
+
+        def generate(seed_prompts):
+            return [f"{' '.join(seeds)} {next(counter)}" for seeds in seed_prompts]
+
+        examples = build_corpus(generate, ["cat", "dog", "sun"], 5, batch=2, k=2)
+        self.assertEqual(len(examples), 5)
+        self.assertEqual(len(set(examples)), 5)
+
+    def test_stops_without_new_examples(self):
+        calls = []
+
+        def generate(seed_prompts):
+            calls.append(len(seed_prompts))
+            return ["same", ""]
+
+        with self.assertLogs("feedme.utils.corpus", level="WARNING"):
+            examples = build_corpus(generate, ["cat"], 10, batch=2, max_stalled=3)
+
+        self.assertEqual(examples, ["same"])
+        self.assertEqual(len(calls), 4)
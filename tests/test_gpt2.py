@@ -0,0 +1,139 @@
+import unittest
+from time import monotonic
+
+import numpy as np
+
+from feedme.utils.gpt2 import StopRules, StopRulesCriteria
+
+
+class TestStopRules(unittest.TestCase):
+    def test_no_rules(self):
+        self.assertEqual(StopRules().truncate("a, b, c"), ("a, b, c", False))
+
+    def test_stop_string(self):
+        rules = StopRules(stop="\n")
+        self.assertEqual(rules.truncate("first line\nsecond"), ("first line", True))
+        self.assertEqual(rules.truncate("first line"), ("first line", False))
+
+    def test_max_commas(self):
+        rules = StopRules(max_commas=2)
+        self.assertEqual(rules.truncate("a, b, c, d"), ("a, b,", True))
+        self.assertEqual(rules.truncate("a, b"), ("a, b", False))
+
+    def test_max_words(self):
+        rules = StopRules(max_words=3)
+        self.assertEqual(rules.truncate("one two three four"), ("one two three", True))
+        self.assertEqual(
+            rules.truncate("  one two  three"), ("  one two  three", False)
+        )
+
+    def test_max_words_waits_for_next_word(self):
+        rules = StopRules(max_words=2)
+        self.assertEqual(rules.truncate("one two "), ("one two ", False))
+        self.assertEqual(rules.truncate("one two t"), ("one two", True))
+
+    def test_max_words_long_word(self):
+        rules = StopRules(max_words=3)
+        self.assertEqual(
+            rules.truncate("supercalifragilistic word"),
+            ("supercalifragilistic word", False),
+        )
+
+    def test_max_words_long_token_is_fast(self):
+        rules = StopRules(max_words=25)
+        start = monotonic()
+        self.assertEqual(rules.truncate("a" * 10000), ("a" * 10000, False))
+        self.assertLess(monotonic() - start, 1)
+
+    def test_rules_combined(self):
+        rules = StopRules(stop=".", max_commas=1, max_words=2)
+        self.assertEqual(rules.truncate("one, two three. four"), ("one,", True))
+
+
+class FakeTokenizer:
+    """
+    Each token id is the index of its text in a vocabulary, and decoding joins the token texts.
+    """
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+        self.decoded = []
+
+    def encode(self, text):
+        return [self.vocab.index(token) for token in text.split("|")]
+
+    def decode(self, ids, skip_special_tokens=False):
+        self.decoded.append(len(ids))
+        return "".join(self.vocab[i] for i in ids)
+
+
+class TestStopRulesCriteria(unittest.TestCase):
+    vocab = ["<prompt>", "one", " two", ",", " three", "\n", "\n\n", "x", "."]
+
+    def run_criteria(self, rules, rows, prompt_length=1):
+        """
+        Generate the rows one token at a time, returning the number of steps taken before stopping.
+        """
+        tokenizer = FakeTokenizer(self.vocab)
+        ids = np.array([[0] * prompt_length + tokenizer.encode(row) for row in rows])
+        criteria = StopRulesCriteria(rules, tokenizer, prompt_length, len(rows))
+        for length in range(prompt_length + 1, ids.shape[1] + 1):
+            if criteria(ids[:, :length], None):
+                return length - prompt_length, criteria, tokenizer
+
+        return None, criteria, tokenizer
+
+    def test_stop_string(self):
+        steps, criteria, _ = self.run_criteria(
+            StopRules(stop="\n"), ["one| two|\n|x|x", "one|\n|x|x|x"]
+        )
+        self.assertEqual(steps, 3)
+        self.assertEqual(criteria.done, [True, True])
+
+    def test_stop_string_across_tokens(self):
+        rules = StopRules(stop=", three")
+        steps, _, _ = self.run_criteria(rules, ["one|,| three|x|x"])
+        self.assertEqual(steps, 3)
+
+    def test_max_commas(self):
+        steps, _, _ = self.run_criteria(
+            StopRules(max_commas=2), ["one|,| two|,|x|x", "one|,|x|x|x|x"]
+        )
+        self.assertIsNone(steps)
+
+        steps, _, _ = self.run_criteria(
+            StopRules(max_commas=2), ["one|,| two|,|x|x", "one|,|,|x|x|x"]
+        )
+        self.assertEqual(steps, 4)
+
+    def test_max_words(self):
+        rules = StopRules(max_words=2)
+        steps, _, _ = self.run_criteria(rules, ["one| two| three|x"])
+        # like truncate, stop once the third word has started
+        self.assertEqual(steps, 3)
+
+        steps, _, _ = self.run_criteria(rules, ["one|x|x| two|x|x"])
+        self.assertIsNone(steps)
+
+    def test_matches_truncate(self):
+        rules = StopRules(stop="\n\n", max_commas=2, max_words=3)
+        rows = ["one|,| two|,|x", "one| two| three|x", "one|\n|\n|x|x", "one|x|.|x|x"]
+        for row in rows:
+            steps, _, _ = self.run_criteria(rules, [row])
+            tokens = row.split("|")
+            for length in range(1, len(tokens) + 1):
+                _text, stopped = rules.truncate("".join(tokens[:length]))
+                if stopped:
+                    break
+            else:
+                length = None
+
+            self.assertEqual(steps, length, row)
+
+    def test_decodes_new_tokens(self):
+        _steps, criteria, tokenizer = self.run_criteria(
+            StopRules(stop="\n"), ["one| two|\n|x|x", "one| two| three|x|\n"]
+        )
+        # finished rows are not decoded again, and each step only decodes the newest token
+        self.assertEqual(tokenizer.decoded, [1] * 8)
+        self.assertEqual(criteria.done, [True, True])
@@ -0,0 +1,46 @@
+import unittest
+from os import path
+from struct import pack
+from tempfile import TemporaryDirectory
+
+from PIL import Image
+
+from feedme.tools.image_tools import PNG_SIGNATURE, png_size, read_image_size
+
+
+class TestPngSize(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def write_file(self, name: str, data: bytes) -> str:
+        file = path.join(self.temp.name, name)
+        with open(file, "wb") as f:
+            f.write(data)
+
+        return file
+
+    def test_header(self):
+        header = PNG_SIGNATURE + pack(">I", 13) + b"IHDR" + pack(">II", 1024, 768)
+        self.assertEqual(png_size(self.write_file("a.png", header)), (1024, 768))
+
+    def test_image(self):
+        file = path.join(self.temp.name, "a.png")
+        Image.new("RGB", (640, 384)).save(file)
+        self.assertEqual(png_size(file), (640, 384))
+
+    def test_not_png(self):
+        self.assertIsNone(png_size(self.write_file("a.png", b"not a png image")))
+        self.assertIsNone(png_size(self.write_file("b.png", PNG_SIGNATURE)))
+        self.assertIsNone(png_size(self.write_file("c.png", b"")))
+
+    def test_read_image_size(self):
+        png_file = path.join(self.temp.name, "a.png")
+        Image.new("RGB", (64, 32)).save(png_file)
+        self.assertEqual(read_image_size(png_file), (64, 32))
+
+        jpeg_file = path.join(self.temp.name, "a.jpg")
+        Image.new("RGB", (48, 16)).save(jpeg_file)
+        self.assertEqual(read_image_size(jpeg_file), (48, 16))
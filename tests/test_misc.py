@@ -0,0 +1,99 @@
+import unittest
+
+from feedme.utils.misc import get_bool, parse_critique, parse_scores
+
+
+class TestParseScores(unittest.TestCase):
+    def test_object(self):
+        self.assertEqual(parse_scores('{"1": 4, "2": 2}'), {1: 4, 2: 2})
+
+    def test_object_with_comments(self):
+        self.assertEqual(
+            parse_scores('Here are the scores:\n{"1": 4,\n"2": 2}\nThanks!'),
+            {1: 4, 2: 2},
+        )
+
+    def test_list(self):
+        self.assertEqual(parse_scores("[4, 2, 5]"), {1: 4, 2: 2, 3: 5})
+
+    def test_list_of_objects(self):
+        self.assertEqual(
+            parse_scores('[{"concept": 2, "score": 5}, {"concept": 1, "score": 3}]'),
+            {2: 5, 1: 3},
+        )
+
+    def test_wrapped(self):
+        self.assertEqual(parse_scores('{"scores": {"1": 4, "2": 2}}'), {1: 4, 2: 2})
+        self.assertEqual(parse_scores('{"scores": [4, 2]}'), {1: 4, 2: 2})
+
+    def test_single_item(self):
+        self.assertEqual(parse_scores('{"1": 4}'), {1: 4})
+        self.assertEqual(parse_scores('{"1": {"score": 4}}'), {1: 4})
+        self.assertEqual(parse_scores('{"concept 1": {"rating": 4}}'), {1: 4})
+
+    def test_wrapped_single_item(self):
+        self.assertEqual(parse_scores('{"scores": {"1": 4}}'), {1: 4})
+        self.assertEqual(parse_scores('{"scores": {"1": {"score": 4}}}'), {1: 4})
+
+    def test_lines(self):
+        self.assertEqual(parse_scores("1: 4\n2 - 5\n3) 1"), {1: 4, 2: 5, 3: 1})
+
+    def test_unclosed_json(self):
+        self.assertEqual(parse_scores('{"1": 4, "2": 3'), {1: 4, 2: 3})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_scores("no scores here")
+
+
+class TestParseCritique(unittest.TestCase):
+    def test_json(self):
+        self.assertEqual(
+            parse_critique('{"critique": "Fun and relevant.", "rating": "yes"}'),
+            ("Fun and relevant.", "yes"),
+        )
+
+    def test_json_with_comments(self):
+        self.assertEqual(
+            parse_critique('Sure!\n{"review": "Too plain.", "score": 2}\nThanks.'),
+            ("Too plain.", 2),
+        )
+
+    def test_doubled_quotes(self):
+        self.assertEqual(
+            parse_critique('{""critique"": ""Good."", ""rating"": 4}'), ("Good.", 4)
+        )
+
+    def test_rating_line(self):
+        self.assertEqual(
+            parse_critique("Critique: The colors are dull.\nRating: 2"),
+            ("The colors are dull.", "2"),
+        )
+        self.assertEqual(
+            parse_critique("Answer: no\nIt is not relevant to the theme."),
+            ("It is not relevant to the theme.", "no"),
+        )
+
+    def test_leaked_prompt(self):
+        self.assertEqual(
+            parse_critique('{"critique": "Nice.", "rating": 5}</|assistant|> {}'),
+            ("Nice.", 5),
+        )
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_critique("I like it.")
+
+        with self.assertRaises(ValueError):
+            parse_critique("Rating: 4")
+
+
+class TestGetBool(unittest.TestCase):
+    def test_values(self):
+        self.assertTrue(get_bool(True))
+        self.assertTrue(get_bool(1))
+        self.assertFalse(get_bool(0))
+        self.assertTrue(get_bool("Yes, it is"))
+        self.assertFalse(get_bool("no"))
+        self.assertIsNone(get_bool("maybe"))
+        self.assertIsNone(get_bool(None))
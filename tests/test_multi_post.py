@@ -0,0 +1,600 @@
+import unittest
+from collections import Counter
+from contextlib import contextmanager
+from os import listdir, makedirs, path
+from tempfile import TemporaryDirectory
+from threading import Event
+from time import monotonic
+from unittest.mock import patch
+
+from feedme.data import misc
+from feedme.multi_post import (
+    PostJob,
+    PostRunner,
+    SpeculativeImages,
+    collect_results,
+    generate_ideas,
+    has_majority,
+    image_ranking_early_exit,
+    retry_checkpoint,
+    sample_items,
+    vote_choice,
+)
+from feedme.state.checkpoint import Checkpoint
+from feedme.utils.pipeline import run_stages
+from feedme.utils.profile import run_profile
+
+
+class FakeAgent:
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+
+
+class IdeaAgent(FakeAgent):
+    """
+    Come up with an idea right away, or wait until the release event is set.
+    """
+
+    def __init__(self, name, release=None):
+        super().__init__(name)
+        self.release = release
+
+    def __call__(self, prompt, **kwargs):
+        if self.release is not None:
+            self.release.wait(5)
+
+        return f"{self.name} idea"
+
+
+class TraceRecorder:
+    """
+    Record the outputs reported to each trace, in place of the real tracer.
+    """
+
+    def __init__(self):
+        self.outputs = []
+
+    @contextmanager
+    def __call__(self, name, kind):
+        yield (
+            lambda *args, **kwargs: None,
+            lambda output: self.outputs.append((kind, output)),
+        )
+
+    def statuses(self):
+        return [
+            (output["status"], output.get("reason")) for _kind, output in self.outputs
+        ]
+
+
+class TestRetryCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        stages = {
+            "interests": ["cats"],
+            "concepts": ["a"],
+            "ranking": [["a", 1]],
+            "parameters": {"count": 1},
+            "ideas": {},
+            "description": "cats",
+            "prompt": "cats",
+            "images": [],
+        }
+        self.checkpoint = Checkpoint(
+            "post", root=self.temp.name, stages=stages, version="1", enabled=True
+        )
+
+    def tearDown(self):
+        self.temp.cleanup()
+
+    def test_reason(self):
+        retry_checkpoint(self.checkpoint, 1, "low rating", {"low rating": "ideas"})
+        self.assertEqual(
+            list(self.checkpoint.stages),
+            ["interests", "concepts", "ranking", "parameters", "retry"],
+        )
+        self.assertEqual(self.checkpoint.get("retry"), 1)
+
+    def test_unknown_reason(self):
+        retry_checkpoint(self.checkpoint, 2, "unknown", {})
+        self.assertEqual(
+            list(self.checkpoint.stages),
+            ["interests", "concepts", "ranking", "retry"],
+        )
+
+    def test_stage(self):
+        retry_checkpoint(
+            self.checkpoint, 1, "error", {"error": "ideas"}, stage="images"
+        )
+        self.assertNotIn("images", self.checkpoint.stages)
+        self.assertIn("prompt", self.checkpoint.stages)
+
+
+class TestHasMajority(unittest.TestCase):
+    def test_no_votes(self):
+        self.assertFalse(has_majority(Counter(), 3))
+        self.assertFalse(has_majority(Counter(), 0))
+
+    def test_tied(self):
+        self.assertFalse(has_majority(Counter({"square": 2, "portrait": 2}), 0))
+        self.assertFalse(has_majority(Counter({"square": 2, "portrait": 1}), 1))
+
+    def test_unreachable(self):
+        self.assertTrue(has_majority(Counter({"square": 3, "portrait": 1}), 1))
+        self.assertTrue(has_majority(Counter({"square": 2}), 1))
+        self.assertFalse(has_majority(Counter({"square": 2}), 2))
+
+    def test_no_remaining(self):
+        self.assertTrue(has_majority(Counter({"square": 1}), 0))
+        self.assertTrue(has_majority(Counter({"square": 2, "portrait": 1}), 0))
+
+
+class TestVoteChoice(unittest.TestCase):
+    def test_stops_at_majority(self):
+        asked = []
+
+        def ask(option):
+            asked.append(option)
+            return option
+
+        agents = ["square", "square", "square", "portrait", "portrait"]
+        votes = vote_choice(agents, ask)
+        self.assertEqual(votes, Counter({"square": 3}))
+        self.assertEqual(asked, ["square", "square", "square"])
+
+    def test_invalid_votes(self):
+        votes = vote_choice([None, "square", None], lambda option: option)
+        self.assertEqual(votes, Counter({"square": 1}))
+
+    def test_tied(self):
+        votes = vote_choice(["square", "portrait"], lambda option: option)
+        self.assertEqual(votes, Counter({"square": 1, "portrait": 1}))
+
+    def test_concurrent(self):
+        votes = vote_choice(
+            ["square", "square", "square"], lambda option: option, concurrent=True
+        )
+        self.assertEqual(votes["square"], 2)
+
+
+class FlakyAgent(FakeAgent):
+    """
+    Fail the first call, then reply with the score.
+    """
+
+    def __init__(self, name, score):
+        super().__init__(name)
+        self.score = score
+        self.calls = 0
+
+    def __call__(self, prompt, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise ValueError("not a score")
+
+        return str(self.score)
+
+
+class TestSampleItems(unittest.TestCase):
+    def test_concurrent_retries_each_call(self):
+        agents = [FlakyAgent("cats", 4), FlakyAgent("dogs", 2)]
+        with patch.object(misc.concurrency, "ranking", True):
+            futures = sample_items(
+                agents,
+                ["a", "b"],
+                "rank {item}",
+                lambda item: {"item": item},
+                name="items",
+                result_parser=int,
+            )
+
+        self.assertEqual(len(futures), 2)
+        self.assertEqual(collect_results(futures[0]), {"cats": 4, "dogs": 2})
+        self.assertEqual(collect_results(futures[1]), {"cats": 4, "dogs": 2})
+
+
+class TestSpeculativeImages(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.calls = []
+        self.error = None
+        self.started = Event()
+        self.patch = patch("feedme.multi_post.do_images", self.do_images)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.temp.cleanup()
+
+    def do_images(self, prompt, count, size, cancel=None, save_path=None):
+        self.calls.append((prompt, count, size, save_path))
+        images = []
+        for i in range(count):
+            image = path.join(save_path, f"{size}-{i}.png")
+            with open(image, "wb") as f:
+                f.write(b"png")
+
+            images.append(image)
+
+        self.started.set()
+        if self.error is not None:
+            raise self.error
+
+        # take a moment to finish, like a slow image server, unless cancelled
+        cancel.wait(0.05)
+        return images
+
+    def test_matching_size(self):
+        speculative = SpeculativeImages("cats", 2, "square", save_path=self.temp.name)
+        images = speculative.resolve("square")
+        self.assertEqual(len(images), 2)
+        self.assertTrue(all(path.exists(image) for image in images))
+        self.assertEqual(self.calls, [("cats", 2, "square", self.temp.name)])
+
+    def test_other_size(self):
+        speculative = SpeculativeImages("cats", 2, "square", save_path=self.temp.name)
+        self.started.wait(1)
+
+        with self.assertLogs("feedme.multi_post", level="WARNING"):
+            self.assertIsNone(speculative.resolve("portrait"))
+
+        self.assertTrue(speculative.cancel.is_set())
+        self.assertEqual(listdir(self.temp.name), [])
+
+    def test_other_size_error(self):
+        self.error = ValueError("server down")
+        speculative = SpeculativeImages("cats", 1, "square", save_path=self.temp.name)
+
+        with self.assertLogs("feedme.multi_post", level="ERROR"):
+            self.assertIsNone(speculative.resolve(None))
+
+
+class TestImageRankingEarlyExit(unittest.TestCase):
+    def setUp(self):
+        self.asked = []
+        self.scores = {}
+
+        test = self
+
+        class ScorePanel:
+            def __init__(self, agents, name=None):
+                self.agents = agents
+
+            def sample(self, prompt, context, result_parser=None):
+                agent = self.agents[0].name
+                test.asked.append((agent, context["caption"]))
+                return {agent: test.scores[context["caption"]].pop(0)}
+
+        self.patch = patch("feedme.multi_post.Panel", ScorePanel)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def rank(self, scores, count=2):
+        self.scores = {caption: list(votes) for caption, votes in scores.items()}
+        interests = ["cats", "dogs", "birds"]
+        image_data = [
+            {"filename": f"{caption}.png", "caption": caption} for caption in scores
+        ]
+        return image_ranking_early_exit(
+            interests,
+            {interest: FakeAgent(interest) for interest in interests},
+            image_data,
+            count,
+            "description",
+            ranking_threshold=3.5,
+            max_score=5,
+            min_score=1,
+        )
+
+    def test_full_votes(self):
+        self.assertEqual(self.rank({"a": [4, 4, 4]}), [("a.png", 40)])
+        self.assertEqual(len(self.asked), 3)
+
+    def test_exit_when_threshold_is_reached(self):
+        # after two 5s, the worst average is (5 + 5 + 1) / 3, which already meets the threshold
+        self.assertEqual(self.rank({"a": [5, 5, 5]}), [("a.png", 36)])
+        self.assertEqual(len(self.asked), 2)
+
+    def test_exit_when_threshold_is_unreachable(self):
+        # after two 1s, the best average is (1 + 1 + 5) / 3, which cannot meet the threshold
+        self.assertEqual(self.rank({"a": [1, 1, 5]}), [])
+        self.assertEqual(len(self.asked), 2)
+
+    def test_early_exit_ranked_by_lower_bound(self):
+        # b stops early with higher votes, but is ranked by its lowest possible average, below a
+        top_images = self.rank({"a": [4, 4, 4], "b": [5, 5, 5]})
+        self.assertEqual(top_images, [("a.png", 40), ("b.png", 36)])
+
+    def test_skips_after_count(self):
+        top_images = self.rank({"a": [5, 5], "b": [5, 5], "c": [5, 5]}, count=1)
+        self.assertEqual(top_images, [("a.png", 36)])
+        self.assertEqual(len(self.asked), 2)
+
+    def test_clamps_scores(self):
+        # a score of 9 is counted as 5, so one vote cannot decide the image
+        self.assertEqual(self.rank({"a": [9, 1, 1]}), [])
+        self.assertEqual(len(self.asked), 3)
+
+
+class TestGenerateIdeas(unittest.TestCase):
+    def setUp(self):
+        self.release = Event()
+
+    def tearDown(self):
+        # let the abandoned calls finish, so they do not hold on to the shared pool
+        self.release.set()
+
+    def test_sequential(self):
+        agents = {"cats": IdeaAgent("cats"), "dogs": IdeaAgent("dogs")}
+        ideas = generate_ideas(["cats", "dogs"], agents, concurrent=False)
+        self.assertEqual(ideas, {"cats": "cats idea", "dogs": "dogs idea"})
+
+    def test_concurrent_abandons_hung_call(self):
+        agents = {
+            "cats": IdeaAgent("cats"),
+            "dogs": IdeaAgent("dogs", release=self.release),
+        }
+        start = monotonic()
+        with self.assertLogs("feedme.multi_post", level="ERROR") as logs:
+            ideas = generate_ideas(
+                ["cats", "dogs"], agents, concurrent=True, timeout=0.2, margin=0.1
+            )
+
+        self.assertLess(monotonic() - start, 2)
+        self.assertEqual(ideas, {"cats": "cats idea"})
+        self.assertIn("abandoned", logs.output[0])
+
+    def test_concurrent_no_ideas(self):
+        agents = {"dogs": IdeaAgent("dogs", release=self.release)}
+        with self.assertLogs("feedme.multi_post", level="ERROR"):
+            with self.assertRaises(ValueError):
+                generate_ideas(
+                    ["dogs"], agents, concurrent=True, timeout=0.1, margin=0.1
+                )
+
+
+class TestPostRunner(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        root = self.temp.name
+        self.approved_path = path.join(root, "approved")
+        self.rejected_path = path.join(root, "rejected")
+        self.working_path = path.join(root, "working")
+
+        self.calls = []
+        self.ratings = []
+        self.image_error = None
+        self.trace = TraceRecorder()
+
+        patches = {
+            "approved_path": self.approved_path,
+            "rejected_path": self.rejected_path,
+            "working_path": self.working_path,
+            "trace": self.trace,
+            "InterestAgent": FakeAgent,
+            "CachedAgent": FakeAgent,
+            "get_random_interest": self.stage("interests", ["cats", "dogs"]),
+            "generate_concepts": self.stage("concepts", ["cats and dogs"]),
+            "concept_ranking": self.stage("ranking", [("cats and dogs", 5)]),
+            "generate_ideas": self.stage("ideas", {"cats": "nap"}),
+            "generate_description": self.stage("description", "cats nap"),
+            "generate_prompt": self.stage("prompt", "cats, napping"),
+            "generate_post_images": self.generate_images,
+            "rate_post": self.rate_post,
+            "do_post": self.stage("post", None),
+            "update_state": lambda status, post, state: state,
+            "save_state": lambda state: None,
+        }
+        self.patches = [
+            patch(f"feedme.multi_post.{name}", value) for name, value in patches.items()
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+        self.temp.cleanup()
+
+    def stage(self, name, value):
+        def run(*args, **kwargs):
+            self.calls.append(name)
+            return value
+
+        return run
+
+    def generate_images(self, *args, save_path=None):
+        self.calls.append("images")
+        if self.image_error is not None:
+            error, self.image_error = self.image_error, None
+            raise error
+
+        image = path.join(save_path, "output-0.png")
+        with open(image, "wb") as f:
+            f.write(b"png")
+
+        return [(image, None)]
+
+    def rate_post(self, critics, post, post_path):
+        self.calls.append("rate")
+        return self.ratings.pop(0)
+
+    def make_runner(self, max_post_retry=3, critique_gate=False) -> PostRunner:
+        return PostRunner(
+            approval_threshold=3,
+            max_post_retry=max_post_retry,
+            min_image_count=1,
+            max_image_count=1,
+            min_interest_count=2,
+            max_interest_count=2,
+            post_interests=None,
+            post_format="photo",
+            post_state={},
+            critique_gate=critique_gate,
+        )
+
+    def make_job(self, stages=None) -> PostJob:
+        checkpoint = Checkpoint(
+            "post",
+            root=path.join(self.temp.name, "checkpoints"),
+            stages=stages,
+            version="1",
+            enabled=True,
+        )
+        return PostJob(checkpoint)
+
+    def run_job(self, runner, job):
+        run_stages(runner.stages, [job])
+
+    def test_approve(self):
+        self.ratings = [4]
+        runner = self.make_runner()
+        job = self.make_job()
+        self.run_job(runner, job)
+
+        self.assertEqual(len(runner.approved_posts), 1)
+        post_path = runner.approved_posts[0]
+        self.assertEqual(
+            sorted(listdir(post_path)),
+            ["ideas.json", "output-0.png", "post.json", "profile.json"],
+        )
+        self.assertFalse(path.exists(job.checkpoint.file))
+        self.assertFalse(path.exists(job.working_path))
+        self.assertEqual(self.trace.statuses()[-1], ("approved", None))
+
+    def test_images_saved_to_working_path(self):
+        self.ratings = [4]
+        job = self.make_job()
+        with patch(
+            "feedme.multi_post.generate_post_images", wraps=self.generate_images
+        ) as images:
+            self.run_job(self.make_runner(), job)
+
+        self.assertEqual(images.call_args.kwargs["save_path"], job.working_path)
+
+    def test_reject_then_approve(self):
+        self.ratings = [1, 4]
+        runner = self.make_runner()
+        job = self.make_job()
+        self.run_job(runner, job)
+
+        self.assertEqual(job.retry, 1)
+        self.assertEqual(len(runner.rejected_posts), 1)
+        self.assertEqual(len(runner.approved_posts), 1)
+
+        rejected = listdir(self.rejected_path)
+        self.assertEqual(len(rejected), 1)
+        self.assertIn(
+            "profile.json", listdir(path.join(self.rejected_path, rejected[0]))
+        )
+
+        # low rating retries from the ideas, so the earlier stages are only run once
+        self.assertEqual(self.calls.count("concepts"), 1)
+        self.assertEqual(self.calls.count("ideas"), 2)
+        self.assertEqual(
+            self.trace.statuses(),
+            [
+                ("planned", None),
+                ("rendered", None),
+                ("failed", "low rating"),
+                ("planned", None),
+                ("rendered", None),
+                ("approved", None),
+            ],
+        )
+
+    def test_max_retries(self):
+        self.ratings = [1, 1]
+        runner = self.make_runner(max_post_retry=2)
+        job = self.make_job()
+        self.run_job(runner, job)
+
+        self.assertEqual(job.retry, 2)
+        self.assertEqual(runner.approved_posts, [])
+        self.assertFalse(path.exists(job.checkpoint.file))
+        self.assertEqual(
+            self.trace.statuses()[-2:],
+            [("failed", "low rating"), ("failed", "max retries exceeded")],
+        )
+
+    def test_fail_retries_failed_stage(self):
+        self.ratings = [4]
+        self.image_error = ValueError("server down")
+        runner = self.make_runner()
+        job = self.make_job()
+        with self.assertLogs("feedme.multi_post", level="ERROR"):
+            self.run_job(runner, job)
+
+        self.assertEqual(job.retry, 1)
+        self.assertEqual(len(runner.approved_posts), 1)
+
+        # only the images stage failed, so the plan is reused
+        self.assertEqual(self.calls.count("ideas"), 1)
+        self.assertEqual(self.calls.count("prompt"), 1)
+        self.assertEqual(self.calls.count("images"), 2)
+        self.assertIn(("failed", "server down"), self.trace.statuses())
+        self.assertIsNone(job.checkpoint.failed)
+        self.assertTrue(
+            path.exists(path.join(self.rejected_path, "post_0_error", "profile.json"))
+        )
+
+    def test_gate_reject(self):
+        self.ratings = [4]
+        gate = iter([False, True])
+        with patch(
+            "feedme.multi_post.critique_gate", lambda *args, **kwargs: next(gate)
+        ):
+            runner = self.make_runner(critique_gate=True)
+            self.run_job(runner, self.make_job())
+
+        self.assertEqual(len(runner.approved_posts), 1)
+        rejected = listdir(self.rejected_path)
+        self.assertEqual(len(rejected), 1)
+        self.assertTrue(rejected[0].endswith("_post_0"))
+        self.assertEqual(
+            listdir(path.join(self.rejected_path, rejected[0])), ["profile.json"]
+        )
+
+    def test_no_concepts(self):
+        with patch("feedme.multi_post.concept_ranking", self.stage("ranking", [])):
+            runner = self.make_runner()
+            self.run_job(runner, self.make_job())
+
+        self.assertEqual(runner.approved_posts, [])
+        self.assertEqual(listdir(self.rejected_path), ["post_0_no_top_concepts"])
+
+    def test_retries_in_run_profile(self):
+        self.ratings = [1, 1, 4]
+        retries = run_profile.retries
+        self.run_job(self.make_runner(), self.make_job())
+        self.assertEqual(run_profile.retries - retries, 2)
+
+    def test_fail_max_retries(self):
+        runner = self.make_runner(max_post_retry=1)
+        job = self.make_job()
+        self.image_error = ValueError("server down")
+        with self.assertLogs("feedme.multi_post", level="ERROR"):
+            self.run_job(runner, job)
+
+        self.assertEqual(self.calls.count("images"), 1)
+        self.assertEqual(self.trace.statuses()[-1], ("failed", "max retries exceeded"))
+
+    def test_resume(self):
+        self.ratings = [4]
+        stages = {
+            "interests": ["cats"],
+            "concepts": ["cats"],
+            "ranking": [["cats", 5]],
+            "parameters": {"count": 1, "modifier": "photo"},
+            "ideas": {"cats": "nap"},
+            "description": "cats nap",
+            "prompt": "cats, napping",
+        }
+        job = self.make_job(stages=stages)
+        makedirs(job.working_path)
+        self.run_job(self.make_runner(), job)
+
+        self.assertEqual(self.calls, ["images", "rate", "post"])
@@ -0,0 +1,225 @@
+import unittest
+from contextvars import ContextVar
+from threading import Event, Lock
+from time import sleep
+from unittest.mock import patch
+
+from feedme.tools.onnx_tools import (
+    ReadinessPoller,
+    generate_batches,
+    generate_images,
+    parse_progress,
+    run_batches,
+)
+
+batch_name: ContextVar[str] = ContextVar("batch_name", default="none")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestParseProgress(unittest.TestCase):
+    def test_fraction(self):
+        self.assertEqual(parse_progress(0.25, 20), 0.25)
+
+    def test_steps(self):
+        self.assertEqual(parse_progress(5, 20), 0.25)
+        self.assertEqual(parse_progress(30, 20), 1.0)
+
+    def test_object(self):
+        self.assertEqual(parse_progress({"current": 5, "total": 10}, 20), 0.5)
+        self.assertEqual(parse_progress({"steps": 5}, 20), 0.25)
+        self.assertIsNone(parse_progress({"total": 10}, 20))
+
+    def test_invalid(self):
+        self.assertIsNone(parse_progress(None, 20))
+        self.assertIsNone(parse_progress(True, 20))
+        self.assertIsNone(parse_progress("half", 20))
+        self.assertIsNone(parse_progress(5, 0))
+
+
+class TestReadinessPoller(unittest.TestCase):
+    def setUp(self):
+        ReadinessPoller.step_time = None
+        self.clock = Clock()
+        self.patch = patch("feedme.tools.onnx_tools.monotonic", self.clock)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        ReadinessPoller.step_time = None
+
+    def make_poller(self, steps=10) -> ReadinessPoller:
+        return ReadinessPoller(steps, min_poll=0.5, max_poll=8, deadline=100)
+
+    def test_backs_off_while_queued(self):
+        poller = self.make_poller()
+        waits = []
+        for _ in range(6):
+            wait = poller.next_wait(0.0)
+            waits.append(wait)
+            self.clock.now += wait
+
+        self.assertEqual(waits, [0.5, 1, 2, 4, 8, 8])
+
+    def test_backs_off_without_progress(self):
+        poller = self.make_poller()
+        self.assertEqual(poller.next_wait(None), 0.5)
+        self.assertEqual(poller.next_wait(None), 1)
+
+    def test_predicts_from_progress_rate(self):
+        poller = self.make_poller()
+        self.clock.now = 10
+        poller.next_wait(0.1)
+        self.clock.now = 12
+        # 0.1 done in 2s, so 0.8 remaining takes 16s, and the wait is half of that
+        self.assertEqual(poller.next_wait(0.2), 8)
+        self.clock.now = 20
+        self.assertEqual(poller.next_wait(0.6), 4)
+
+    def test_backs_off_when_overdue(self):
+        ReadinessPoller.step_time = 1.0
+        poller = self.make_poller()
+        self.clock.now = 5
+        self.assertEqual(poller.next_wait(1.0), 0.5)
+        waits = [poller.next_wait(1.0) for _ in range(5)]
+        self.assertEqual(waits, [0.5, 1, 2, 4, 8])
+
+    def test_deadline(self):
+        poller = ReadinessPoller(10, min_poll=0.5, max_poll=8, deadline=3)
+        self.clock.now = 2
+        self.assertEqual(poller.next_wait(None), 0.5)
+        self.clock.now = 2.8
+        self.assertAlmostEqual(poller.next_wait(None), 0.2)
+        self.clock.now = 3
+        self.assertTrue(poller.expired)
+
+    def test_finish_ignores_queue_time(self):
+        poller = self.make_poller(steps=10)
+        self.clock.now = 20
+        poller.next_wait(0.0)
+        self.clock.now = 30
+        poller.next_wait(0.5)
+        self.clock.now = 32
+        poller.next_wait(0.7)
+        self.clock.now = 36
+
+        # predicted to finish at 35, after 5 steps in 5s from when it started
+        self.assertEqual(poller.finish(), 1)
+        self.assertEqual(ReadinessPoller.step_time, 1.0)
+
+    def test_finish_without_progress(self):
+        poller = self.make_poller()
+        self.clock.now = 5
+        poller.next_wait(None)
+        self.clock.now = 6
+        self.assertEqual(poller.finish(), 1)
+        self.assertIsNone(ReadinessPoller.step_time)
+
+
+class TestGenerateImagesProgress(unittest.TestCase):
+    def setUp(self):
+        ReadinessPoller.step_time = None
+        self.clock = Clock()
+        self.checked_steps = []
+
+        def sleep(wait):
+            self.clock.now += wait
+
+        def check_progress(host, job, steps):
+            # the server counts the steps for the whole batch, at 1 step per second
+            self.checked_steps.append(steps)
+            done = min(self.clock.now, 30)
+            return done >= 30, parse_progress(int(done), steps)
+
+        self.patches = [
+            patch("feedme.tools.onnx_tools.monotonic", self.clock),
+            patch("feedme.tools.onnx_tools.sleep", sleep),
+            patch("feedme.tools.onnx_tools.onnx_root", "http://onnx"),
+            patch(
+                "feedme.tools.onnx_tools.generate_txt2img",
+                lambda host, prompt, count, height, width: ("job", 10),
+            ),
+            patch("feedme.tools.onnx_tools.check_progress", check_progress),
+            patch(
+                "feedme.tools.onnx_tools.download_images",
+                lambda host, job, prefix: [f"{prefix}-{i}.png" for i in range(3)],
+            ),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+        ReadinessPoller.step_time = None
+
+    def test_batch_uses_total_steps(self):
+        results = generate_images("cats", 3, save_path="/tmp/images")
+        self.assertEqual(len(results), 3)
+
+        # 3 images of 10 steps each
+        self.assertEqual(set(self.checked_steps), {30})
+        self.assertAlmostEqual(ReadinessPoller.step_time, 1.0, delta=0.1)
+
+
+class TestGenerateBatches(unittest.TestCase):
+    def test_batches(self):
+        self.assertEqual(generate_batches(5, batch_size=2), [2, 2, 1])
+        self.assertEqual(generate_batches(4, batch_size=2), [2, 2])
+        self.assertEqual(generate_batches(1, batch_size=4), [1])
+        self.assertEqual(generate_batches(0, batch_size=2), [])
+
+
+class TestRunBatches(unittest.TestCase):
+    def test_results_in_order(self):
+        def generate(i, count):
+            # finish the later batches first
+            sleep(0.05 * (3 - i))
+            return [f"{i}-{j}" for j in range(count)]
+
+        self.assertEqual(
+            run_batches(generate, [2, 2, 1], inflight=3),
+            [["0-0", "0-1"], ["1-0", "1-1"], ["2-0"]],
+        )
+
+    def test_inflight(self):
+        lock = Lock()
+        running = [0]
+        most = [0]
+
+        def generate(i, count):
+            with lock:
+                running[0] += 1
+                most[0] = max(most[0], running[0])
+
+            sleep(0.05)
+            with lock:
+                running[0] -= 1
+
+            return [str(i)]
+
+        results = run_batches(generate, [1] * 6, inflight=2)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(most[0], 2)
+
+    def test_cancel(self):
+        cancel = Event()
+
+        def generate(i, count):
+            cancel.set()
+            return [str(i)]
+
+        results = run_batches(generate, [1, 1, 1], cancel=cancel, inflight=1)
+        self.assertEqual(results, [["0"], None, None])
+
+    def test_context(self):
+        batch_name.set("post")
+        results = run_batches(lambda i, count: [batch_name.get()], [1, 1])
+        self.assertEqual(results, [["post"], ["post"]])
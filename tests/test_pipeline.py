@@ -0,0 +1,113 @@
+import unittest
+from threading import Thread
+
+from feedme.utils.pipeline import Pipeline, StageQueue, run_stages
+
+
+class TestStageQueue(unittest.TestCase):
+    def test_order(self):
+        queue = StageQueue(depth=3)
+        queue.put(1)
+        queue.put(2)
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.get(), 1)
+        self.assertEqual(queue.get(), 2)
+
+    def test_returned_first(self):
+        queue = StageQueue(depth=3)
+        queue.put(1)
+        queue.put(2, returned=True)
+        self.assertEqual(queue.get(), 2)
+        self.assertEqual(queue.get(), 1)
+
+    def test_returned_not_bounded(self):
+        queue = StageQueue(depth=1)
+        queue.put(1)
+        queue.put(2, returned=True)
+        queue.put(3, returned=True)
+        self.assertEqual(len(queue), 3)
+
+    def test_put_blocks_when_full(self):
+        queue = StageQueue(depth=1)
+        queue.put(1)
+
+        thread = Thread(target=queue.put, args=(2,))
+        thread.start()
+        thread.join(timeout=0.1)
+        self.assertTrue(thread.is_alive())
+
+        self.assertEqual(queue.get(), 1)
+        thread.join(timeout=1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(queue.get(), 2)
+
+    def test_close(self):
+        queue = StageQueue(depth=1)
+        queue.put(1)
+        queue.close()
+        self.assertEqual(queue.get(), 1)
+        self.assertIsNone(queue.get())
+
+
+def make_stages(log):
+    """
+    Double each item, then send odd items back once before finishing them.
+    """
+
+    def double(item):
+        log.append(("double", item["value"]))
+        item["value"] *= 2
+        return "check"
+
+    def check(item):
+        log.append(("check", item["value"]))
+        if item["value"] % 4 != 0 and not item.get("retried"):
+            item["retried"] = True
+            return "double"
+
+        return None
+
+    return [("double", double), ("check", check)]
+
+
+class TestPipeline(unittest.TestCase):
+    def test_run(self):
+        log = []
+        items = [{"value": i} for i in range(1, 5)]
+        Pipeline(make_stages(log), depth=1).run(items)
+        self.assertEqual([item["value"] for item in items], [4, 4, 12, 8])
+        self.assertEqual(len(log), 12)
+
+    def test_failed_stage_drops_item(self):
+        def fail(item):
+            raise ValueError("failed")
+
+        finished = []
+        stages = [("fail", fail), ("finish", finished.append)]
+        with self.assertLogs("feedme.utils.pipeline", level="ERROR"):
+            Pipeline(stages).run([1, 2])
+
+        self.assertEqual(finished, [])
+
+    def test_unknown_stage_drops_item(self):
+        with self.assertLogs("feedme.utils.pipeline", level="ERROR") as logs:
+            Pipeline([("first", lambda item: "missing")]).run([1, 2])
+
+        self.assertEqual(len(logs.records), 2)
+
+    def test_run_stages(self):
+        log = []
+        items = [{"value": i} for i in range(1, 3)]
+        run_stages(make_stages(log), items)
+        self.assertEqual([item["value"] for item in items], [4, 4])
+        self.assertEqual(
+            log,
+            [
+                ("double", 1),
+                ("check", 2),
+                ("double", 2),
+                ("check", 4),
+                ("double", 2),
+                ("check", 4),
+            ],
+        )
@@ -0,0 +1,95 @@
+import unittest
+
+from feedme.utils.profile import (
+    Profile,
+    activate_profile,
+    current_stage,
+    percentile,
+    profile_stage,
+    profiled,
+    record_llm_call,
+)
+
+
+class TestPercentile(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(percentile([], 50), 0)
+
+    def test_single(self):
+        self.assertEqual(percentile([3.0], 50), 3.0)
+        self.assertEqual(percentile([3.0], 99), 3.0)
+
+    def test_nearest_rank(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 90), 5)
+        self.assertEqual(percentile(values, 100), 5)
+
+
+class TestProfile(unittest.TestCase):
+    def test_record(self):
+        profile = Profile("post")
+        profile.record_time("plan", 2.0)
+        profile.record_time("plan", 1.0, error=True)
+        profile.record_call("plan", 100, 20, cached=False)
+        profile.record_call("plan", 50, 10, cached=True)
+
+        stats = profile.to_dict()["stages"]["plan"]
+        self.assertEqual(stats["runs"], 2)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["time"], 3.0)
+        self.assertEqual(stats["llm_calls"], 2)
+        self.assertEqual(stats["cached_calls"], 1)
+        self.assertEqual(stats["prompt_chars"], 150)
+        self.assertEqual(stats["completion_chars"], 30)
+
+    def test_table(self):
+        profile = Profile("post")
+        profile.record_time("fast", 1.0)
+        profile.record_time("slow", 5.0)
+
+        profile.record_retry()
+        profile.record_retry()
+
+        lines = profile.table().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith("slow"))
+        self.assertTrue(lines[2].startswith("fast"))
+        self.assertEqual(lines[3].split(), ["retries", "2"])
+        self.assertEqual(profile.to_dict()["retries"], 2)
+
+    def test_profile_stage(self):
+        profile = Profile("post")
+        with activate_profile(profile):
+            with profile_stage("outer"):
+                self.assertEqual(current_stage.get(), "outer")
+                with profile_stage("inner"):
+                    record_llm_call("rate {theme}", "4", context={"theme": "cats"})
+
+                self.assertEqual(current_stage.get(), "outer")
+
+        self.assertIsNone(current_stage.get())
+        self.assertEqual(profile.stages["outer"].runs, 1)
+        self.assertEqual(profile.stages["inner"].llm_calls, 1)
+        self.assertEqual(profile.stages["inner"].prompt_chars, len("rate cats"))
+
+    def test_profile_stage_error(self):
+        profile = Profile("post")
+        with activate_profile(profile):
+            with self.assertRaises(ValueError):
+                with profile_stage("plan"):
+                    raise ValueError("failed")
+
+        self.assertEqual(profile.stages["plan"].errors, 1)
+
+    def test_profiled(self):
+        @profiled
+        def generate_ideas():
+            return current_stage.get()
+
+        profile = Profile("post")
+        with activate_profile(profile):
+            self.assertEqual(generate_ideas(), "generate_ideas")
+
+        self.assertEqual(profile.stages["generate_ideas"].runs, 1)
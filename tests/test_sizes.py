@@ -0,0 +1,60 @@
+import unittest
+from json import load
+from os import listdir, path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest.mock import patch
+
+from feedme.state.sizes import load_size_history, predict_size, save_size_choice
+
+
+class TestSizes(unittest.TestCase):
+    def setUp(self):
+        self.temp = TemporaryDirectory()
+        self.size_path = path.join(self.temp.name, "sizes.json")
+        self.patch = patch("feedme.state.sizes.size_path", self.size_path)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.temp.cleanup()
+
+    def test_empty(self):
+        self.assertEqual(load_size_history(), {})
+        self.assertEqual(predict_size(["cats"]), "landscape")
+        self.assertEqual(predict_size(["cats"], default="square"), "square")
+
+    def test_save(self):
+        save_size_choice(["cats", "dogs"], "portrait")
+        save_size_choice(["cats"], "square")
+        save_size_choice(["cats"], "square")
+
+        with open(self.size_path) as f:
+            self.assertEqual(
+                load(f),
+                {"cats": {"portrait": 1, "square": 2}, "dogs": {"portrait": 1}},
+            )
+
+        self.assertEqual(listdir(self.temp.name), ["sizes.json"])
+
+    def test_predict(self):
+        save_size_choice(["cats", "dogs"], "portrait")
+        save_size_choice(["cats"], "square")
+        save_size_choice(["birds"], "square")
+
+        self.assertEqual(predict_size(["dogs"]), "portrait")
+        self.assertEqual(predict_size(["cats", "dogs"]), "portrait")
+        self.assertEqual(predict_size(["cats", "birds"]), "square")
+
+    def test_concurrent_saves(self):
+        threads = [
+            Thread(target=save_size_choice, args=(["cats"], "square"))
+            for _ in range(20)
+        ]
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(load_size_history(), {"cats": {"square": 20}})